@@ -17,7 +17,7 @@ import collections
 
 from arl.data.data_models import Visibility, BlockVisibility, Skycomponent, Image
 from arl.visibility.iterators import vis_timeslice_iter
-from arl.visibility.operations import copy_visibility
+from arl.visibility.operations import create_derived_visibility
 from arl.fourier_transforms.ftprocessor_base import predict_skycomponent_blockvisibility, predict_2d, \
     predict_skycomponent_visibility, invert_2d, predict_2d
 from arl.visibility.coalesce import convert_blockvisibility_to_visibility, decoalesce_visibility
@@ -46,7 +46,7 @@ def calibrate_blockvisibility(bvt: BlockVisibility, model=None, components=None,
         if components is not None:
             bvtpred = predict_skycomponent_blockvisibility(bvtpred, components)
     else:
-        bvtpred = copy_visibility(bvt, zero=True)
+        bvtpred = create_derived_visibility(bvt, zero=True)
         bvtpred = predict_skycomponent_blockvisibility(bvtpred, components)
     
     gt = solve_gaintable(bvt, bvtpred, **kwargs)
@@ -64,7 +64,7 @@ def calibrate_visibility(vt: Visibility, model=None, components=None, predict=pr
     """
     assert model is not None or components is not None, "calibration requires a model or skycomponents"
     
-    vtpred = copy_visibility(vt, zero=True)
+    vtpred = create_derived_visibility(vt, zero=True)
     
     if model is not None:
         vtpred = predict(vtpred, model, **kwargs)
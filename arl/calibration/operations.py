@@ -3,9 +3,7 @@ merging gaintables.
 
 """
 
-import copy
-
-import numpy.linalg
+import numpy
 
 from arl.data.data_models import QA
 from arl.fourier_transforms.ftprocessor_params import *
@@ -74,6 +72,10 @@ def apply_gaintable(vis: BlockVisibility, gt: GainTable, inverse=False, **kwargs
     If the visibility data are polarised e.g. polarisation_frame("linear") then the inverse operator
     represents an actual inverse of the gains.
     
+    The gains are applied as 2x2 Jones matrices, V_applied = g_i V g_j^H, for all baselines and channels at once.
+    Diagonal (e.g. scalar) gains are applied as a scale factor for each polarisation. Singular gains are inverted
+    to zero.
+    
     :param vis: Visibility to have gains applied
     :param gt: Gaintable to be applied
     :param inverse: Apply the inverse (default=False)
@@ -88,6 +90,7 @@ def apply_gaintable(vis: BlockVisibility, gt: GainTable, inverse=False, **kwargs
     else:
         log.info('apply_gaintable: Apply gaintable')
     
+    antenna1, antenna2 = vis.baselines
     for chunk, rows in enumerate(vis_timeslice_iter(vis)):
         vistime = numpy.average(vis.time[rows])
         integration_time = numpy.average(vis.integration_time[rows])
@@ -99,22 +102,68 @@ def apply_gaintable(vis: BlockVisibility, gt: GainTable, inverse=False, **kwargs
         # The shape of the mueller matrix is
         ntimes, nant, nchan, nrec, _ = gain.shape
         
-        original = vis.vis[rows]
-        applied = copy.deepcopy(original)
-        for time in range(ntimes):
-            for a1 in range(vis.nants - 1):
-                for a2 in range(a1 + 1, vis.nants):
-                    for chan in range(nchan):
-                        mueller = numpy.kron(gain[time, a1, chan, :, :], numpy.conjugate(gain[time, a2, chan, :, :]))
-                        if inverse:
-                            mueller = numpy.linalg.inv(mueller)
-                        
-                        applied[time, a2, a1, chan, :] = numpy.matmul(mueller, original[time, a2, a1, chan, :])
+        original = vis.data.column('vis')[rows]
+        applied = numpy.array(original)
+        
+        # The baselines antenna1 < antenna2 in either layout, for all times and channels at once
+        if vis.compact:
+            blvis = original[:ntimes]
+        else:
+            blvis = original[:ntimes, antenna2, antenna1]
+        
+        # V_applied = g_1 V g_2^H as 2x2 matrices, equivalent to kron(g_1, conj(g_2)) applied to V as a vector
+        offdiagonal = [(rec1, rec2) for rec1 in range(nrec) for rec2 in range(nrec) if rec1 != rec2]
+        if all(numpy.all(gain[..., rec1, rec2] == 0.0) for rec1, rec2 in offdiagonal):
+            # Diagonal Jones matrices e.g. scalar gains: each polarisation is scaled
+            rec = numpy.arange(nrec)
+            diagonal = gain[..., rec, rec]
+            if inverse:
+                diagonal = invert_diagonal_jones(diagonal)
+            factor = diagonal[:, antenna1, :, :, numpy.newaxis] * \
+                numpy.conjugate(diagonal[:, antenna2, :, numpy.newaxis, :])
+            applied_blvis = blvis * factor.reshape(blvis.shape[:3] + (nrec * nrec,))
+        else:
+            if inverse:
+                gain = invert_jones(gain)
+            blvis = blvis.reshape(blvis.shape[:3] + (nrec, nrec))
+            applied_blvis = numpy.matmul(numpy.matmul(gain[:, antenna1], blvis),
+                                         numpy.conjugate(numpy.swapaxes(gain[:, antenna2], -1, -2)))
+            applied_blvis = applied_blvis.reshape(applied_blvis.shape[:3] + (nrec * nrec,))
+        
+        if vis.compact:
+            applied[:ntimes] = applied_blvis
+        else:
+            applied[:ntimes, antenna2, antenna1] = applied_blvis
         
         vis.data['vis'][rows] = applied
     return vis
 
 
+def invert_diagonal_jones(diagonal):
+    """Invert the diagonals of Jones matrices, zero where singular
+
+    :param diagonal: Diagonal elements [..., nrec]
+    :returns: Inverse diagonal elements [..., nrec]
+    """
+    mask = diagonal != 0.0
+    return numpy.where(mask, 1.0 / numpy.where(mask, diagonal, 1.0), 0.0)
+
+
+def invert_jones(jones):
+    """Invert 2x2 Jones matrices in closed form (adjugate / determinant), zero where singular
+
+    :param jones: Jones matrices [..., 2, 2]
+    :returns: Inverse matrices [..., 2, 2]
+    """
+    det = jones[..., 0, 0] * jones[..., 1, 1] - jones[..., 0, 1] * jones[..., 1, 0]
+    inverse = numpy.empty_like(jones)
+    inverse[..., 0, 0] = jones[..., 1, 1]
+    inverse[..., 0, 1] = -jones[..., 0, 1]
+    inverse[..., 1, 0] = -jones[..., 1, 0]
+    inverse[..., 1, 1] = jones[..., 0, 0]
+    return inverse * invert_diagonal_jones(det)[..., numpy.newaxis, numpy.newaxis]
+
+
 def append_gaintable(gt: GainTable, othergt: GainTable):
     """Append othergt to gt
 
@@ -15,7 +15,7 @@ For example::
 import numpy
 import logging
 
-from arl.data.data_models import GainTable, BlockVisibility, Skycomponent
+from arl.data.data_models import GainTable, BlockVisibility, Skycomponent, get_baselines
 from arl.visibility.iterators import vis_timeslice_iter
 from arl.calibration.operations import create_gaintable_from_blockvisibility
 
@@ -44,9 +44,12 @@ def solve_gaintable(vis: BlockVisibility, modelvis: BlockVisibility, phase_only=
     
     gt = create_gaintable_from_blockvisibility(vis)
     
+    # Square blocks, a copy if held in the compact layout
+    visvis, visweight, modelvisvis = vis.vis, vis.weight, modelvis.vis
+    
     for chunk, rows in enumerate(vis_timeslice_iter(vis)):
         
-        x, xwt = remove_model(vis.vis[rows], vis.weight[rows], modelvis.vis[rows],
+        x, xwt = remove_model(visvis[rows], visweight[rows], modelvisvis[rows],
                               isscalar=vis.polarisation_frame.npol == 1, crosspol=crosspol)
         
         # Now average over time, chan. The axes of x are time, antenna2, antenna1, chan, pol
@@ -60,16 +63,19 @@ def solve_gaintable(vis: BlockVisibility, modelvis: BlockVisibility, phase_only=
         gainshape = gt.data['gain'][chunk, ...].shape
         if vis.polarisation_frame.npol > 1:
             if crosspol:
-                gt.data['gain'][chunk, ...], gt.data['weight'][chunk, ...], gt.data['residual'][chunk, ...] = \
+                gt.data['gain'][chunk, ...], gt.data['weight'][chunk, ...], gt.data['residual'][chunk, ...], \
+                    gt.data['antenna_residual'][chunk, ...] = \
                     solve_antenna_gains_itsubs_matrix(gainshape, xave, xwtAve, phase_only=phase_only, niter=niter,
                                                       tol=tol)
             else:
-                gt.data['gain'][chunk, ...], gt.data['weight'][chunk, ...], gt.data['residual'][chunk, ...] = \
+                gt.data['gain'][chunk, ...], gt.data['weight'][chunk, ...], gt.data['residual'][chunk, ...], \
+                    gt.data['antenna_residual'][chunk, ...] = \
                     solve_antenna_gains_itsubs_vector(gainshape, xave, xwtAve, phase_only=phase_only, niter=niter,
                                                       tol=tol)
         
         else:
-            gt.data['gain'][chunk, ...], gt.data['weight'][chunk, ...], gt.data['residual'][chunk, ...] = \
+            gt.data['gain'][chunk, ...], gt.data['weight'][chunk, ...], gt.data['residual'][chunk, ...], \
+                gt.data['antenna_residual'][chunk, ...] = \
                 solve_antenna_gains_itsubs_scalar(gainshape, xave, xwtAve, phase_only=phase_only, niter=niter,
                                                   tol=tol)
     
@@ -79,7 +85,19 @@ def solve_gaintable(vis: BlockVisibility, modelvis: BlockVisibility, phase_only=
 
 
 def remove_model(vis, weight, modelvis, isscalar, crosspol):
-    # Form the point source equivalent visibility
+    """Form the point source equivalent visibility by dividing the observed by the model visibility
+    
+    In the vector/matrix case the model is a 2x2 coherency matrix, which is inverted in closed form for all
+    rows, baselines and channels at once. Where the model is singular the equivalent visibility and weight are zero.
+    
+    :param vis: Observed visibility [nrows, nants, nants, nchan, npol]
+    :param weight: Weight [nrows, nants, nants, nchan, npol]
+    :param modelvis: Model visibility [nrows, nants, nants, nchan, npol]
+    :param isscalar: Is the visibility scalar e.g. stokesI?
+    :param crosspol: Solve including the cross polarisations (not used)
+    :returns: x, xwt: point source equivalent visibility and weight [nrows, nants, nants, nchan, npol] (scalar)
+        or [nrows, nants, nants, nchan, 2, 2] (vector/matrix)
+    """
  
     # Different for scalar and vector/matrix cases
     
@@ -96,19 +114,50 @@ def remove_model(vis, weight, modelvis, isscalar, crosspol):
         xshape = (nrows, nants, nants, nchan, nrec, nrec)
         x = numpy.zeros(xshape, dtype='complex')
         xwt = numpy.zeros(xshape)
-        for row in range(nrows):
-            for ant1 in range(nants):
-                for ant2 in range(ant1+1, nants):
-                    for chan in range(nchan):
-                        ovis = numpy.matrix(vis[row, ant2, ant1, chan].reshape([2,2]))
-                        mvis = numpy.matrix(modelvis[row, ant2, ant1, chan].reshape([2,2]))
-                        wt = numpy.matrix(weight[row, ant2, ant1, chan].reshape([2,2]))
-                        x[row, ant2, ant1, chan] = numpy.matmul(numpy.linalg.inv(mvis), ovis)
-                        xwt[row, ant2, ant1, chan] = numpy.dot(mvis, numpy.multiply(wt, mvis.H)).real
+        
+        # Only the baselines antenna1 < antenna2, held at [antenna2, antenna1], are used
+        antenna1, antenna2 = get_baselines(nants)
+        blshape = (nrows, len(antenna1), nchan, nrec, nrec)
+        ovis = vis[:, antenna2, antenna1].reshape(blshape)
+        mvis = modelvis[:, antenna2, antenna1].reshape(blshape)
+        wt = weight[:, antenna2, antenna1].reshape(blshape)
+        
+        # Inverse = adjugate / determinant
+        det = mvis[..., 0, 0] * mvis[..., 1, 1] - mvis[..., 0, 1] * mvis[..., 1, 0]
+        mask = numpy.abs(det) > 0.0
+        det[~mask] = 1.0
+        minv = numpy.empty_like(mvis)
+        minv[..., 0, 0] = mvis[..., 1, 1]
+        minv[..., 0, 1] = -mvis[..., 0, 1]
+        minv[..., 1, 0] = -mvis[..., 1, 0]
+        minv[..., 1, 1] = mvis[..., 0, 0]
+        minv /= det[..., numpy.newaxis, numpy.newaxis]
+        
+        mask = mask[..., numpy.newaxis, numpy.newaxis]
+        x[:, antenna2, antenna1] = numpy.where(mask, numpy.matmul(minv, ovis), 0.0)
+        mvisH = numpy.conjugate(numpy.swapaxes(mvis, -1, -2))
+        xwt[:, antenna2, antenna1] = numpy.where(mask, numpy.matmul(mvis, wt * mvisH).real, 0.0)
                         
     return x, xwt
 
 
+def symmetrise_point_source(x, xwt):
+    """Make the point source equivalent visibility Hermitian in the antenna indices
+
+    x[antenna1, antenna2] = conj(x[antenna2, antenna1]) for antenna1 < antenna2, and the autocorrelations are zeroed.
+
+    :param x: Equivalent point source visibility[nants, nants, ...] (changed in place)
+    :param xwt: Equivalent point source weight [nants, nants, ...] (changed in place)
+    """
+    nants = x.shape[0]
+    antenna1, antenna2 = numpy.triu_indices(nants, 1)
+    x[antenna1, antenna2, ...] = numpy.conjugate(x[antenna2, antenna1, ...])
+    xwt[antenna1, antenna2, ...] = xwt[antenna2, antenna1, ...]
+    diagonal = numpy.arange(nants)
+    x[diagonal, diagonal, ...] = 0.0
+    xwt[diagonal, diagonal, ...] = 0.0
+
+
 def solve_antenna_gains_itsubs_scalar(gainshape, x, xwt, niter=30, tol=1e-8, phase_only=True, refant=0):
     """Solve for the antenna gains
 
@@ -124,16 +173,10 @@ def solve_antenna_gains_itsubs_scalar(gainshape, x, xwt, niter=30, tol=1e-8, pha
     :param tol: tolerance on solution change
     :param phase_only: Do solution for only the phase? (default True)
     :param refant: Reference antenna for phase (default=0.0)
-    :returns: gain [nants, ...], weight [nants, ...]
+    :returns: gain [nants, ...], weight [nants, ...], residual [...], residual for each antenna [nants, ...]
     """
     
-    nants = x.shape[0]
-    for ant1 in range(nants):
-        x[ant1, ant1, ...] = 0.0
-        xwt[ant1, ant1, ...] = 0.0
-        for ant2 in range(ant1 + 1, nants):
-            x[ant1, ant2, ...] = numpy.conjugate(x[ant2, ant1, ...])
-            xwt[ant1, ant2, ...] = xwt[ant2, ant1, ...]
+    symmetrise_point_source(x, xwt)
     
     gain = numpy.ones(shape=gainshape, dtype=x.dtype)
     gwt = numpy.zeros(shape=gainshape, dtype=xwt.dtype)
@@ -148,9 +191,9 @@ def solve_antenna_gains_itsubs_scalar(gainshape, x, xwt, niter=30, tol=1e-8, pha
         gain = 0.5 * (gain + gainLast)
         change = numpy.max(numpy.abs(gain - gainLast))
         if change < tol:
-            return gain, gwt, solution_residual_scalar(gain, x, xwt)
+            return (gain, gwt) + solution_residual_scalar(gain, x, xwt)
     
-    return gain, gwt, solution_residual_scalar(gain, x, xwt)
+    return (gain, gwt) + solution_residual_scalar(gain, x, xwt)
 
 
 def gain_substitution_scalar(gain, x, xwt):
@@ -163,20 +206,15 @@ def gain_substitution_scalar(gain, x, xwt):
     x = x.reshape(nants, nants, nchan, nrec, nrec)
     xwt = xwt.reshape(nants, nants, nchan, nrec, nrec)
     
-    for ant1 in range(nants):
-        for chan in range(nchan):
-            # Loop over e.g. 'RR', 'LL, or 'xx', 'YY' ignoring cross terms
-            top = numpy.sum(x[:, ant1, chan, 0, 0] \
-                            * gain[:, chan, 0, 0] * xwt[:, ant1, chan, 0, 0], axis=0)
-            bot = numpy.sum((gain[:, chan, 0, 0] * numpy.conjugate(gain[:, chan, 0, 0])
-                             * xwt[:, ant1, chan, 0, 0]).real, axis=0)
-            
-            if bot > 0.0:
-                newgain[ant1, chan, 0, 0] = top / bot
-                gwt[ant1, chan, 0, 0] = bot
-            else:
-                newgain[ant1, chan, 0, 0] = 0.0
-                gwt[ant1, chan, 0, 0] = 0.0
+    # Use e.g. 'RR', 'LL, or 'xx', 'YY' ignoring cross terms. The sums over antenna2 are for all antenna1 and
+    # channels at once
+    g = gain[..., 0, 0]
+    top = numpy.einsum('ijc,ic->jc', x[..., 0, 0] * xwt[..., 0, 0], g)
+    bot = numpy.einsum('ic,ijc->jc', (g * numpy.conjugate(g)).real, xwt[..., 0, 0])
+    
+    mask = bot > 0.0
+    newgain[..., 0, 0] = numpy.where(mask, top / numpy.where(mask, bot, 1.0), 0.0)
+    gwt[..., 0, 0] = numpy.where(mask, bot, 0.0)
     return newgain, gwt
 
 
@@ -198,16 +236,10 @@ def solve_antenna_gains_itsubs_vector(gainshape, x, xwt, niter=30, tol=1e-8, pha
     :param tol: tolerance on solution change
     :param phase_only: Do solution for only the phase? (default True)
     :param refant: Reference antenna for phase (default=0.0)
-    :returns: gain [nants, ...], weight [nants, ...]
+    :returns: gain [nants, ...], weight [nants, ...], residual [...], residual for each antenna [nants, ...]
     """
     
-    nants, _, nchan, nrec, _ = x.shape
-    for ant1 in range(nants):
-        x[ant1, ant1, ...] = 0.0
-        xwt[ant1, ant1, ...] = 0.0
-        for ant2 in range(ant1 + 1, nants):
-            x[ant1, ant2, ...] = numpy.conjugate(x[ant2, ant1, ...])
-            xwt[ant1, ant2, ...] = xwt[ant2, ant1, ...]
+    symmetrise_point_source(x, xwt)
     
     gain = numpy.ones(shape=gainshape, dtype=x.dtype)
     gain[..., 0, 1] = 0.0
@@ -225,9 +257,9 @@ def solve_antenna_gains_itsubs_vector(gainshape, x, xwt, niter=30, tol=1e-8, pha
         change = numpy.max(numpy.abs(gain - gainLast))
         gain = 0.5 * (gain + gainLast)
         if change < tol:
-            return gain, gwt, solution_residual_vector(gain, x, xwt)
+            return (gain, gwt) + solution_residual_vector(gain, x, xwt)
     
-    return gain, gwt, solution_residual_vector(gain, x, xwt)
+    return (gain, gwt) + solution_residual_vector(gain, x, xwt)
 
 
 def gain_substitution_vector(gain, x, xwt):
@@ -248,21 +280,17 @@ def gain_substitution_vector(gain, x, xwt):
         gain[..., 0, 1] = 0.0
         gain[..., 1, 0] = 0.0
     
-    for ant1 in range(nants):
-        for chan in range(nchan):
-            # Loop over e.g. 'RR', 'LL, or 'xx', 'YY' ignoring cross terms
-            for rec in range(nrec):
-                top = numpy.sum(x[:, ant1, chan, rec, rec] \
-                                * gain[:, chan, rec, rec] * xwt[:, ant1, chan, rec, rec], axis=0)
-                bot = numpy.sum((gain[:, chan, rec, rec] * numpy.conjugate(gain[:, chan, rec, rec])
-                                 * xwt[:, ant1, chan, rec, rec]).real, axis=0)
-                
-                if bot > 0.0:
-                    newgain[ant1, chan, rec, rec] = top / bot
-                    gwt[ant1, chan, rec, rec] = bot
-                else:
-                    newgain[ant1, chan, rec, rec] = 0.0
-                    gwt[ant1, chan, rec, rec] = 0.0
+    # Use e.g. 'RR', 'LL, or 'xx', 'YY' ignoring cross terms. The sums over antenna2 are for all antenna1,
+    # channels and receptors at once
+    rec = numpy.arange(nrec)
+    g = gain[..., rec, rec]
+    xwtdiag = xwt[..., rec, rec]
+    top = numpy.einsum('ijcr,icr->jcr', x[..., rec, rec] * xwtdiag, g)
+    bot = numpy.einsum('icr,ijcr->jcr', (g * numpy.conjugate(g)).real, xwtdiag)
+    
+    mask = bot > 0.0
+    newgain[..., rec, rec] = numpy.where(mask, top / numpy.where(mask, bot, 1.0), 0.0)
+    gwt[..., rec, rec] = numpy.where(mask, bot, 0.0)
     
     return newgain, gwt
 
@@ -285,17 +313,11 @@ def solve_antenna_gains_itsubs_matrix(gainshape, x, xwt, niter=30, tol=1e-8, pha
     :param tol: tolerance on solution change
     :param phase_only: Do solution for only the phase? (default True)
     :param refant: Reference antenna for phase (default=0.0)
-    :returns: gain [nants, ...], weight [nants, ...]
+    :returns: gain [nants, ...], weight [nants, ...], residual [...], residual for each antenna [nants, ...]
     """
     
-    nants, _, nchan, nrec, _ = x.shape
-    for ant1 in range(nants):
-        x[ant1, ant1, ...] = 0.0
-        xwt[ant1, ant1, ...] = 0.0
-        for ant2 in range(ant1 + 1, nants):
-            x[ant1, ant2, ...] = numpy.conjugate(x[ant2, ant1, ...])
-            xwt[ant1, ant2, ...] = xwt[ant2, ant1, ...]
-        
+    symmetrise_point_source(x, xwt)
+    
     gain = numpy.ones(shape=gainshape, dtype=x.dtype)
     gain[..., 0, 1] = 0.0
     gain[..., 1, 0] = 0.0
@@ -309,9 +331,9 @@ def solve_antenna_gains_itsubs_matrix(gainshape, x, xwt, niter=30, tol=1e-8, pha
         change = numpy.max(numpy.abs(gain - gainLast))
         gain = 0.5 * (gain + gainLast)
         if change < tol:
-            return gain, gwt, solution_residual_matrix(gain, x, xwt)
+            return (gain, gwt) + solution_residual_matrix(gain, x, xwt)
     
-    return gain, gwt, solution_residual_matrix(gain, x, xwt)
+    return (gain, gwt) + solution_residual_matrix(gain, x, xwt)
 
 
 def gain_substitution_matrix(gain, x, xwt):
@@ -324,122 +346,108 @@ def gain_substitution_matrix(gain, x, xwt):
     x = x.reshape(nants, nants, nchan, nrec, nrec)
     xwt = xwt.reshape(nants, nants, nchan, nrec, nrec)
     
-    # Write these loops out explicitly. Derivation of these vector equations is tedious but they are
-    # structurally identical to the scalar case with the following changes
+    # Derivation of these vector equations is tedious but they are structurally identical to the scalar case
+    # with the following changes
     # Vis -> 2x2 coherency vector, g-> 2x2 Jones matrix, *-> matmul, conjugate->Hermitean transpose (.H)
-    for ant1 in range(nants):
-        for chan in range(nchan):
-            top = 0.0
-            bot = 0.0
-            for ant2 in range(nants):
-                if ant1 != ant2:
-                    xmat = x[ant2, ant1, chan]
-                    xwtmat = xwt[ant2, ant1, chan]
-                    g2 = gain[ant2, chan]
-                    top += xmat * xwtmat * g2
-                    bot += numpy.conjugate(g2) * xwtmat * g2
-            newgain[ant1, chan][bot>0.0] = top[bot>0.0] / bot[bot>0.0]
-            newgain[ant1, chan][bot<=0.0] = 0.0
-            gwt[ant1, chan] = bot.real
+    # The sums over antenna2 != antenna1 are for all antenna1 and channels at once
+    xwt = xwt * (1.0 - numpy.eye(nants))[..., numpy.newaxis, numpy.newaxis, numpy.newaxis]
+    top = numpy.einsum('ijcab,icab->jcab', x * xwt, gain)
+    bot = numpy.einsum('icab,ijcab->jcab', (numpy.conjugate(gain) * gain).real, xwt)
+    
+    mask = bot > 0.0
+    newgain[...] = numpy.where(mask, top / numpy.where(mask, bot, 1.0), 0.0)
+    gwt[...] = bot
     return newgain, gwt
 
 
+def solution_chisq(gain, x, xwt):
+    """Calculate the weighted squared error of the gain solution for every pair of antennas in one pass
+
+    :param gain: gain [nant, nchan, nrec, nrec]
+    :param x: Point source equivalent visibility [nant, nant, ...]
+    :param xwt: Point source equivalent weight [nant, nant, ...]
+    :returns: chisq[nant, nant, nchan, nrec, nrec], weight[nant, nant, nchan, nrec, nrec]
+    """
+    nants, nchan, nrec, _ = gain.shape
+    x = x.reshape(nants, nants, nchan, nrec, nrec)
+    xwt = xwt.reshape(nants, nants, nchan, nrec, nrec)
+    
+    # error[ant2, ant1] = x[ant2, ant1] - gain[ant1] conj(gain[ant2])
+    error = x - numpy.conjugate(gain)[:, numpy.newaxis, ...] * gain[numpy.newaxis, ...]
+    return xwt * (error * numpy.conjugate(error)).real, xwt
+
+
+def normalise_chisq(chisq, sumwt):
+    """Convert a sum of weighted squared errors to an rms residual, zero where there is no weight
+
+    :param chisq: Sum of weighted squared errors
+    :param sumwt: Sum of weights
+    :returns: residual
+    """
+    chisq = numpy.asarray(chisq, dtype='float')
+    sumwt = numpy.asarray(sumwt, dtype='float')
+    mask = sumwt > 0.0
+    return numpy.where(mask, numpy.sqrt(numpy.abs(chisq) / numpy.where(mask, sumwt, 1.0)), 0.0)
+
+
 def solution_residual_scalar(gain, x, xwt):
     """Calculate residual across all baselines of gain for point source equivalent visibilities
-    
+
+    The residual is over all baselines and channels. The residual for each antenna is over the baselines of
+    that antenna.
+
     :param gain: gain [nant, ...]
     :param x: Point source equivalent visibility [nant, ...]
     :param xwt: Point source equivalent weight [nant, ...]
-    :returns: residual[...]
+    :returns: residual[...], residual for each antenna [nant, ...]
     """
     
     nants, nchan, nrec, _ = gain.shape
-    x = x.reshape(nants, nants, nchan, nrec, nrec)
+    chisq, xwt = solution_chisq(gain, x, xwt)
+    chisq, xwt = chisq[..., 0, 0], xwt[..., 0, 0]
     
-    xwt = xwt.reshape(nants, nants, nchan, nrec, nrec)
-    
-    residual = numpy.zeros([nchan, nrec, nrec])
-    sumwt = numpy.zeros([nchan, nrec, nrec])
-    
-    for ant1 in range(nants):
-        for ant2 in range(nants):
-            for chan in range(nchan):
-                error = x[ant2, ant1, chan, 0, 0] - \
-                        gain[ant1, chan, 0, 0] * numpy.conjugate(gain[ant2, chan, 0, 0])
-                residual += (error * xwt[ant2, ant1, chan, 0, 0] * numpy.conjugate(error)).real
-                sumwt += xwt[ant2, ant1, chan, 0, 0]
-    
-    residual = numpy.sqrt(residual / sumwt)
-    return residual
+    residual = numpy.full([nchan, nrec, nrec], normalise_chisq(numpy.sum(chisq), numpy.sum(xwt)))
+    antenna_residual = numpy.zeros([nants, nchan, nrec, nrec])
+    antenna_residual[..., 0, 0] = normalise_chisq(numpy.sum(chisq, axis=0), numpy.sum(xwt, axis=0))
+    return residual, antenna_residual
 
 
 def solution_residual_vector(gain, x, xwt):
     """Calculate residual across all baselines of gain for point source equivalent visibilities
     
-    Vector case i.e. off-diagonals of gains are zero
+    Vector case i.e. off-diagonals of gains are zero. The residual is over all baselines, channels and
+    receptors. The residual for each antenna is over the baselines of that antenna.
 
     :param gain: gain [nant, ...]
     :param x: Point source equivalent visibility [nant, ...]
     :param xwt: Point source equivalent weight [nant, ...]
-    :returns: residual[...]
+    :returns: residual[...], residual for each antenna [nant, ...]
     """
     
     nants, nchan, nrec, _ = gain.shape
-    x = x.reshape(nants, nants, nchan, nrec, nrec)
-    x[..., 1, 0] = 0.0
-    x[..., 0, 1] = 0.0
+    chisq, xwt = solution_chisq(gain, x, xwt)
+    rec = numpy.arange(nrec)
+    chisq, xwt = chisq[..., rec, rec], xwt[..., rec, rec]
     
-    xwt = xwt.reshape(nants, nants, nchan, nrec, nrec)
-    xwt[..., 1, 0] = 0.0
-    xwt[..., 0, 1] = 0.0
-    
-    residual = numpy.zeros([nchan, nrec, nrec])
-    sumwt = numpy.zeros([nchan, nrec, nrec])
-    
-    for ant1 in range(nants):
-        for ant2 in range(nants):
-            for chan in range(nchan):
-                for rec in range(nrec):
-                    error = x[ant2, ant1, chan, rec, rec] - \
-                            gain[ant1, chan, rec, rec] * numpy.conjugate(gain[ant2, chan, rec, rec])
-                    residual += (error * xwt[ant2, ant1, chan, rec, rec] * numpy.conjugate(error)).real
-                    sumwt += xwt[ant2, ant1, chan, rec, rec]
-    
-    residual = numpy.sqrt(residual / sumwt)
-    return residual
+    residual = numpy.full([nchan, nrec, nrec], normalise_chisq(numpy.sum(chisq), numpy.sum(xwt)))
+    antenna_residual = numpy.zeros([nants, nchan, nrec, nrec])
+    antenna_residual[..., rec, rec] = normalise_chisq(numpy.sum(chisq, axis=0), numpy.sum(xwt, axis=0))
+    return residual, antenna_residual
 
 
 def solution_residual_matrix(gain, x, xwt):
     """Calculate residual across all baselines of gain for point source equivalent visibilities
 
+    The residual is for each channel and pair of receptors. The residual for each antenna is over the baselines
+    of that antenna.
+
     :param gain: gain [nant, ...]
     :param x: Point source equivalent visibility [nant, ...]
     :param xwt: Point source equivalent weight [nant, ...]
-    :returns: residual[...]
+    :returns: residual[...], residual for each antenna [nant, ...]
     """
     
-    nants, nchan, nrec, _ = gain.shape
-    x = x.reshape(nants, nants, nchan, nrec, nrec)
-    xwt = xwt.reshape(nants, nants, nchan, nrec, nrec)
-    
-    residual = numpy.zeros([nchan, nrec, nrec])
-    sumwt = numpy.zeros([nchan, nrec, nrec])
-
-
-    # This is written out in long winded form but should be optimised for
-    # production code!
-    for ant1 in range(nants):
-        for ant2 in range(nants):
-            for chan in range(nchan):
-                for rec1 in range(nrec):
-                    for rec2 in range(nrec):
-                        error = x[ant2, ant1, chan, rec2, rec1] - \
-                                gain[ant1, chan, rec2, rec1] * numpy.conjugate(gain[ant2, chan, rec2, rec1])
-                        residual[chan, rec2, rec1] += (error * xwt[ant2, ant1, chan, rec2, rec1] * numpy.conjugate(
-                            error)).real
-                        sumwt[chan, rec2, rec1] += xwt[ant2, ant1, chan, rec2, rec1]
-
-    residual[sumwt>0.0] = numpy.sqrt(residual[sumwt>0.0] / sumwt[sumwt>0.0])
-    residual[sumwt <= 0.0] = 0.0
-    return residual
-
+    chisq, xwt = solution_chisq(gain, x, xwt)
+    residual = normalise_chisq(numpy.sum(chisq, axis=(0, 1)), numpy.sum(xwt, axis=(0, 1)))
+    antenna_residual = normalise_chisq(numpy.sum(chisq, axis=0), numpy.sum(xwt, axis=0))
+    return residual, antenna_residual
@@ -19,8 +19,11 @@ The principle transitions between the data models:
 
 """
 
+import collections
+import functools
 import logging
 import sys
+import weakref
 
 import numpy
 from astropy import units as u
@@ -96,12 +99,13 @@ class Configuration:
 class GainTable:
     """ Gain table with data: time, antenna, gain[:,chan,pol], weight columns
     
-    The weight is usually that output from gain solvers.
+    The weight is usually that output from gain solvers. The residual is that of the solution over all baselines,
+    and the antenna_residual that over the baselines of each antenna, e.g. for flagging.
     """
     
     def __init__(self, data=None, gain: numpy.array = None, time: numpy.array = None, weight: numpy.array = None,
                  residual: numpy.array = None, frequency: numpy.array = None,
-                 receptor_frame: ReceptorFrame = ReceptorFrame("linear")):
+                 receptor_frame: ReceptorFrame = ReceptorFrame("linear"), antenna_residual: numpy.array = None):
         """ Create a gaintable from arrays
         
         The definition of gain is:
@@ -112,6 +116,7 @@ class GainTable:
         :param time:
         :param weight:
         :param frequency:
+        :param antenna_residual: Residual of the solution for each antenna (default zero)
         :returns: Gaintable
         """
         if data is None and gain is not None:
@@ -123,12 +128,15 @@ class GainTable:
             desc = [('gain', '>c16', (nants, nchan, nrec, nrec)),
                     ('weight', '>f8', (nants, nchan, nrec, nrec)),
                     ('residual', '>f8', (nchan, nrec, nrec)),
+                    ('antenna_residual', '>f8', (nants, nchan, nrec, nrec)),
                     ('time', '>f8')]
             self.data = numpy.zeros(shape=[nrows], dtype=desc)
             self.data['gain'] = gain
             self.data['weight'] = weight
             self.data['time'] = time
             self.data['residual'] = residual
+            if antenna_residual is not None:
+                self.data['antenna_residual'] = antenna_residual
         self.frequency = frequency
         self.receptor_frame = receptor_frame
     
@@ -155,6 +163,10 @@ class GainTable:
     def residual(self):
         return self.data['residual']
     
+    @property
+    def antenna_residual(self):
+        return self.data['antenna_residual']
+    
     @property
     def nants(self):
         return self.data['gain'].shape[1]
@@ -286,11 +298,351 @@ class Skycomponent:
         return s
 
 
+class ColumnTable:
+    """ Table of named columns, each held as a separate contiguous native-endian array
+    
+    This is the storage for Visibility and BlockVisibility data. It supports the parts of the numpy structured
+    array interface used for those: table['uvw'] is the column array (so it can be updated in place), table[i] is a
+    row (see ColumnTableRow), table[rows] is a table of the selected rows, and len, shape and dtype are as for the
+    equivalent structured array. Keeping columns separate avoids the byte swapping and strided access of the
+    interleaved big-endian records used previously.
+    
+    A selection of rows (by slice, range, index array or boolean mask) is copy-on-write, and behaves as a copy for
+    all of these. It refers to the columns of the table it was taken from until a column is asked for with
+    table['uvw'], and only then is that column copied. If instead the table it was taken from asks for a column
+    that a selection still refers to, that table copies its column first. Writes to either therefore never show
+    in the other. Boolean masks are converted to index arrays, and to ranges if contiguous.
+    
+    table.column('uvw') gives a column for reading only, as used by the Visibility properties. For a selection of
+    a contiguous range of rows this is a view and so copies nothing. Columns are written through table['uvw'] or
+    a row. table.version('uvw') counts the times the column has been got for writing, replaced or appended to, so
+    that anything derived from a column can be checked as still valid.
+    
+    A column may have a single value per row where a value per e.g. polarisation is expected. Assigning values that
+    differ along that axis to the whole column, as table['weight'] = weight, then expands it.
+    
+    Use from_structured and to_structured to convert from and to the legacy structured array layout.
+    """
+    
+    def __init__(self, columns):
+        """ Create from an ordered list of (name, array) pairs, the first axis of each array being the rows
+        
+        :param columns: list of (name, array) or OrderedDict
+        """
+        self.columns = collections.OrderedDict()
+        for name, col in (columns.items() if isinstance(columns, dict) else columns):
+            col = numpy.asarray(col)
+            self.columns[name] = numpy.ascontiguousarray(col, dtype=col.dtype.newbyteorder('='))
+        self.names = list(self.columns.keys())
+        self.sources = {}  # Columns not yet copied: name: (array, rows of array, weak reference to its table)
+        self.views = weakref.WeakSet()  # Selections that may refer to the columns of this table
+        self.buffers = None  # Storage with spare rows for append, of which the columns are views
+        self.versions = collections.Counter()  # Number of times each column may have changed, see version
+        nrows = set(len(col) for col in self.columns.values())
+        assert len(nrows) <= 1, "Columns have different numbers of rows: %s" % nrows
+    
+    @classmethod
+    def zeros(cls, nrows, desc):
+        """ Create a table of zeros, as numpy.zeros(shape=[nrows], dtype=desc) for a structured array
+        
+        :param nrows: Number of rows
+        :param desc: list of (name, dtype) or (name, dtype, shape)
+        """
+        columns = []
+        for col in desc:
+            shape = [nrows] + list(col[2] if len(col) > 2 else [])
+            columns.append((col[0], numpy.zeros(shape, dtype=numpy.dtype(col[1]).newbyteorder('='))))
+        return cls(columns)
+    
+    @classmethod
+    def from_structured(cls, data):
+        """ Convert from the legacy structured array layout
+        
+        :param data: numpy structured array
+        """
+        return cls([(name, data[name]) for name in data.dtype.names])
+    
+    def to_structured(self):
+        """ Convert to the legacy (big-endian, interleaved) structured array layout
+        
+        :returns: numpy structured array
+        """
+        desc = [(name, self.dtype[name].base.newbyteorder('>'), self.dtype[name].shape) for name in self.names]
+        data = numpy.zeros(shape=[len(self)], dtype=desc)
+        for name in self.names:
+            data[name] = self.column(name)
+        return data
+    
+    @classmethod
+    def concatenate(cls, tables):
+        """ Concatenate the rows of tables with the same columns
+        
+        :param tables: list of ColumnTable
+        """
+        names = tables[0].names
+        for table in tables:
+            assert table.names == names, "Tables have different columns"
+        return cls([(name, numpy.concatenate([table.column(name) for table in tables])) for name in names])
+    
+    def append(self, other, growth=2.0):
+        """ Append the rows of another table with the same columns, in place
+        
+        The columns are held in buffers with spare rows, the capacity being multiplied by growth whenever it is
+        exceeded, so building a table by appending many small tables takes time linear in the total size. Arrays
+        obtained from the table before the append remain valid but do not include the new rows.
+        
+        :param other: ColumnTable
+        :param growth: Factor by which to increase the capacity when full
+        :returns: self
+        """
+        assert other.names == self.names, "Tables have different columns"
+        assert growth > 1.0, "Growth factor must be greater than 1"
+        for name in list(self.sources.keys()):
+            self._copy_column(name)
+        
+        nrows = len(self)
+        newrows = nrows + len(other)
+        if self.buffers is None or newrows > len(next(iter(self.buffers.values()))):
+            capacity = max(newrows, int(growth * nrows))
+            self.buffers = collections.OrderedDict()
+            for name in self.names:
+                col = self.columns[name]
+                self.buffers[name] = numpy.empty([capacity] + list(col.shape[1:]), dtype=col.dtype)
+                self.buffers[name][:nrows] = col
+        
+        for name in self.names:
+            self.buffers[name][nrows:newrows] = other.column(name)
+            self.columns[name] = self.buffers[name][:newrows]
+            self.versions[name] += 1
+        return self
+    
+    def set_column(self, name, col):
+        """ Replace a column by a new array
+        
+        In a copy-on-write selection this gives the selection its own column without copying the original.
+        
+        :param name: Column name
+        :param col: Array with the same number of rows as the table
+        """
+        assert name in self.names, "Unknown column %s" % name
+        col = numpy.asarray(col)
+        assert len(col) == len(self), "Column has %d rows, table has %d" % (len(col), len(self))
+        self.sources.pop(name, None)
+        self.columns[name] = numpy.ascontiguousarray(col, dtype=col.dtype.newbyteorder('='))
+        self.versions[name] += 1
+        # Any spare rows for append no longer hold this column
+        self.buffers = None
+    
+    def column(self, name):
+        """ Get a column for reading only
+        
+        For a copy-on-write selection of a contiguous range of rows this is a view of the original column.
+        
+        :param name: Column name
+        """
+        if name in self.columns:
+            col = self.columns[name]
+        else:
+            assert name in self.names, "Unknown column %s" % name
+            array, rows, _ = self.sources[name]
+            col = array[rows] if isinstance(rows, slice) else self._copy_column(name)
+        col = col.view()
+        col.flags.writeable = False
+        return col
+    
+    def version(self, name):
+        """ Get the number of times a column may have changed
+        
+        This is incremented whenever the column is got for writing with table['uvw'] (or written through a row),
+        replaced by set_column, or appended to.
+        
+        :param name: Column name
+        """
+        assert name in self.names, "Unknown column %s" % name
+        return self.versions[name]
+    
+    def _copy_column(self, name):
+        # Give this selection its own copy of a column
+        array, rows, _ = self.sources.pop(name)
+        col = array[rows]
+        if isinstance(rows, slice):
+            col = col.copy()
+        self.columns[name] = col
+        return col
+    
+    def _unshare_column(self, name):
+        # Copy a column before it is written if a selection still refers to it
+        col = self.columns[name]
+        for view in list(self.views):
+            if name in view.sources and numpy.may_share_memory(view.sources[name][0], col):
+                self.columns[name] = col.copy()
+                self.buffers = None
+                return
+    
+    def _normalise_rows(self, rows):
+        nrows = len(self)
+        if rows is Ellipsis:
+            return slice(0, nrows)
+        if isinstance(rows, slice):
+            start, stop, step = rows.indices(nrows)
+            if step == 1:
+                return slice(start, max(start, stop))
+            rows = range(start, stop, step)
+        rows = numpy.asarray(rows)
+        if rows.dtype == bool:
+            rows = numpy.flatnonzero(rows)
+        return self._contiguous_rows(rows)
+    
+    @staticmethod
+    def _contiguous_rows(rows):
+        # A slice if the index array is a contiguous range
+        if len(rows) > 0 and rows[-1] - rows[0] == len(rows) - 1 and numpy.all(numpy.diff(rows) == 1):
+            return slice(int(rows[0]), int(rows[-1]) + 1)
+        return rows
+    
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            if key in self.columns:
+                self._unshare_column(key)
+            else:
+                assert key in self.names, "Unknown column %s" % key
+                self._copy_column(key)
+            self.versions[key] += 1
+            return self.columns[key]
+        
+        if isinstance(key, (int, numpy.integer)):
+            if not -len(self) <= key < len(self):
+                raise IndexError("Row %d out of range for table of %d rows" % (key, len(self)))
+            return ColumnTableRow(self, int(key) % len(self))
+        
+        rows = self._normalise_rows(key)
+        table = ColumnTable([])
+        table.names = list(self.names)
+        for name in self.names:
+            if name in self.columns:
+                array, tablerows, ownerref = self.columns[name], rows, weakref.ref(self)
+            else:
+                # A selection of a selection refers to the original column
+                array, sourcerows, ownerref = self.sources[name]
+                if isinstance(sourcerows, slice) and isinstance(rows, slice):
+                    tablerows = slice(sourcerows.start + rows.start, sourcerows.start + rows.stop)
+                elif isinstance(sourcerows, slice):
+                    tablerows = sourcerows.start + rows
+                else:
+                    tablerows = self._contiguous_rows(sourcerows[rows])
+            table.sources[name] = (array, tablerows, ownerref)
+            owner = ownerref()
+            if owner is not None:
+                owner.views.add(table)
+        return table
+    
+    def __setitem__(self, key, value):
+        if isinstance(key, str):
+            col = self[key]
+            value = numpy.asarray(value)
+            if col.ndim > 1 and col.shape[-1] == 1 and value.ndim == col.ndim and value.shape[-1] > 1:
+                # A column with one value per row (e.g. weights for all polarisations) is expanded if needed
+                if numpy.all(value == value[..., 0:1]):
+                    col[...] = value[..., 0:1]
+                else:
+                    self.set_column(key, value.astype(col.dtype))
+            else:
+                col[...] = value
+        else:
+            for name in self.names:
+                self[name][key] = value.column(name) if isinstance(value, ColumnTable) else value[name]
+    
+    def __len__(self):
+        if len(self.columns) > 0:
+            return len(next(iter(self.columns.values())))
+        if len(self.sources) > 0:
+            rows = next(iter(self.sources.values()))[1]
+            if isinstance(rows, slice):
+                return rows.stop - rows.start
+            return len(rows)
+        return 0
+    
+    def __deepcopy__(self, memo):
+        # Copy only the selected rows, not the table they were selected from
+        return ColumnTable([(name, numpy.array(self.column(name))) for name in self.names])
+    
+    def __getstate__(self):
+        # Pickle only the selected rows, not the table they were selected from
+        state = self.__dict__.copy()
+        state['columns'] = collections.OrderedDict((name, self.column(name)) for name in self.names)
+        state['sources'] = {}
+        state['views'] = None
+        state['buffers'] = None
+        return state
+    
+    def __setstate__(self, state):
+        # The selections of a table are not pickled with it. Tables pickled before append have no buffers or
+        # versions.
+        state.setdefault('buffers', None)
+        state.setdefault('versions', collections.Counter())
+        state['sources'] = {}
+        state['views'] = weakref.WeakSet()
+        self.__dict__.update(state)
+    
+    @property
+    def shape(self):
+        return (len(self),)
+    
+    @property
+    def size(self):
+        return len(self)
+    
+    @property
+    def dtype(self):
+        desc = []
+        for name in self.names:
+            col = self.columns[name] if name in self.columns else self.sources[name][0]
+            desc.append((name, col.dtype, col.shape[1:]))
+        return numpy.dtype(desc)
+    
+    @property
+    def nbytes(self):
+        return len(self) * self.dtype.itemsize
+    
+    def __repr__(self):
+        return "ColumnTable(%d rows: %s)" % (len(self), ", ".join(self.names))
+
+
+class ColumnTableRow:
+    """ A row of a ColumnTable, as given by table[i]
+    
+    As for a record of a structured array, row['vis'] is the value of the column in this row, and row['vis'] = value
+    sets it in the table. The value read is not writable, so the whole field must be assigned.
+    """
+    
+    def __init__(self, table, row):
+        """
+        
+        :param table: ColumnTable
+        :param row: Row number
+        """
+        self.table = table
+        self.row = row
+    
+    def __getitem__(self, name):
+        return self.table.column(name)[self.row]
+    
+    def __setitem__(self, name, value):
+        self.table[name][self.row] = value
+    
+    @property
+    def dtype(self):
+        return self.table.dtype
+    
+    def __repr__(self):
+        return "ColumnTableRow(%d of %r)" % (self.row, self.table)
+
+
 class Visibility:
     """ Visibility table class
 
     Visibility with uvw, time, integration_time, frequency, channel_bandwidth, a1, a2, vis, weight Columns in
-    a numpy structured array, The fundemental unit is a complex vector of polarisation.
+    a ColumnTable, The fundemental unit is a complex vector of polarisation.
     
     Visibility is defined to hold an observation with one direction.
     Polarisation frame is the same for the entire data set and can be stokes, circular, linear
@@ -300,14 +652,20 @@ class Visibility:
     row in the original block visibility that this row has a value for. The original blockvisibility
     is also preserves as n attribute so that decoalescence is expedited. If you don't need that then
     the storage can be released by setting self.blockvis to None
+    
+    To save memory the vis, weight and imaging_weight columns can be held in single precision (precision='single'),
+    and the weights with one value per row rather than per polarisation if they are the same for all
+    polarisations (weight_per_row=True). The weight and imaging_weight properties always have a value for each
+    polarisation.
     """
     
     def __init__(self,
                  data=None, frequency=None, channel_bandwidth=None, phasecentre=None, configuration=None,
                  uvw=None, time=None, antenna1=None, antenna2=None, vis=None, weight=None, imaging_weight=None,
                  integration_time=None, polarisation_frame=PolarisationFrame('stokesI'), cindex=None,
-                 blockvis=None):
+                 blockvis=None, precision='double', weight_per_row=False):
         if data is None and vis is not None:
+            assert precision in ['single', 'double'], "Unknown precision %s" % precision
             if imaging_weight is None:
                 imaging_weight = weight
             nvis = vis.shape[0]
@@ -318,17 +676,26 @@ class Visibility:
             assert len(antenna2) == nvis
 
             npol = polarisation_frame.npol
-            desc = [('uvw', '>f8', (3,)),
-                    ('time', '>f8'),
-                    ('frequency', '>f8'),
-                    ('channel_bandwidth', '>f8'),
-                    ('integration_time', '>f8'),
-                    ('antenna1', '>i8'),
-                    ('antenna2', '>i8'),
-                    ('vis', '>c16', (npol,)),
-                    ('weight', '>f8', (npol,)),
-                    ('imaging_weight', '>f8', (npol,))]
-            data = numpy.zeros(shape=[nvis], dtype=desc)
+            nweight = npol
+            if weight_per_row:
+                weight = numpy.broadcast_to(weight, [nvis, npol])
+                imaging_weight = numpy.broadcast_to(imaging_weight, [nvis, npol])
+                if numpy.all(weight == weight[:, 0:1]) and numpy.all(imaging_weight == imaging_weight[:, 0:1]):
+                    nweight = 1
+                    weight = weight[:, 0:1]
+                    imaging_weight = imaging_weight[:, 0:1]
+            vis_dtype, weight_dtype = ('c8', 'f4') if precision == 'single' else ('c16', 'f8')
+            desc = [('uvw', 'f8', (3,)),
+                    ('time', 'f8'),
+                    ('frequency', 'f8'),
+                    ('channel_bandwidth', 'f8'),
+                    ('integration_time', 'f8'),
+                    ('antenna1', 'i8'),
+                    ('antenna2', 'i8'),
+                    ('vis', vis_dtype, (npol,)),
+                    ('weight', weight_dtype, (nweight,)),
+                    ('imaging_weight', weight_dtype, (nweight,))]
+            data = ColumnTable.zeros(nvis, desc)
             data['uvw'] = uvw
             data['time'] = time
             data['frequency'] = frequency
@@ -340,84 +707,120 @@ class Visibility:
             data['weight'] = weight
             data['imaging_weight'] = imaging_weight
         
-        self.data = data  # numpy structured array
+        if isinstance(data, numpy.ndarray):
+            data = ColumnTable.from_structured(data)
+        
+        self.data = data  # ColumnTable
         self.cindex = cindex
         self.blockvis = blockvis
         self.phasecentre = phasecentre  # Phase centre of observation
         self.configuration = configuration  # Antenna/station configuration
         self.polarisation_frame = polarisation_frame
+        self.frequency_map_cache = None  # See arl.fourier_transforms.ftprocessor_params.get_channel_map
+        self.row_index = None  # See arl.visibility.iterators.create_row_index
+    
+    def __getstate__(self):
+        # The cache and index hold a weak reference which cannot be pickled
+        state = self.__dict__.copy()
+        state['frequency_map_cache'] = None
+        state['row_index'] = None
+        return state
+    
+    def __setstate__(self, state):
+        # Visibilities pickled before the change to ColumnTable hold a structured array
+        if isinstance(state.get('data'), numpy.ndarray):
+            state['data'] = ColumnTable.from_structured(state['data'])
+        state.setdefault('frequency_map_cache', None)
+        state.setdefault('row_index', None)
+        self.__dict__.update(state)
     
     def size(self):
         """ Return size in GB
         """
         size = 0
         for col in self.data.dtype.fields.keys():
-            size += self.data[col].nbytes
+            size += self.data.column(col).nbytes
         return size / 1024.0 / 1024.0 / 1024.0
 
     @property
     def nvis(self):
-        return self.data['vis'].shape[0]
+        return self.data.column('vis').shape[0]
 
     @property
     def uvw(self):  # In wavelengths in Visibility
-        return self.data['uvw']
+        return self.data.column('uvw')
     
     @property
     def u(self):
-        return self.data['uvw'][:, 0]
+        return self.data.column('uvw')[:, 0]
     
     @property
     def v(self):
-        return self.data['uvw'][:, 1]
+        return self.data.column('uvw')[:, 1]
     
     @property
     def w(self):
-        return self.data['uvw'][:, 2]
+        return self.data.column('uvw')[:, 2]
     
     @property
     def time(self):
-        return self.data['time']
+        return self.data.column('time')
     
     @property
     def integration_time(self):
-        return self.data['integration_time']
+        return self.data.column('integration_time')
     
     @property
     def frequency(self):
-        return self.data['frequency']
+        return self.data.column('frequency')
     
     @property
     def channel_bandwidth(self):
-        return self.data['channel_bandwidth']
+        return self.data.column('channel_bandwidth')
     
     @property
     def antenna1(self):
-        return self.data['antenna1']
+        return self.data.column('antenna1')
     
     @property
     def antenna2(self):
-        return self.data['antenna2']
+        return self.data.column('antenna2')
     
     @property
     def vis(self):
-        return self.data['vis']
+        return self.data.column('vis')
+    
+    @property
+    def npol(self):
+        return self.data.column('vis').shape[1]
     
     @property
     def weight(self):
-        return self.data['weight']
+        return self._per_polarisation('weight')
     
     @property
     def imaging_weight(self):
-        return self.data['imaging_weight']
+        return self._per_polarisation('imaging_weight')
+    
+    def _per_polarisation(self, name):
+        # Weights held per row are broadcast to all polarisations
+        col = self.data.column(name)
+        if col.shape[1] == self.npol:
+            return col
+        return numpy.broadcast_to(col, [len(col), self.npol])
 
 
 class BlockVisibility:
     """ Block Visibility table class
     
     Visibility with uvw, time, integration_time, frequency, channel_bandwidth, pol, a1, a2, vis, weight Columns in
-    a numpy structured array
+    a ColumnTable
     Visibility is defined to hold an observation with one direction.
+    The vis, weight, and uvw are held either as square blocks [ntimes, nants, nants, ...], with the data for
+    antenna1 < antenna2 at [:, antenna2, antenna1], or in the compact layout [ntimes, nbaselines, ...] with one
+    entry per baseline antenna1 < antenna2 (see baselines). The compact layout needs less than half the memory.
+    The properties vis, weight, and uvw always give the square blocks, and blvis, blweight, and bluvw the
+    baseline-indexed form. Each is a view of the data if held in that layout, and a copy otherwise.
     Polarisation frame is the same for the entire data set and can be stokes, circular, linear
     The configuration is also an attribute
     """
@@ -430,80 +833,157 @@ class BlockVisibility:
         if data is None and vis is not None:
             ntimes = vis.shape[0]
             assert vis.shape == weight.shape
-            nants = vis.shape[1]
-            assert vis.shape[2] == nants
-            nchan = vis.shape[3]
-            npol = vis.shape[4]
-            desc = [('uvw', '>f8', (nants, nants, 3)),
-                    ('time', '>f8'),
-                    ('integration_time', '>f8'),
-                    ('vis', '>c16', (nants, nants, nchan, npol)),
-                    ('weight', '>f8', (nants, nants, nchan, npol))]
-            data = numpy.zeros(shape=[ntimes], dtype=desc)
+            if vis.ndim == 5:
+                nants = vis.shape[1]
+                assert vis.shape[2] == nants
+            else:
+                assert vis.ndim == 4, "vis must have shape [ntimes, nants, nants, nchan, npol] or " \
+                                      "[ntimes, nbaselines, nchan, npol]"
+            blockshape = vis.shape[1:-2]
+            nchan, npol = vis.shape[-2:]
+            desc = [('uvw', 'f8', blockshape + (3,)),
+                    ('time', 'f8'),
+                    ('integration_time', 'f8'),
+                    ('vis', 'c16', blockshape + (nchan, npol)),
+                    ('weight', 'f8', blockshape + (nchan, npol))]
+            data = ColumnTable.zeros(ntimes, desc)
             data['uvw'] = uvw
             data['time'] = time
             data['integration_time'] = integration_time
             data['vis'] = vis
             data['weight'] = weight
         
-        self.data = data  # numpy structured array
+        if isinstance(data, numpy.ndarray):
+            data = ColumnTable.from_structured(data)
+        
+        self.data = data  # ColumnTable
         self.frequency = frequency
         self.channel_bandwidth = channel_bandwidth
         self.phasecentre = phasecentre  # Phase centre of observation
         self.configuration = configuration  # Antenna/station configuration
         self.polarisation_frame = polarisation_frame
+        self.coalescence_cache = None  # See arl.visibility.coalesce.get_coalescence_plan
+        self.row_index = None  # See arl.visibility.iterators.create_row_index
+    
+    def __getstate__(self):
+        # The cache and index hold a weak reference which cannot be pickled
+        state = self.__dict__.copy()
+        state['coalescence_cache'] = None
+        state['row_index'] = None
+        return state
+    
+    def __setstate__(self, state):
+        # BlockVisibilities pickled before the change to ColumnTable hold a structured array
+        if isinstance(state.get('data'), numpy.ndarray):
+            state['data'] = ColumnTable.from_structured(state['data'])
+        state.setdefault('coalescence_cache', None)
+        state.setdefault('row_index', None)
+        self.__dict__.update(state)
     
     def size(self):
         """ Return size in GB
         """
         size = 0
         for col in self.data.dtype.fields.keys():
-            size += self.data[col].nbytes
+            size += self.data.column(col).nbytes
         return size / 1024.0 / 1024.0 / 1024.0
     
     @property
     def nchan(self):
-        return self.data['vis'].shape[3]
+        return self.data.column('vis').shape[-2]
     
     @property
     def npol(self):
-        return self.data['vis'].shape[4]
+        return self.data.column('vis').shape[-1]
+    
+    @property
+    def compact(self):
+        return self.data.column('vis').ndim == 4
     
     @property
     def nants(self):
-        return self.data['vis'].shape[1]
+        if self.compact:
+            return int(round((1 + numpy.sqrt(1 + 8 * self.nbaselines)) / 2))
+        return self.data.column('vis').shape[1]
+    
+    @property
+    def nbaselines(self):
+        if self.compact:
+            return self.data.column('vis').shape[1]
+        return self.nants * (self.nants - 1) // 2
+    
+    @property
+    def baselines(self):
+        """ Antenna indices (antenna1, antenna2) of the baselines in the compact layout, antenna1 < antenna2
+        """
+        return get_baselines(self.nants)
+    
+    def _square(self, name):
+        col = self.data.column(name)
+        if not self.compact:
+            return col
+        antenna1, antenna2 = self.baselines
+        square = numpy.zeros((col.shape[0], self.nants, self.nants) + col.shape[2:], dtype=col.dtype)
+        square[:, antenna2, antenna1] = col
+        # The other half is as for the reversed baseline, which has the cross polarisations swapped
+        if name == 'uvw':
+            square[:, antenna1, antenna2] = -col
+        else:
+            if self.polarisation_frame.type in ['linear', 'circular']:
+                col = col[..., [0, 2, 1, 3]]
+            square[:, antenna1, antenna2] = numpy.conjugate(col) if name == 'vis' else col
+        return square
+    
+    def _baseline(self, name):
+        col = self.data.column(name)
+        if self.compact:
+            return col
+        antenna1, antenna2 = self.baselines
+        return col[:, antenna2, antenna1]
     
     @property
     def uvw(self):  # In wavelengths meters
-        return self.data['uvw']
+        return self._square('uvw')
     
     @property
     def u(self):
-        return self.data['uvw'][:, 0]
+        return self.data.column('uvw')[:, 0]
     
     @property
     def v(self):
-        return self.data['uvw'][:, 1]
+        return self.data.column('uvw')[:, 1]
     
     @property
     def w(self):
-        return self.data['uvw'][:, 2]
+        return self.data.column('uvw')[:, 2]
     
     @property
     def vis(self):
-        return self.data['vis']
+        return self._square('vis')
     
     @property
     def weight(self):
-        return self.data['weight']
+        return self._square('weight')
+    
+    @property
+    def bluvw(self):
+        return self._baseline('uvw')
+    
+    @property
+    def blvis(self):
+        return self._baseline('vis')
+    
+    @property
+    def blweight(self):
+        return self._baseline('weight')
     
     @property
     def time(self):
-        return self.data['time']
+        return self.data.column('time')
     
     @property
     def integration_time(self):
-        return self.data['integration_time']
+        return self.data.column('integration_time')
     
     @property
     def nvis(self):
@@ -533,6 +1013,21 @@ class QA:
         return s
 
 
+@functools.lru_cache(maxsize=16)
+def get_baselines(nants):
+    """ Get the antenna indices (antenna1, antenna2) of all baselines antenna1 < antenna2
+    
+    The order is that of numpy.triu_indices(nants, 1). The arrays are shared and so are read-only.
+    
+    :param nants: Number of antennas
+    :returns: antenna1, antenna2
+    """
+    antenna1, antenna2 = numpy.triu_indices(nants, 1)
+    antenna1.flags.writeable = False
+    antenna2.flags.writeable = False
+    return antenna1, antenna2
+
+
 def assert_same_chan_pol(o1, o2):
     """
     Assert that two entities indexed over channels and polarisations
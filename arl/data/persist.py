@@ -1,7 +1,13 @@
 """
 Persist objects on disk
 """
+import copy
+import os
+
 import cloudpickle
+import numpy
+
+from arl.data.data_models import ColumnTable
 
 
 def arl_dump(obj, name: str):
@@ -13,4 +19,44 @@ def arl_dump(obj, name: str):
 def arl_load(name: str):
     """Load an object from a pre-existing pickle
     """
-    return cloudpickle.load(open(name, 'rb'))
\ No newline at end of file
+    return cloudpickle.load(open(name, 'rb'))
+
+
+def arl_dump_visibility(vis, directory: str):
+    """Save a Visibility or BlockVisibility to a dataset directory for use with arl_load_visibility
+
+    Each column of the data is saved as a separate .npy file, and everything else is pickled.
+
+    :param vis: Visibility or BlockVisibility
+    :param directory: Dataset directory, created if necessary
+    """
+    os.makedirs(directory, exist_ok=True)
+    names = vis.data.names
+    for name in names:
+        numpy.save(os.path.join(directory, '%s.npy' % name), vis.data.column(name))
+    meta = copy.copy(vis)
+    meta.data = None
+    arl_dump({'vis': meta, 'columns': names}, os.path.join(directory, 'visibility.pkl'))
+
+
+def arl_load_visibility(directory: str, mode='c'):
+    """Load a Visibility or BlockVisibility from a dataset directory, memory mapping the columns
+
+    The data are read from disk only as they are used, so the dataset can be larger than memory. Selections
+    of rows e.g. by create_visibility_from_rows via the visibility iterators refer to the memory mapped
+    columns until written, so processing by timeslice or w slice reads only the part of the dataset in
+    each slice.
+
+    With mode 'c' (the default) writes to the data are kept in memory and the dataset is not changed; with
+    'r+' they are written to the dataset; with 'r' the data are read-only.
+
+    :param directory: Dataset directory written by arl_dump_visibility
+    :param mode: Memory mapping mode: 'r', 'r+' or 'c'
+    :returns: Visibility or BlockVisibility
+    """
+    assert mode in ['r', 'r+', 'c'], "Unknown memory mapping mode %s" % mode
+    saved = arl_load(os.path.join(directory, 'visibility.pkl'))
+    vis = saved['vis']
+    vis.data = ColumnTable([(name, numpy.load(os.path.join(directory, '%s.npy' % name), mmap_mode=mode))
+                            for name in saved['columns']])
+    return vis
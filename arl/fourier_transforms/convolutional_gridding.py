@@ -254,7 +254,7 @@ def frac_coord(npixel, kernel_oversampling, p):
     return flx.astype(int), fracx.astype(int)
 
 
-def convolutional_degrid(kernels, vshape, uvgrid, vuvwmap, vfrequencymap, vpolarisationmap):
+def convolutional_degrid(kernels, vshape, uvgrid, vuvwmap, vfrequencymap, vpolarisationmap, vphasor=None):
     """Convolutional degridding with frequency and polarisation independent
 
     Takes into account fractional `uv` coordinate values where the GCF
@@ -266,6 +266,7 @@ def convolutional_degrid(kernels, vshape, uvgrid, vuvwmap, vfrequencymap, vpolar
     :param vuvwmap: function to map uvw to grid fractions
     :param vfrequencymap: function to map frequency to image channels
     :param vpolarisationmap: function to map polarisation to image polarisation
+    :param vphasor: Optional phasor per visibility to multiply the degridded values by e.g. a phase shift
     :returns: Array of visibilities.
     """
     kernels = list(kernels)
@@ -322,6 +323,8 @@ def convolutional_degrid(kernels, vshape, uvgrid, vuvwmap, vfrequencymap, vpolar
 
     vis[numpy.where(wt > 0)] = vis[numpy.where(wt > 0)] / wt[numpy.where(wt > 0)]
     vis[numpy.where(wt < 0)] = 0.0
+    if vphasor is not None:
+        vis *= vphasor[:, numpy.newaxis]
     return numpy.array(vis)
 
 def gridder(uvgrid, vis, xs, ys, kernel=numpy.ones((1,1)), kernel_ixs=None):
@@ -352,7 +355,7 @@ def gridder(uvgrid, vis, xs, ys, kernel=numpy.ones((1,1)), kernel_ixs=None):
         uvgrid[y:y+gh, x:x+gw] += kernel[tuple(kern_ix)] * v
 
 
-def convolutional_grid(kernels, uvgrid, vis, visweights, vuvwmap, vfrequencymap, vpolarisationmap):
+def convolutional_grid(kernels, uvgrid, vis, visweights, vuvwmap, vfrequencymap, vpolarisationmap, vphasor=None):
     """Grid after convolving with frequency and polarisation independent gcf
 
     Takes into account fractional `uv` coordinate values where the GCF
@@ -365,6 +368,8 @@ def convolutional_grid(kernels, uvgrid, vis, visweights, vuvwmap, vfrequencymap,
     :param vuvwmap: map uvw to grid fractions
     :param vfrequencymap: map frequency to image channels
     :param vpolarisationmap: map polarisation to image polarisation
+    :param vphasor: Optional phasor per visibility, the conjugate of which is applied while weighting (the inverse
+        of vphasor in convolutional_degrid)
     :returns: uv grid[nchan, npol, ny, nx], sumwt[nchan, npol]
     """
     
@@ -397,6 +402,8 @@ def convolutional_grid(kernels, uvgrid, vis, visweights, vuvwmap, vfrequencymap,
     # Now we can loop over all rows
     wts = visweights[...]
     viswt = vis[...] * visweights[...]
+    if vphasor is not None:
+        viswt *= numpy.conjugate(vphasor)[:, numpy.newaxis]
     
     npol = vis.shape[-1]
     
@@ -20,10 +20,12 @@ extra phase term in the Fourier transform cannot be ignored.
 """
 
 import collections
+from multiprocessing.pool import ThreadPool
 
 from astropy import constants
 from astropy import units as units
 from astropy import wcs
+from astropy.coordinates import UnitSphericalRepresentation
 from astropy.wcs.utils import pixel_to_skycoord
 
 from arl.data.data_models import *
@@ -37,19 +39,20 @@ from arl.fourier_transforms.ftprocessor_params import get_frequency_map, \
 from arl.image.iterators import *
 from arl.image.operations import copy_image
 from arl.util.coordinate_support import simulate_point, skycoord_to_lmn
-from arl.visibility.operations import phaserotate_visibility, copy_visibility
+from arl.visibility.operations import phaserotate_visibility, copy_visibility, create_derived_visibility
 from arl.visibility.coalesce import coalesce_visibility, decoalesce_visibility
 
 log = logging.getLogger(__name__)
 
 
-def shift_vis_to_image(vis, im, tangent=True, inverse=False):
-    """Shift visibility to the FFT phase centre of the image in place
+def shift_vis_to_image(vis, im, tangent=True, inverse=False, inplace=False):
+    """Shift visibility to the FFT phase centre of the image
 
     :param vis: Visibility data
     :param im: Image model used to determine phase centre
     :param tangent: Is the shift purely on the tangent plane True|False
     :param inverse: Do the inverse operation True|False
+    :param inplace: Shift vis itself rather than a copy True|False
     :returns: visibility with phase shift applied and phasecentre updated
 
     """
@@ -70,7 +73,7 @@ def shift_vis_to_image(vis, im, tangent=True, inverse=False):
         else:
             log.debug("shift_vis_from_image: shifting phasecentre from vis phasecentre %s to image phasecentre %s" %
                       (vis.phasecentre, image_phasecentre))
-        vis = phaserotate_visibility(vis, image_phasecentre, tangent=tangent, inverse=inverse)
+        vis = phaserotate_visibility(vis, image_phasecentre, tangent=tangent, inverse=inverse, inplace=inplace)
         vis.phasecentre = im.phasecentre
     
     assert type(vis) is Visibility, "after phase_rotation, vis is not a Visibility"
@@ -78,6 +81,35 @@ def shift_vis_to_image(vis, im, tangent=True, inverse=False):
     return vis
 
 
+def calculate_image_phasor(vis, im, uvw=None):
+    """Calculate the phasor that shifts the visibility to the FFT phase centre of the image
+
+    The shift stays on the tangent plane so the uvw are unchanged and only the vis column is affected. The phasor
+    is applied on the fly by convolutional_grid and convolutional_degrid so the visibility itself is not changed
+    and one Visibility can be shared read-only by many images e.g. facets.
+
+    :param vis: Visibility data, or BlockVisibility if uvw is given
+    :param im: Image model used to determine phase centre
+    :param uvw: uvw in wavelengths (default vis.uvw)
+    :returns: phasor[nvis] (multiply by the conjugate to shift to the image), or None if no shift is needed
+    """
+    if uvw is None:
+        assert type(vis) is Visibility, "vis is not a Visibility: %r" % vis
+        uvw = vis.uvw
+    
+    nchan, npol, ny, nx = im.data.shape
+    image_phasecentre = pixel_to_skycoord(nx // 2, ny // 2, im.wcs, origin=1)
+    
+    if vis.phasecentre.separation(image_phasecentre).rad > 1e-15:
+        l, m, n = skycoord_to_lmn(image_phasecentre, vis.phasecentre)
+        if numpy.abs(l) > 1e-15 or numpy.abs(m) > 1e-15:
+            log.debug("calculate_image_phasor: shifting between vis phasecentre %s and image phasecentre %s" %
+                      (vis.phasecentre, image_phasecentre))
+            return simulate_point(uvw, l, m)
+    
+    return None
+
+
 def normalize_sumwt(im: Image, sumwt):
     """Normalize out the sum of weights
 
@@ -93,23 +125,131 @@ def normalize_sumwt(im: Image, sumwt):
     return im
 
 
+def use_block_gridding(vis, **kwargs):
+    """ Can the vis be gridded and degridded in the block layout, without conversion to Visibility?
+
+    This is so for a BlockVisibility with no coalescence and the standard (not w projection) kernel.
+
+    :param vis: Visibility or BlockVisibility
+    :returns: True or False
+    """
+    return type(vis) is BlockVisibility and get_parameter(kwargs, 'time_coal', 0.0) == 0.0 and \
+        get_parameter(kwargs, 'frequency_coal', 0.0) == 0.0 and get_parameter(kwargs, 'kernel', '2d') == '2d'
+
+
+def blockvisibility_channel_maps(vis, im, **kwargs):
+    """ Generate the maps for gridding one channel of a BlockVisibility at a time
+    
+    The uvw of the baselines are scaled to wavelengths for each channel on the fly, so the rows of the channel
+    are the [ntimes, nbaselines] elements of the baseline form (see BlockVisibility.bluvw).
+    
+    :param vis: BlockVisibility
+    :param im: Image
+    :returns: Generator of channel, uv map, frequency map, polarisation map, phasor
+    """
+    assert type(vis) is BlockVisibility, "vis is not a BlockVisibility: %r" % vis
+    
+    spectral_mode, chanmap = get_frequency_map(vis, im)
+    polarisation_mode, vpolarisationmap = get_polarisation_map(vis, im, **kwargs)
+    bluvw = vis.bluvw.reshape([-1, 3])
+    for chan in range(vis.nchan):
+        uvw = bluvw * vis.frequency[chan] / constants.c.value
+        uvw_mode, shape, padding, vuvwmap = get_uvw_map(vis, im, uvw=uvw, **kwargs)
+        vfrequencymap = numpy.full(len(uvw), chanmap[chan], dtype='int32')
+        yield chan, vuvwmap, vfrequencymap, vpolarisationmap, calculate_image_phasor(vis, im, uvw=uvw)
+
+
+def convolutional_degrid_blockvisibility(kernels, uvgrid, vis, im, **kwargs):
+    """ Degrid a BlockVisibility directly from the block layout
+    
+    :param kernels: list of oversampled convolution kernel
+    :param uvgrid: The uv plane to de-grid from
+    :param vis: BlockVisibility giving the uvw and frequencies
+    :param im: Image with the grid coordinates
+    :returns: Predicted visibility in the baseline form [ntimes, nbaselines, nchan, npol]
+    """
+    kernels = list(kernels)
+    npol = vis.npol
+    blvis = numpy.zeros([vis.nvis, vis.nbaselines, vis.nchan, npol], dtype='complex')
+    for chan, vuvwmap, vfrequencymap, vpolarisationmap, phasor in blockvisibility_channel_maps(vis, im, **kwargs):
+        blvis[:, :, chan, :] = convolutional_degrid(kernels, (len(vuvwmap), npol), uvgrid, vuvwmap, vfrequencymap,
+                                                    vpolarisationmap, vphasor=phasor).reshape([vis.nvis, -1, npol])
+    return blvis
+
+
+def convolutional_grid_blockvisibility(kernels, uvgrid, blvis, vis, im, **kwargs):
+    """ Grid a BlockVisibility directly from the block layout
+    
+    As for a BlockVisibility converted to Visibility, the imaging weights are all one.
+    
+    :param kernels: List of oversampled convolution kernels
+    :param uvgrid: Grid to add to
+    :param blvis: Visibility values in the baseline form [ntimes, nbaselines, nchan, npol]
+    :param vis: BlockVisibility giving the uvw and frequencies
+    :param im: Image with the grid coordinates
+    :returns: uv grid[nchan, npol, ny, nx], sumwt[nchan, npol]
+    """
+    kernels = list(kernels)
+    npol = vis.npol
+    visweights = numpy.ones([vis.nvis * vis.nbaselines, npol])
+    sumwt = numpy.zeros(uvgrid.shape[:2])
+    for chan, vuvwmap, vfrequencymap, vpolarisationmap, phasor in blockvisibility_channel_maps(vis, im, **kwargs):
+        uvgrid, chansumwt = convolutional_grid(kernels, uvgrid, blvis[:, :, chan, :].reshape([-1, npol]), visweights,
+                                               vuvwmap, vfrequencymap, vpolarisationmap, vphasor=phasor)
+        sumwt += chansumwt
+    return uvgrid, sumwt
+
+
+def insert_blockvisibility_vis(vis, blvis):
+    """ Set the vis column of a BlockVisibility from values in the baseline form
+    
+    In the square layout the reversed baselines are set to the conjugates, with the cross polarisations swapped,
+    and the autocorrelations to zero.
+    
+    :param vis: BlockVisibility (changed in place)
+    :param blvis: Visibility values [ntimes, nbaselines, nchan, npol]
+    :returns: vis
+    """
+    if vis.compact:
+        vis.data['vis'] = blvis
+    else:
+        antenna1, antenna2 = vis.baselines
+        square = numpy.zeros(vis.data.column('vis').shape, dtype='complex')
+        square[:, antenna2, antenna1] = blvis
+        if vis.polarisation_frame.type in ['linear', 'circular']:
+            blvis = blvis[..., [0, 2, 1, 3]]
+        square[:, antenna1, antenna2] = numpy.conjugate(blvis)
+        vis.data['vis'] = square
+    return vis
+
+
 def predict_2d_base(vis, model, **kwargs):
     """ Predict using convolutional degridding.
 
     This is at the bottom of the layering i.e. all transforms are eventually expressed in terms of
     this function. Any shifting needed is performed here.
 
+    A BlockVisibility is degridded directly from the block layout if possible (see use_block_gridding), and
+    otherwise coalesced to Visibility and decoalesced afterwards.
+
     :param vis: Visibility to be predicted
     :param model: model image
     :returns: resulting visibility (in place works)
     """
+    _, _, ny, nx = model.data.shape
+    
+    if use_block_gridding(vis, **kwargs):
+        padding = get_parameter(kwargs, "padding", 2)
+        kernel_name, gcf, vkernellist = get_kernel_list(vis, model, **kwargs)
+        uvgrid = fft((pad_mid(model.data, int(round(padding * nx))) * gcf).astype(dtype=complex))
+        return insert_blockvisibility_vis(vis, convolutional_degrid_blockvisibility(vkernellist, uvgrid, vis, model,
+                                                                                    **kwargs))
+    
     if type(vis) is not Visibility:
         avis = coalesce_visibility(vis, **kwargs)
     else:
         avis = vis
     
-    _, _, ny, nx = model.data.shape
-    
     spectral_mode, vfrequencymap = get_frequency_map(avis, model)
     polarisation_mode, vpolarisationmap = get_polarisation_map(avis, model, **kwargs)
     uvw_mode, shape, padding, vuvwmap = get_uvw_map(avis, model, **kwargs)
@@ -117,29 +257,116 @@ def predict_2d_base(vis, model, **kwargs):
     
     uvgrid = fft((pad_mid(model.data, int(round(padding * nx))) * gcf).astype(dtype=complex))
     
-    avis.data['vis'] = convolutional_degrid(vkernellist, avis.data['vis'].shape, uvgrid,
-                                            vuvwmap, vfrequencymap, vpolarisationmap)
-    
-    # Now we can shift the visibility from the image frame to the original visibility frame
-    svis = shift_vis_to_image(avis, model, tangent=True, inverse=True)
+    # The degridded visibility is shifted from the image frame to the original visibility frame on the fly
+    phasor = calculate_image_phasor(avis, model)
+    avis.data['vis'] = convolutional_degrid(vkernellist, avis.data.column('vis').shape, uvgrid,
+                                            vuvwmap, vfrequencymap, vpolarisationmap, vphasor=phasor)
 
     if type(vis) is not Visibility:
-        return decoalesce_visibility(svis)
+        return decoalesce_visibility(avis)
     else:
-        return svis
+        return avis
 
 
 def predict_2d(vis, model, **kwargs):
     """ Predict using convolutional degridding and w projection
     
+    If the model is sparse and the visibility small then the direct Fourier transform of the model pixels is
+    cheaper than the FFT and degridding. Setting dft_threshold e.g. to 1.0 uses predict_dft in that case. The
+    results differ by the degridding errors so this is off by default. See predict_dft_cost.
+    
     :param vis: Visibility to be predicted
     :param model: model image
+    :param dft_threshold: Use predict_dft if its relative cost is less than this (0.0: always degrid)
     :returns: resulting visibility (in place works)
     """
+    dft_threshold = get_parameter(kwargs, "dft_threshold", 0.0)
+    if dft_threshold > 0.0 and predict_dft_cost(vis, model, **kwargs) < dft_threshold:
+        log.debug("predict_2d: predict using direct Fourier transform")
+        return predict_dft(vis, model, **kwargs)
+    
     log.debug("predict_2d: predict using 2d transform")
     return predict_2d_base(vis, model, **kwargs)
 
 
+# Costs for predict_dft_cost (in seconds as measured, only the ratios matter). These are fitted to timings by
+# util/benchmark_predict_dft.py, which can be run to re-derive them for other hardware.
+predict_fft_overhead = 8e-3
+predict_fft_pixel_cost = 5e-9
+predict_degrid_sample_cost = 1e-5
+predict_dft_overhead = 4e-3
+predict_dft_phasor_cost = 5e-8
+
+
+def predict_dft_cost(vis, model, **kwargs):
+    """ Estimate the cost of predict_dft relative to predict_2d_base
+
+    The DFT costs one phasor per visibility row and non-zero model pixel. The FFT path costs the padded FFT
+    of every image plane plus a kernel sum per visibility sample. The constants are least squares fits to the
+    times of both on a range of image and visibility sizes and numbers of non-zero pixels, as made by
+    util/benchmark_predict_dft.py.
+
+    :param vis: Visibility or BlockVisibility to be predicted
+    :param model: model image
+    :returns: Ratio of estimated DFT cost to estimated FFT and degridding cost
+    """
+    padding = get_parameter(kwargs, "padding", 2)
+    nchan, npol, ny, nx = model.data.shape
+    
+    if type(vis) is Visibility:
+        nrows, vnpol = vis.data.column('vis').shape
+    else:
+        vnchan, vnpol = vis.nchan, vis.npol
+        nrows = vis.nvis * vis.nbaselines * vnchan
+    
+    npixel = int(round(padding * nx)) * int(round(padding * ny))
+    fft_cost = predict_fft_overhead + predict_fft_pixel_cost * nchan * npol * npixel * numpy.log2(npixel) + \
+        predict_degrid_sample_cost * nrows * vnpol
+    dft_cost = predict_dft_overhead + \
+        predict_dft_phasor_cost * nrows * numpy.count_nonzero(numpy.any(model.data != 0.0, axis=(0, 1)))
+    return dft_cost / fft_cost
+
+
+def predict_dft(vis, model, **kwargs):
+    """ Predict by direct Fourier transform of the non-zero pixels of the model
+
+    The pixels are treated as point sources, including the w term. This is exact and is cheaper than the FFT
+    and degridding for sparse models and small visibility sets.
+
+    :param vis: Visibility to be predicted
+    :param model: model image
+    :param dft_chunksize: Maximum number of phasors calculated at one time (2**20)
+    :param dft_workers: Number of threads (1)
+    :returns: resulting visibility (in place works)
+    """
+    if type(vis) is not Visibility:
+        avis = coalesce_visibility(vis, **kwargs)
+    else:
+        avis = vis
+    
+    spectral_mode, vfrequencymap = get_frequency_map(avis, model)
+    polarisation_mode, vpolarisationmap = get_polarisation_map(avis, model, **kwargs)
+    
+    # The FFT phase centre is at ny // 2, nx // 2 (0-relative) so the pixels are converted with origin=1
+    ys, xs = numpy.nonzero(numpy.any(model.data != 0.0, axis=(0, 1)))
+    vnpol = avis.data.column('vis').shape[1]
+    dftvis = numpy.zeros(avis.data.column('vis').shape, dtype='complex')
+    if len(xs) > 0:
+        l, m, n = skycoord_to_lmn(pixel_to_skycoord(xs, ys, model.wcs, origin=1), avis.phasecentre)
+        impol = [vpolarisationmap(pol) for pol in range(vnpol)]
+        for chan in numpy.unique(vfrequencymap):
+            rows = vfrequencymap == chan
+            flux = model.data[chan][impol][:, ys, xs].T
+            dftvis[rows] = dft_skycomponents(avis.uvw[rows], numpy.atleast_1d(l), numpy.atleast_1d(m), flux,
+                                             **kwargs)
+    avis.data['vis'] = dftvis
+    
+    if type(vis) is not Visibility:
+        return decoalesce_visibility(avis)
+    else:
+        return avis
+
+
 def predict_wprojection(vis, model, **kwargs):
     """ Predict using convolutional degridding and w projection.
     
@@ -174,6 +401,9 @@ def invert_2d_base(vis, im, dopsf=False, normalize=True, **kwargs):
     This is at the bottom of the layering i.e. all transforms are eventually expressed in terms
     of this function. . Any shifting needed is performed here.
 
+    A BlockVisibility is gridded directly from the block layout if possible (see use_block_gridding), and
+    otherwise coalesced to Visibility first.
+
     :param vis: Visibility to be inverted
     :param im: image template (not changed)
     :param dopsf: Make the psf instead of the dirty image
@@ -181,32 +411,44 @@ def invert_2d_base(vis, im, dopsf=False, normalize=True, **kwargs):
     :returns: resulting image
 
     """
-    if type(vis) is not Visibility:
-        avis = coalesce_visibility(vis, **kwargs)
-    else:
-        avis = vis
-        
-    svis = copy_visibility(avis)
-
-    if dopsf:
-        svis.data['vis'] = numpy.ones_like(svis.data['vis'])
-
-    # Shift
-    svis = shift_vis_to_image(svis, im, tangent=True, inverse=False)
-    
     nchan, npol, ny, nx = im.data.shape
     
-    spectral_mode, vfrequencymap = get_frequency_map(avis, im)
-    polarisation_mode, vpolarisationmap = get_polarisation_map(avis, im, **kwargs)
-    uvw_mode, shape, padding, vuvwmap = get_uvw_map(avis, im, **kwargs)
-    kernel_name, gcf, vkernellist = get_kernel_list(avis, im, **kwargs)
-    
-    # Optionally pad to control aliasing
-    imgridpad = numpy.zeros([nchan, npol, int(round(padding * ny)), int(round(padding * nx))], dtype='complex')
-    imgridpad, sumwt = convolutional_grid(vkernellist, imgridpad, svis.data['vis'],
-                                          svis.data['imaging_weight'],
-                                          vuvwmap,
-                                          vfrequencymap, vpolarisationmap)
+    if use_block_gridding(vis, **kwargs):
+        # Grid directly from the block layout
+        padding = get_parameter(kwargs, "padding", 2)
+        kernel_name, gcf, vkernellist = get_kernel_list(vis, im, **kwargs)
+        if dopsf:
+            svis = numpy.ones([vis.nvis, vis.nbaselines, vis.nchan, vis.npol], dtype='complex')
+        else:
+            svis = vis.blvis
+        imgridpad = numpy.zeros([nchan, npol, int(round(padding * ny)), int(round(padding * nx))], dtype='complex')
+        imgridpad, sumwt = convolutional_grid_blockvisibility(vkernellist, imgridpad, svis, vis, im, **kwargs)
+    else:
+        if type(vis) is not Visibility:
+            avis = coalesce_visibility(vis, **kwargs)
+        else:
+            avis = vis
+        
+        # Only read from avis, which may be shared e.g. by the partitions in invert_with_image_iterator
+        if dopsf:
+            svis = numpy.ones_like(avis.data.column('vis'))
+        else:
+            svis = avis.data.column('vis')
+        
+        # The visibility is not changed: the shift to the image phase centre is applied on the fly during gridding
+        phasor = calculate_image_phasor(avis, im)
+        
+        spectral_mode, vfrequencymap = get_frequency_map(avis, im)
+        polarisation_mode, vpolarisationmap = get_polarisation_map(avis, im, **kwargs)
+        uvw_mode, shape, padding, vuvwmap = get_uvw_map(avis, im, **kwargs)
+        kernel_name, gcf, vkernellist = get_kernel_list(avis, im, **kwargs)
+        
+        # Optionally pad to control aliasing
+        imgridpad = numpy.zeros([nchan, npol, int(round(padding * ny)), int(round(padding * nx))], dtype='complex')
+        imgridpad, sumwt = convolutional_grid(vkernellist, imgridpad, svis,
+                                              avis.imaging_weight,
+                                              vuvwmap,
+                                              vfrequencymap, vpolarisationmap, vphasor=phasor)
     
     # Fourier transform the padded grid to image, multiply by the gridding correction
     # function, and extract the unpadded inner part.
@@ -282,12 +524,84 @@ def invert_wprojection(vis, im, dopsf=False, normalize=True, **kwargs):
     return invert_2d_base(vis, im, dopsf, normalize=normalize, **kwargs)
 
 
+def skycomponents_to_lmn(sc, phasecentre):
+    """ Convert the directions of a list of Skycomponents to direction cosines in one transform
+
+    :param sc: list of Skycomponents
+    :param phasecentre: Phase centre
+    :returns: l, m arrays [ncomp]
+    """
+    frame = sc[0].direction.frame
+    if not all(comp.direction.frame.is_equivalent_frame(frame) for comp in sc):
+        lmn = numpy.array([skycoord_to_lmn(comp.direction, phasecentre) for comp in sc])
+        return lmn[:, 0], lmn[:, 1]
+    
+    # Building a SkyCoord from a list of SkyCoords is slow so collect the coordinates directly
+    representations = [comp.direction.frame.represent_as(UnitSphericalRepresentation) for comp in sc]
+    lon = numpy.array([r.lon.rad for r in representations])
+    lat = numpy.array([r.lat.rad for r in representations])
+    directions = SkyCoord(frame.realize_frame(UnitSphericalRepresentation(lon * units.rad, lat * units.rad)))
+    l, m, n = skycoord_to_lmn(directions, phasecentre)
+    return l, m
+
+
+def dft_skycomponents(uvw, l, m, flux, **kwargs):
+    """ Direct Fourier transform of point sources
+    
+    The phasors for a block of rows and a block of components are calculated in one matrix product and
+    the flux summed with another. The size of the blocks is limited by dft_chunksize (the number of
+    phasors held at one time). The row blocks may be processed by a pool of dft_workers threads.
+
+    :param uvw: :math:`(u,v,w)` of the visibilities in wavelengths [nrows, 3]
+    :param l: horizontal direction cosines of the components [ncomp]
+    :param m: orthogonal direction cosines of the components [ncomp]
+    :param flux: Flux of the components [ncomp, npol]
+    :param dft_chunksize: Maximum number of phasors calculated at one time (2**20)
+    :param dft_workers: Number of threads (1)
+    :returns: visibility [nrows, npol]
+    """
+    chunksize = get_parameter(kwargs, "dft_chunksize", 2 ** 20)
+    workers = get_parameter(kwargs, "dft_workers", 1)
+    
+    nrows = uvw.shape[0]
+    ncomp, npol = flux.shape
+    vis = numpy.zeros([nrows, npol], dtype='complex')
+    if nrows == 0 or ncomp == 0:
+        return vis
+    
+    # Vector directions to the components, including phase tracking to the centre of the field
+    s = numpy.array([l, m, numpy.sqrt(1 - l ** 2 - m ** 2) - 1.0]).T
+    
+    compchunk = max(1, min(ncomp, chunksize // max(1, min(nrows, 1024))))
+    rowchunk = max(1, chunksize // compchunk)
+    
+    def dft_rows(rowslice):
+        for comp in range(0, ncomp, compchunk):
+            compslice = slice(comp, comp + compchunk)
+            phasor = numpy.exp(-2j * numpy.pi * numpy.dot(uvw[rowslice], s[compslice].T))
+            vis[rowslice] += numpy.dot(phasor, flux[compslice])
+    
+    rowslices = [slice(row, row + rowchunk) for row in range(0, nrows, rowchunk)]
+    if workers > 1 and len(rowslices) > 1:
+        with ThreadPool(workers) as pool:
+            pool.map(dft_rows, rowslices)
+    else:
+        for rowslice in rowslices:
+            dft_rows(rowslice)
+    
+    return vis
+
+
 def predict_skycomponent_blockvisibility(vis: BlockVisibility, sc: Skycomponent, **kwargs) -> BlockVisibility:
     """Predict the visibility from a Skycomponent, add to existing visibility, for BlockVisibility
 
+    All components are predicted together by dft_skycomponents.
+
     :param vis: BlockVisibility
     :param sc: Skycomponent or list of SkyComponents
     :param spectral_mode: {mfs|channel} (channel)
+    :param dft_chunksize: Maximum number of phasors calculated at one time (2**20)
+    :param dft_workers: Number of threads (1)
     :returns: BlockVisibility
     """
     assert type(vis) is BlockVisibility, "vis is not a BlockVisibility: %r" % vis
@@ -295,36 +609,42 @@ def predict_skycomponent_blockvisibility(vis: BlockVisibility, sc: Skycomponent,
     if not isinstance(sc, collections.Iterable):
         sc = [sc]
     
+    if len(sc) == 0:
+        return vis
+    
     nchan = vis.nchan
     npol = vis.npol
     
-    if not isinstance(sc, collections.Iterable):
-        sc = [sc]
-    
     k = vis.frequency / constants.c.to('m/s').value
     
-    for comp in sc:
-        
+    flux = numpy.zeros([len(sc), nchan, npol], dtype='complex')
+    for icomp, comp in enumerate(sc):
         assert_same_chan_pol(vis, comp)
-        
-        flux = comp.flux
+        flux[icomp] = comp.flux
         if comp.polarisation_frame != vis.polarisation_frame:
-            flux = convert_pol_frame(flux, comp.polarisation_frame, vis.polarisation_frame)
-        
-        l, m, n = skycoord_to_lmn(comp.direction, vis.phasecentre)
-        for chan in range(nchan):
-            phasor = simulate_point(vis.uvw * k[chan], l, m)
-            for pol in range(npol):
-                vis.data['vis'][..., chan, pol] += flux[chan, pol] * phasor[...]
+            flux[icomp] = convert_pol_frame(comp.flux, comp.polarisation_frame, vis.polarisation_frame)
+    
+    l, m = skycomponents_to_lmn(sc, vis.phasecentre)
+    
+    # Either layout
+    blockuvw = vis.data.column('uvw')
+    uvw = blockuvw.reshape([-1, 3])
+    for chan in range(nchan):
+        vis.data['vis'][..., chan, :] += dft_skycomponents(uvw * k[chan], l, m, flux[:, chan, :],
+                                                           **kwargs).reshape(blockuvw.shape[:-1] + (npol,))
     
     return vis
 
 
-def predict_skycomponent_visibility(vis: Visibility, sc: Skycomponent) -> Visibility:
+def predict_skycomponent_visibility(vis: Visibility, sc: Skycomponent, **kwargs) -> Visibility:
     """Predict the visibility from a Skycomponent, add to existing visibility, for Visibility
 
+    All components are predicted together by dft_skycomponents, one channel at a time.
+
     :param vis: Visibility
     :param sc: Skycomponent or list of SkyComponents
+    :param dft_chunksize: Maximum number of phasors calculated at one time (2**20)
+    :param dft_workers: Number of threads (1)
     :returns: Visibility
     """
     assert type(vis) is Visibility, "vis is not a Visibility: %r" % vis
@@ -332,20 +652,19 @@ def predict_skycomponent_visibility(vis: Visibility, sc: Skycomponent) -> Visibi
     if not isinstance(sc, collections.Iterable):
         sc = [sc]
     
+    if len(sc) == 0:
+        return vis
+    
     _, ichan = list(get_frequency_map(vis, None))
+    ichan = numpy.array(ichan)
     
-    npol = vis.polarisation_frame.npol
+    flux = numpy.array([comp.flux for comp in sc])
     
-    for comp in sc:
-        
-        l, m, n = skycoord_to_lmn(comp.direction, vis.phasecentre)
-        phasor = simulate_point(vis.uvw, l, m)
-        for pol in range(npol):
-            vis.data['vis'][:, pol] += comp.flux[ichan[:], pol] * phasor[:]
-            
-            # coords = phasor, ichan
-            # for pol in range(npol):
-            #     vis.data['vis'][:,pol] += [comp.flux[ic, pol] * p for p, ic in zip(*coords)]
+    l, m = skycomponents_to_lmn(sc, vis.phasecentre)
+    
+    for chan in numpy.unique(ichan):
+        rows = ichan == chan
+        vis.data['vis'][rows] += dft_skycomponents(vis.uvw[rows], l, m, flux[:, chan, :], **kwargs)
     
     return vis
 
@@ -371,7 +690,7 @@ def weight_visibility(vis, im, **kwargs):
     densitygrid = None
     
     weighting = get_parameter(kwargs, "weighting", "uniform")
-    vis.data['imaging_weight'], density, densitygrid = weight_gridding(im.data.shape, vis.data['weight'], vuvwmap,
+    vis.data['imaging_weight'], density, densitygrid = weight_gridding(im.data.shape, vis.weight, vuvwmap,
                                                                        vfrequencymap, vpolarisationmap, weighting)
     
     return vis, density, densitygrid
@@ -431,7 +750,11 @@ def create_image_from_visibility(vis: Visibility, **kwargs) -> Image:
     
     # Image sampling options
     npixel = get_parameter(kwargs, "npixel", 512)
-    uvmax = numpy.max((numpy.abs(vis.data['uvw'][:, 0:1])))
+    if type(vis) is BlockVisibility and vis.compact:
+        # The baselines with antenna 0, as for the square layout
+        uvmax = numpy.max((numpy.abs(vis.data.column('uvw')[:, 0:vis.nants - 1])))
+    else:
+        uvmax = numpy.max((numpy.abs(vis.data.column('uvw')[:, 0:1])))
     if type(vis) is BlockVisibility:
         uvmax *= numpy.max(frequency) / constants.c.to('m/s').value
     log.info("create_image_from_visibility: uvmax = %f wavelengths" % uvmax)
@@ -495,7 +818,7 @@ def create_w_term_image(vis, w=None, **kwargs):
     :returns: Image
     """
     if w is None:
-        w = numpy.median(numpy.abs(vis.data['uvw'][:, 2]))
+        w = numpy.median(numpy.abs(vis.data.column('uvw')[:, 2]))
         log.info('create_w_term_image: Creating w term image for median w %f' % w)
     
     im = create_image_from_visibility(vis, **kwargs)
@@ -520,8 +843,107 @@ def residual_image(vis: Visibility, model: Image, invert_residual=invert_2d, pre
     :param predict: predict to be used (default predict_2d)
     :returns: residual visibility, residual image, sum of weights
     """
-    visres = copy_visibility(vis, zero=True)
+    # The 2d transforms can be fused into one sweep without a model visibility
+    if invert_residual is invert_2d and predict_residual is predict_2d:
+        return residual_invert(vis, model, **kwargs)
+    elif invert_residual is invert_wprojection and predict_residual is predict_wprojection:
+        kwargs['kernel'] = "wprojection"
+        return residual_invert(vis, model, **kwargs)
+    
+    visres = create_derived_visibility(vis, zero=True)
     visres = predict_residual(visres, model, **kwargs)
-    visres.data['vis'] = vis.data['vis'] - visres.data['vis']
+    numpy.subtract(vis.data.column('vis'), visres.data['vis'], out=visres.data['vis'])
     dirty, sumwt = invert_residual(visres, model, dopsf=False, **kwargs)
-    return visres, dirty, sumwt
\ No newline at end of file
+    return visres, dirty, sumwt
+
+
+def residual_invert(vis, model, normalize=True, inplace=False, **kwargs):
+    """Calculate residual visibility and image in one sweep using convolutional degridding and gridding
+
+    The model is degridded and subtracted from the observed visibilities, and the residual is then gridded with the
+    same maps, kernels and phase shift. No zeroed model Visibility is made so the memory needed is one copy of the
+    visibility (none if inplace). This is equivalent to residual_image with predict_2d and invert_2d, or with
+    w projection if kernel='wprojection'.
+
+    A BlockVisibility is processed in the block layout if possible (see use_block_gridding). Otherwise it is
+    coalesced once and the image is that of the coalesced residual. The residual visibility returned is still vis
+    less the decoalesced model, as with predict_2d.
+
+    :param vis: Visibility or BlockVisibility
+    :param model: model image
+    :param normalize: Normalize by the sum of weights (True)
+    :param inplace: Overwrite the vis column of vis with the residual (False)
+    :returns: residual visibility, residual image, sum of weights
+    """
+    nchan, npol, ny, nx = model.data.shape
+    
+    if use_block_gridding(vis, **kwargs):
+        # Degrid and grid directly in the block layout
+        padding = get_parameter(kwargs, "padding", 2)
+        kernel_name, gcf, vkernellist = get_kernel_list(vis, model, **kwargs)
+        vkernellist = list(vkernellist)
+        uvgrid = fft((pad_mid(model.data, int(round(padding * nx))) * gcf).astype(dtype=complex))
+        blvis = vis.blvis - convolutional_degrid_blockvisibility(vkernellist, uvgrid, vis, model, **kwargs)
+        uvgrid = None
+        imgridpad = numpy.zeros([nchan, npol, int(round(padding * ny)), int(round(padding * nx))], dtype='complex')
+        imgridpad, sumwt = convolutional_grid_blockvisibility(vkernellist, imgridpad, blvis, vis, model, **kwargs)
+        sumwt /= float(padding * int(round(padding * nx)) * ny)
+        result = extract_mid(numpy.real(ifft(imgridpad)) * gcf, npixel=nx)
+        resultimage = create_image_from_array(result, model.wcs)
+        if normalize:
+            resultimage = normalize_sumwt(resultimage, sumwt)
+        if not inplace:
+            vis = create_derived_visibility(vis)
+        return insert_blockvisibility_vis(vis, blvis), resultimage, sumwt
+    
+    if type(vis) is not Visibility:
+        avis = coalesce_visibility(vis, **kwargs)
+    elif inplace:
+        avis = vis
+    else:
+        avis = create_derived_visibility(vis, zero=False)
+    
+    spectral_mode, vfrequencymap = get_frequency_map(avis, model)
+    polarisation_mode, vpolarisationmap = get_polarisation_map(avis, model, **kwargs)
+    uvw_mode, shape, padding, vuvwmap = get_uvw_map(avis, model, **kwargs)
+    kernel_name, gcf, vkernellist = get_kernel_list(avis, model, **kwargs)
+    # The kernels may be a generator but are needed twice
+    vkernellist = list(vkernellist)
+    
+    phasor = calculate_image_phasor(avis, model)
+    
+    uvgrid = fft((pad_mid(model.data, int(round(padding * nx))) * gcf).astype(dtype=complex))
+    modelvis = convolutional_degrid(vkernellist, avis.data.column('vis').shape, uvgrid,
+                                    vuvwmap, vfrequencymap, vpolarisationmap, vphasor=phasor)
+    avis.data['vis'] -= modelvis
+    uvgrid = None
+    if type(vis) is Visibility:
+        modelvis = None
+    
+    imgridpad = numpy.zeros([nchan, npol, int(round(padding * ny)), int(round(padding * nx))], dtype='complex')
+    imgridpad, sumwt = convolutional_grid(vkernellist, imgridpad, avis.data.column('vis'),
+                                          avis.imaging_weight,
+                                          vuvwmap,
+                                          vfrequencymap, vpolarisationmap, vphasor=phasor)
+    
+    # Normalise weights for consistency with transform
+    sumwt /= float(padding * int(round(padding * nx)) * ny)
+    
+    result = extract_mid(numpy.real(ifft(imgridpad)) * gcf, npixel=nx)
+    resultimage = create_image_from_array(result, model.wcs)
+    if normalize:
+        resultimage = normalize_sumwt(resultimage, sumwt)
+    
+    if type(vis) is Visibility:
+        return avis, resultimage, sumwt
+    
+    # The residual visibility is the observed less the decoalesced model. The decoalesced residual would have the
+    # observed visibility averaged as in the coalescence.
+    avis.data['vis'] = modelvis
+    avis.blockvis = create_derived_visibility(vis, zero=True)
+    modelvis = decoalesce_visibility(avis)
+    if inplace:
+        vis.data['vis'] -= modelvis.data.column('vis')
+        return vis, resultimage, sumwt
+    numpy.subtract(vis.data.column('vis'), modelvis.data['vis'], out=modelvis.data['vis'])
+    return modelvis, resultimage, sumwt
\ No newline at end of file
@@ -4,7 +4,8 @@
 Functions that distributes predict and invert using either just loops or parallel execution
 """
 
-import multiprocessing
+import threading
+from multiprocessing.pool import ThreadPool
 
 from arl.data.parameters import get_parameter
 from arl.fourier_transforms.ftprocessor_base import *
@@ -12,7 +13,7 @@ from arl.fourier_transforms.ftprocessor_params import *
 from arl.image.iterators import *
 from arl.image.operations import create_empty_image_like
 from arl.visibility.iterators import vis_slice_iter
-from arl.visibility.operations import create_visibility_from_rows
+from arl.visibility.operations import create_visibility_from_rows, create_derived_visibility
 
 log = logging.getLogger(__name__)
 
@@ -68,48 +69,112 @@ def predict_with_vis_iterator(vis, model, vis_iter=vis_slice_iter, predict=predi
     return vis
 
 
+def process_image_partitions(process, image_partitions, facet_workers=1):
+    """ Apply process to each image partition, optionally using a pool of worker threads
+
+    The partitions are views into one image so process must only write into its own partition. They are handed
+    to the workers one at a time in order.
+
+    :param process: Function taking a single image partition
+    :param image_partitions: Iterable of image partitions e.g. raster_iter(im, facets=4)
+    :param facet_workers: Number of partitions to process concurrently (1)
+    """
+    if facet_workers > 1:
+        log.debug("process_image_partitions: Processing partitions using %d workers" % facet_workers)
+        pool = ThreadPool(facet_workers)
+        try:
+            pool.map(process, list(image_partitions), chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        for dpatch in image_partitions:
+            process(dpatch)
+
+
 def predict_with_image_iterator(vis, model, image_iterator=raster_iter, predict_function=predict_2d_base,
                                 **kwargs):
     """ Predict using image partitions, calling specified predict function
 
+    The partitions are independent and can be predicted concurrently by setting facet_workers. A BlockVisibility
+    is coalesced once and shared by all partitions. Each worker predicts into its own vis column, sharing the other
+    columns (see create_derived_visibility), and the results are accumulated into vis in the order of the
+    partitions, so the result does not depend on facet_workers.
+
     :param vis: Visibility to be predicted
     :param model: model image
     :param image_iterator: Image iterator used to access the image
     :param predict_function: Function to be used for prediction (allows nesting)
+    :param facet_workers: Number of partitions to predict concurrently (1)
     :returns: resulting visibility (in place works)
     """
     log.info("predict_with_image_iterator: Predicting by image partitions")
-    vis.data['vis'] *= 0.0
-    result = copy_visibility(vis)
-    for dpatch in image_iterator(model, **kwargs):
-        result = predict_function(result, dpatch, **kwargs)
-        vis.data['vis'] += result.data['vis']
-    return vis
+    if type(vis) is not Visibility:
+        avis = coalesce_visibility(vis, **kwargs)
+    else:
+        avis = vis
+    avis.data['vis'] *= 0.0
+    
+    facet_workers = get_parameter(kwargs, "facet_workers", 1)
+    accumulate_turn = threading.Condition()
+    next_partition = [0]
+    worker = threading.local()
+    
+    def predict_partition(partition):
+        ipatch, dpatch = partition
+        if not hasattr(worker, 'vis'):
+            worker.vis = create_derived_visibility(avis, zero=True)
+        result = predict_function(worker.vis, dpatch, **kwargs)
+        with accumulate_turn:
+            accumulate_turn.wait_for(lambda: next_partition[0] == ipatch)
+            avis.data['vis'] += result.data.column('vis')
+            next_partition[0] += 1
+            accumulate_turn.notify_all()
+    
+    process_image_partitions(predict_partition, enumerate(image_iterator(model, **kwargs)), facet_workers)
+    
+    if type(vis) is not Visibility:
+        return decoalesce_visibility(avis)
+    else:
+        return avis
 
 
 def invert_with_image_iterator(vis, im, image_iterator=raster_iter, dopsf=False,
                                normalize=True, invert_function=invert_2d_base, **kwargs):
     """ Predict using image partitions, calling specified predict function
 
+    The partitions are independent and can be inverted concurrently by setting facet_workers. The visibility is
+    shared read-only by all partitions (a BlockVisibility is coalesced once) and each result is written straight
+    into the corresponding view of im.
+
     :param vis: Visibility to be inverted
     :param im: image template (not changed)
     :param image_iterator: Iterator to use for partitioning
     :param dopsf: Make the psf instead of the dirty image
     :param normalize: Normalize by the sum of weights (True)
+    :param facet_workers: Number of partitions to invert concurrently (1)
     :returns: resulting image[nchan, npol, ny, nx], sum of weights[nchan, npol]
     """
     
     log.info("invert_with_image_iterator: Inverting by image partitions")
-    i = 0
+    if type(vis) is not Visibility:
+        avis = coalesce_visibility(vis, **kwargs)
+    else:
+        avis = vis
+    
     nchan, npol, _, _ = im.shape
     totalwt = numpy.zeros([nchan, npol])
-    for dpatch in image_iterator(im, **kwargs):
-        result, sumwt = invert_function(vis, dpatch, dopsf, normalize=False, **kwargs)
-        totalwt = sumwt
+    facet_workers = get_parameter(kwargs, "facet_workers", 1)
+    
+    def invert_partition(dpatch):
+        result, sumwt = invert_function(avis, dpatch, dopsf, normalize=False, **kwargs)
+        # Every partition sees all the visibilities so the sum of weights is the same for all
+        totalwt[...] = sumwt
         # Ensure that we fill in the elements of dpatch instead of creating a new numpy arrray
         dpatch.data[...] = result.data[...]
-        assert numpy.max(numpy.abs(dpatch.data)), "Partition image %d appears to be empty" % i
-        i += 1
+        assert numpy.max(numpy.abs(dpatch.data)), "Partition image appears to be empty"
+    
+    process_image_partitions(invert_partition, image_iterator(im, **kwargs), facet_workers)
     assert numpy.max(numpy.abs(im.data)), "Output image appears to be empty"
     
     if normalize:
@@ -2,12 +2,15 @@
 Functions that aid definition of fourier transform processing.
 """
 
+import weakref
+
 import astropy.constants as constants
 
 from arl.data.data_models import *
 from arl.data.parameters import *
 from arl.fourier_transforms.convolutional_gridding import anti_aliasing_calculate, w_kernel
 from arl.image.iterators import *
+from arl.visibility.iterators import get_row_index
 
 log = logging.getLogger(__name__)
 
@@ -18,27 +21,25 @@ def get_frequency_map(vis, im=None, **kwargs):
     """
     
     # Find the unique frequencies in the visibility
-    ufrequency = numpy.unique(vis.frequency)
+    ufrequency, row2vis = get_channel_map(vis)
     vnchan = len(ufrequency)
 
     if im is None:
         spectral_mode = 'channel'
-        vfrequencymap = get_rowmap(vis.frequency, ufrequency)
+        vfrequencymap = row2vis
         assert min(vfrequencymap) >= 0, "Invalid frequency map: visibility channel < 0"
 
 
     elif im.data.shape[0] == 1 and vnchan >= 1:
         spectral_mode = 'mfs'
-        vfrequencymap = numpy.zeros_like(vis.frequency, dtype='int')
+        vfrequencymap = numpy.zeros_like(vis.frequency, dtype='int32')
 
     else:
         # We can map these to image channels
-        v2im_map = im.wcs.sub(['spectral']).wcs_world2pix(ufrequency, 0)[0].astype('int')
+        v2im_map = im.wcs.sub(['spectral']).wcs_world2pix(ufrequency, 0)[0].astype('int32')
     
         spectral_mode = 'channel'
-        nrows = len(vis.frequency)
-        row2vis = numpy.array(get_rowmap(vis.frequency, ufrequency))
-        vfrequencymap = [v2im_map[row2vis[row]] for row in range(nrows)]
+        vfrequencymap = v2im_map[row2vis]
         
         assert min(vfrequencymap) >= 0, "Invalid frequency map: image channel < 0"
         assert max(vfrequencymap) < im.shape[0], "Invalid frequency map: image channel > number image channels"
@@ -46,6 +47,39 @@ def get_frequency_map(vis, im=None, **kwargs):
     return spectral_mode, vfrequencymap
 
 
+def get_channel_map(vis):
+    """ Get the unique frequencies and the map from each row to the unique frequencies
+
+    For a Visibility the result is cached on the Visibility and reused for as long as vis.data is the same table
+    and its frequency column is unchanged (see ColumnTable.version). The frequency index from create_row_index is
+    used if there is one.
+
+    :param vis: Visibility or BlockVisibility
+    :returns: unique frequencies, read-only int32 array of index into unique frequencies
+    """
+    if type(vis) is Visibility and vis.frequency_map_cache is not None:
+        dataref, version, ufrequency, vmap = vis.frequency_map_cache
+        if dataref() is vis.data and version == vis.data.version('frequency'):
+            return ufrequency, vmap
+    
+    index = get_row_index(vis, 'frequency')
+    if index is not None and numpy.all(numpy.diff(numpy.round(index['unique'])) > 0):
+        # Each group of equal frequencies in the index is a channel
+        ufrequency = index['unique']
+        vmap = numpy.empty(len(index['order']), dtype='int32')
+        vmap[index['order']] = numpy.repeat(numpy.arange(len(ufrequency), dtype='int32'),
+                                            numpy.diff(index['offsets']))
+    else:
+        ufrequency = numpy.unique(vis.frequency)
+        vmap = get_rowmap(vis.frequency, ufrequency)
+    vmap.flags.writeable = False
+    
+    if type(vis) is Visibility:
+        vis.frequency_map_cache = (weakref.ref(vis.data), vis.data.version('frequency'), ufrequency, vmap)
+    
+    return ufrequency, vmap
+
+
 def get_polarisation_map(vis: Visibility, im: Image=None, **kwargs):
     """ Get the mapping of visibility polarisations to image polarisations
     
@@ -62,29 +96,37 @@ def get_polarisation_map(vis: Visibility, im: Image=None, **kwargs):
 def get_rowmap(col, ucol=None):
     """ Map to unique cols
     
+    The values are matched after rounding to integer. If more than one value in ucol rounds to the same
+    integer then the last one is used.
+    
     :param col: Data column
     :param ucol: Unique values in col
+    :returns: int32 array of index into ucol for each value in col
     """
-    pdict = {}
-    
     def phash(f):
         return numpy.round(f).astype('int')
     
     if ucol is None:
         ucol = numpy.unique(col)
-        
-    for i, f in enumerate(ucol):
-        pdict[phash(f)] = i
-    vmap = []
-    for p in col:
-        vmap.append(pdict[phash(p)])
-
-    return vmap
+    
+    ukeys = phash(numpy.asarray(ucol))
+    keys = phash(numpy.asarray(col))
+    
+    # Stable sort so that searching from the right finds the last of any duplicate keys
+    order = numpy.argsort(ukeys, kind='stable')
+    sortedkeys = ukeys[order]
+    index = numpy.searchsorted(sortedkeys, keys, side='right') - 1
+    assert numpy.all(index >= 0) and numpy.array_equal(sortedkeys[index], keys), "Value in col not found in ucol"
+    
+    return order[index].astype('int32')
 
 
-def get_uvw_map(vis, im, **kwargs):
+def get_uvw_map(vis, im, uvw=None, **kwargs):
     """ Get the generators that map channels uvw to pixels
 
+    :param vis: Visibility
+    :param im: Image
+    :param uvw: uvw in wavelengths to map instead of vis.uvw e.g. for one channel of a BlockVisibility
     """
     # Transform parameters
     padding = get_parameter(kwargs, "padding", 2)
@@ -98,7 +140,9 @@ def get_uvw_map(vis, im, **kwargs):
     assert uvwscale[0] != 0.0, "Error in uv scaling"
     fov = int(round(padding * nx)) * numpy.abs(uvwscale[0])
     
-    vuvwmap = uvwscale * vis.uvw
+    if uvw is None:
+        uvw = vis.uvw
+    vuvwmap = uvwscale * uvw
     uvw_mode = "2d"
     
     return uvw_mode, shape, padding, vuvwmap
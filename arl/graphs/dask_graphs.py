@@ -36,13 +36,14 @@ from dask import delayed
 from arl.calibration.operations import apply_gaintable
 from arl.calibration.solvers import solve_gaintable
 from arl.data.data_models import Visibility, BlockVisibility, Image
+from arl.data.parameters import get_parameter
 from arl.fourier_transforms.ftprocessor import predict_2d, invert_2d, invert_wstack_single, predict_wstack_single, \
-    normalize_sumwt
+    normalize_sumwt, residual_invert
 from arl.image.deconvolution import deconvolve_cube
 from arl.image.gather_scatter import image_scatter, image_gather
 from arl.image.operations import copy_image, create_empty_image_like
 from arl.visibility.gather_scatter import visibility_scatter_w, visibility_gather_w
-from arl.visibility.operations import copy_visibility
+from arl.visibility.operations import copy_visibility, create_derived_visibility
 
 
 def create_zero_vis_graph_list(vis_graph_list, **kwargs):
@@ -55,9 +56,7 @@ def create_zero_vis_graph_list(vis_graph_list, **kwargs):
     
     def zerovis(vis):
         if vis is not None:
-            zerovis = copy_visibility(vis)
-            zerovis.data['vis'][...] = 0.0
-            return zerovis
+            return create_derived_visibility(vis, zero=True)
         else:
             return None
     
@@ -75,8 +74,8 @@ def create_subtract_vis_graph_list(vis_graph_list, model_vis_graph_list, **kwarg
     def subtract_vis(vis, model_vis):
         if vis is not None and model_vis is not None:
             assert vis.vis.shape == model_vis.vis.shape
-            subvis = copy_visibility(vis)
-            subvis.data['vis'][...] -= model_vis.data['vis'][...]
+            subvis = create_derived_visibility(vis, zero=True)
+            numpy.subtract(vis.data.column('vis'), model_vis.data.column('vis'), out=subvis.data['vis'])
             return subvis
         else:
             return None
@@ -372,12 +371,59 @@ def create_residual_graph(vis_graph_list, model_graph,
     :param kwargs:
     :return:
     """
+    if c_invert_graph is create_invert_graph and c_predict_graph is create_predict_graph and \
+            get_parameter(kwargs, 'invert', invert_2d) is invert_2d and \
+            get_parameter(kwargs, 'predict', predict_2d) is predict_2d:
+        return create_residual_invert_graph(vis_graph_list, model_graph, **kwargs)
+    
     model_vis_graph_list = create_zero_vis_graph_list(vis_graph_list)
     model_vis_graph_list = c_predict_graph(model_vis_graph_list, model_graph, **kwargs)
     residual_vis_graph_list = create_subtract_vis_graph_list(vis_graph_list, model_vis_graph_list)
     return c_invert_graph(residual_vis_graph_list, model_graph, dopsf=False, normalize=True, **kwargs)
 
 
+def create_residual_invert_graph(vis_graph_list, model_graph, **kwargs):
+    """ Create a graph to calculate residual image using the fused residual_invert
+
+    The model is degridded, subtracted and the residual gridded in one step per vis_graph so no model or
+    residual visibility graphs are made.
+
+    :param vis_graph_list:
+    :param model_graph:
+    :param kwargs:
+    :return: Graph for residual image, sum of weights
+    """
+    
+    def residual_invert_single(vis, model, **kwargs):
+        if vis is not None:
+            _, dirty, sumwt = residual_invert(vis, model, normalize=True, **kwargs)
+            return dirty, sumwt
+        else:
+            return None
+    
+    def sum_invert_results(image_list):
+        first = True
+        for arg in image_list:
+            if arg is None:
+                continue
+            if first:
+                im = copy_image(arg[0])
+                im.data *= arg[1]
+                sumwt = arg[1]
+                first = False
+            else:
+                im.data += arg[1] * arg[0].data
+                sumwt += arg[1]
+        
+        im = normalize_sumwt(im, sumwt)
+        return im, sumwt
+    
+    image_graph_list = [delayed(residual_invert_single, pure=True, nout=2)(vis_graph, model_graph, **kwargs)
+                        for vis_graph in vis_graph_list]
+    
+    return delayed(sum_invert_results)(image_graph_list)
+
+
 def create_residual_wstack_graph(vis_graph_list, model_graph,
                                  c_invert_graph=create_invert_wstack_graph,
                                  c_predict_graph=create_predict_wstack_graph,
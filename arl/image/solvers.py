@@ -7,9 +7,10 @@ subclasses of astropy classes.
 
 from arl.data.data_models import *
 from arl.data.parameters import *
-from arl.fourier_transforms.ftprocessor_base import invert_2d, predict_2d, predict_skycomponent_visibility
+from arl.fourier_transforms.ftprocessor_base import invert_2d, predict_2d, predict_skycomponent_visibility, \
+    residual_image
 from arl.image.deconvolution import deconvolve_cube
-from arl.visibility.operations import copy_visibility
+from arl.visibility.operations import create_derived_visibility
 
 log = logging.getLogger(__name__)
 
@@ -30,18 +31,16 @@ def solve_image(vis: Visibility, model: Image, components=None, predict=predict_
     nmajor = get_parameter(kwargs, 'nmajor', 5)
     log.info("solve_image: Performing %d major cycles" % nmajor)
     
-    # The model is added to each major cycle and then the visibilities are
+    # The model is added to each major cycle and then the residual visibilities are
     # calculated from the full model
-    vispred = copy_visibility(vis)
-    visres = copy_visibility(vis)
-
-    vispred = predict(vispred, model, **kwargs)
-    
-    if components is not None:
-        vispred = predict_skycomponent_visibility(vispred, components)
-    
-    visres.data['vis'] = vis.data['vis'] - vispred.data['vis']
-    dirty, sumwt = invert(visres, model, **kwargs)
+    if components is None:
+        visres, dirty, sumwt = residual_image(vis, model, invert_residual=invert, predict_residual=predict, **kwargs)
+    else:
+        visres = create_derived_visibility(vis, zero=True)
+        visres = predict(visres, model, **kwargs)
+        visres = predict_skycomponent_visibility(visres, components)
+        numpy.subtract(vis.data['vis'], visres.data['vis'], out=visres.data['vis'])
+        dirty, sumwt = invert(visres, model, **kwargs)
     psf, sumwt = invert(visres, model, dopsf=True, **kwargs)
     
     thresh = get_parameter(kwargs, "threshold", 0.0)
@@ -51,9 +50,7 @@ def solve_image(vis: Visibility, model: Image, components=None, predict=predict_
         cc, res = deconvolve_cube(dirty, psf, **kwargs)
         res = None
         model.data += cc.data
-        vispred = predict(vispred, model, **kwargs)
-        visres.data['vis'] = vis.data['vis'] - vispred.data['vis']
-        dirty, sumwt = invert(visres, model, **kwargs)
+        visres, dirty, sumwt = residual_image(vis, model, invert_residual=invert, predict_residual=predict, **kwargs)
         if numpy.abs(dirty.data).max() < 1.1 * thresh:
             log.info("Reached stopping threshold %.6f Jy" % thresh)
             break
@@ -30,7 +30,7 @@ def rcal(vis: BlockVisibility, components, **kwargs):
         vis = [vis]
     
     for ichunk, vischunk in enumerate(vis):
-        vispred = copy_visibility(vischunk, zero=True)
+        vispred = create_derived_visibility(vischunk, zero=True)
         vispred = predict_skycomponent_blockvisibility(vispred, components, **kwargs)
         solve_gain_graph = create_solve_gain_graph(vischunk, vispred, **kwargs)
         gt = solve_gain_graph.compute()
@@ -75,34 +75,26 @@ def average_chunks(arr, wts, chunksize):
 def average_chunks2(arr, wts, chunksize):
     """ Average the two dimensional array arr with weights by chunks
 
-    Array len does not have to be multiple of chunksize.
+    Array len does not have to be multiple of chunksize. The average is over chunks of the second axis and then
+    over chunks of the first axis, each with one add.reduceat. Leading batch axes may be given, e.g. for many
+    baselines, in which case the last two axes of each element are averaged separately.
     
-    :param arr: 2D array of values
-    :param wts: 2D array of weights
+    :param arr: 2D array of values, optionally with leading batch axes
+    :param wts: 2D array of weights, optionally with leading batch axes
     :param chunksize: 2-tuple of averaging region e.g. (2,3)
-    :returns: 2D array of averaged data, 2d array of weights
+    :returns: 2D array of averaged data, 2d array of weights, with the same leading axes
     """
-    # Do each axis to determine length
-    #    assert arr.shape == wts.shape, "Shapes of arrays must be the same"
     # It is possible that there is a dangling null axis on wts
     wts = wts.reshape(arr.shape)
     
-    l0 = len(average_chunks(arr[:, 0], wts[:, 0], chunksize[0])[0])
-    l1 = len(average_chunks(arr[0, :], wts[0, :], chunksize[1])[0])
-    
-    tempchunks = numpy.zeros([arr.shape[0], l1], dtype=arr.dtype)
-    tempwt = numpy.zeros([arr.shape[0], l1])
-    
-    tempchunks *= tempwt
-    for i in range(arr.shape[0]):
-        result = average_chunks(arr[i, :], wts[i, :], chunksize[1])
-        tempchunks[i, :], tempwt[i, :] = result[0].flatten(), result[1].flatten()
-    
-    chunks = numpy.zeros([l0, l1], dtype=arr.dtype)
-    weights = numpy.zeros([l0, l1])
-    
-    for i in range(l1):
-        result = average_chunks(tempchunks[:, i], tempwt[:, i], chunksize[0])
-        chunks[:, i], weights[:, i] = result[0].flatten(), result[1].flatten()
+    chunks = numpy.array(arr)
+    weights = numpy.array(wts, dtype='float')
+    for axis, size in [(-1, chunksize[1]), (-2, chunksize[0])]:
+        if size > 1:
+            places = numpy.arange(0, chunks.shape[axis], size)
+            wchunks = numpy.add.reduceat(weights * chunks, places, axis=axis)
+            weights = numpy.add.reduceat(weights, places, axis=axis)
+            wchunks[weights > 0.0] = wchunks[weights > 0.0] / weights[weights > 0.0]
+            chunks = wchunks.astype(arr.dtype, copy=False)
     
     return chunks, weights
@@ -18,11 +18,14 @@ A typical use might be::
     
 """
 
+import hashlib
+import weakref
+
 from astropy import constants
 
 from arl.data.data_models import *
 from arl.data.parameters import get_parameter
-from arl.util.array_functions import average_chunks, average_chunks2
+from arl.util.array_functions import average_chunks2
 from arl.visibility.operations import vis_summary, copy_visibility
 
 log = logging.getLogger(__name__)
@@ -38,6 +41,9 @@ def coalesce_visibility(vis: BlockVisibility, **kwargs) -> Visibility:
     When faceting, the coalescence factors should be roughly the same as the number of facets on one axis.
 
     If coalescence_factor=0.0 then just a format conversion is done
+    
+    The layout of the coalesced data is cached on vis (see get_coalescence_plan) so that coalescing the same
+    BlockVisibility again only averages the vis and weight columns.
 
     :param vis: BlockVisibility to be coalesced
     :returns: Coalesced visibility with  cindex and blockvis filled in
@@ -53,18 +59,8 @@ def coalesce_visibility(vis: BlockVisibility, **kwargs) -> Visibility:
     if time_coal == 0.0 and frequency_coal == 0.0:
         return convert_blockvisibility_to_visibility((vis))
     
-    cvis, cuvw, cwts, ctime, cfrequency, cchannel_bandwidth, ca1, ca2, cintegration_time, cindex \
-        = average_in_blocks(vis.data['vis'], vis.data['uvw'], vis.data['weight'], vis.time, vis.integration_time,
-                            vis.frequency, vis.channel_bandwidth, time_coal, max_time_coal,
-                            frequency_coal, max_frequency_coal)
-    cimwt = numpy.ones(cvis.shape)
-    coalesced_vis = Visibility(uvw=cuvw, time=ctime, frequency=cfrequency,
-                               channel_bandwidth=cchannel_bandwidth,
-                               phasecentre=vis.phasecentre, antenna1=ca1, antenna2=ca2, vis=cvis,
-                               weight=cwts, imaging_weight=cimwt,
-                               configuration=vis.configuration, integration_time=cintegration_time,
-                               polarisation_frame=vis.polarisation_frame, cindex=cindex,
-                               blockvis=vis)
+    plan = get_coalescence_plan(vis, time_coal, max_time_coal, frequency_coal, max_frequency_coal)
+    coalesced_vis = create_visibility_from_coalescence_plan(vis, plan)
     
     log.debug('coalesce_visibility: Created new Visibility for coalesced data, coalescence factors (t,f) = (%.3f,%.3f)'
              % (time_coal, frequency_coal))
@@ -83,23 +79,278 @@ def convert_blockvisibility_to_visibility(vis: BlockVisibility) -> Visibility:
     
     assert type(vis) is BlockVisibility, "vis is not a BlockVisibility: %r" % vis
     
-    cvis, cuvw, cwts, ctime, cfrequency, cchannel_bandwidth, ca1, ca2, cintegration_time, cindex \
-        = convert_blocks(vis.data['vis'], vis.data['uvw'], vis.data['weight'], vis.time, vis.integration_time,
-                         vis.frequency, vis.channel_bandwidth)
-    cimwt = numpy.ones(cvis.shape)
-    converted_vis = Visibility(uvw=cuvw, time=ctime, frequency=cfrequency,
-                               channel_bandwidth=cchannel_bandwidth,
-                               phasecentre=vis.phasecentre, antenna1=ca1, antenna2=ca2, vis=cvis,
-                               weight=cwts, imaging_weight=cimwt,
-                               configuration=vis.configuration, integration_time=cintegration_time,
-                               polarisation_frame=vis.polarisation_frame, cindex=cindex,
-                               blockvis=vis)
+    plan = get_coalescence_plan(vis)
+    converted_vis = create_visibility_from_coalescence_plan(vis, plan)
     
     log.debug('convert_visibility: Original %s, converted %s' % (vis_summary(vis), vis_summary(converted_vis)))
     
     return converted_vis
 
 
+def coalesce_visibility_iter(vis_iter, **kwargs):
+    """ Coalesce a stream of BlockVisibility chunks, yielding a stream of coalesced Visibility
+    
+    For real-time processing, where the data arrive a few integrations at a time. The averaging is as in
+    coalesce_visibility except that the averaging factors are calculated for each chunk, and only the baselines
+    antenna1 < antenna2 are coalesced. The partially filled averaging bins are kept for each baseline, so the memory
+    needed does not grow with the length of the stream. If the averaging factors of a baseline change between
+    chunks, its partially filled bins are completed first. A Visibility holding the rows completed by each chunk is
+    yielded, and then one holding the rows still open at the end of the stream.
+    
+    The integration time and channel bandwidth of each row are the totals of those averaged. The coalesced rows
+    have no cindex or blockvis and so cannot be decoalesced.
+    
+    :param vis_iter: Iterable of BlockVisibility in time order, all with the same configuration and frequencies
+    :param time_coal: Time coalescence factor, 0.0 for no coalescence
+    :param max_time_coal: Maximum number of integrations to average
+    :param frequency_coal: Frequency coalescence factor, 0.0 for no coalescence
+    :param max_frequency_coal: Maximum number of channels to average
+    :returns: Generator of Visibility
+    """
+    time_coal = get_parameter(kwargs, 'time_coal', 0.0)
+    max_time_coal = get_parameter(kwargs, 'max_time_coal', 100)
+    frequency_coal = get_parameter(kwargs, 'frequency_coal', 0.0)
+    max_frequency_coal = get_parameter(kwargs, 'max_frequency_coal', 100)
+    
+    template = None
+    for vis in vis_iter:
+        assert type(vis) is BlockVisibility, "vis is not a BlockVisibility: %r" % vis
+        if template is None:
+            template = vis
+            antenna1, antenna2 = vis.baselines
+            nbaselines = len(antenna1)
+            frequency = numpy.copy(vis.frequency)
+            time_average = numpy.zeros([nbaselines], dtype='int')
+            frequency_average = numpy.zeros([nbaselines], dtype='int')
+            
+            # Each baseline has a bin for each channel, of which the first frequency_chunks are in use
+            nbins = nbaselines * vis.nchan
+            bin_baseline = numpy.repeat(numpy.arange(nbaselines), vis.nchan)
+            bin_chunk = numpy.tile(numpy.arange(vis.nchan), nbaselines)
+            sums = {'vis': numpy.zeros([nbins, vis.npol], dtype='complex'),
+                    'weight': numpy.zeros([nbins, vis.npol]),
+                    'allpwts': numpy.zeros([nbins]),
+                    'time': numpy.zeros([nbins]),
+                    'frequency': numpy.zeros([nbins]),
+                    'uvw': numpy.zeros([nbins, 3])}
+            integration_time = numpy.zeros([nbaselines])
+            integrations = numpy.zeros([nbaselines], dtype='int')
+            
+            def complete(baselines):
+                # Average the bins of the baselines, and then empty them
+                rows = baselines[bin_baseline] & (bin_chunk < frequency_chunks[bin_baseline])
+                allpwts = sums['allpwts'][rows]
+                norm = numpy.where(allpwts > 0.0, allpwts, 1.0)
+                weight = sums['weight'][rows]
+                columns = {'vis': sums['vis'][rows] / numpy.where(weight > 0.0, weight, 1.0),
+                           'weight': weight,
+                           'time': sums['time'][rows] / norm,
+                           'frequency': sums['frequency'][rows] / norm,
+                           'uvw': sums['uvw'][rows] / norm[:, numpy.newaxis],
+                           'channel_bandwidth': bin_bandwidth[rows],
+                           'integration_time': integration_time[bin_baseline[rows]],
+                           'antenna1': antenna1[bin_baseline[rows]],
+                           'antenna2': antenna2[bin_baseline[rows]]}
+                for name in sums:
+                    sums[name][baselines[bin_baseline]] = 0.0
+                integration_time[baselines] = 0.0
+                integrations[baselines] = 0
+                return columns
+        else:
+            assert numpy.array_equal(vis.frequency, frequency), "Frequencies change within the stream"
+            assert vis.nants == template.nants, "Number of antennas changes within the stream"
+        
+        completed = []
+        if time_coal == 0.0 and frequency_coal == 0.0:
+            chunk_time_average = numpy.ones([nbaselines], dtype='int')
+            chunk_frequency_average = numpy.ones([nbaselines], dtype='int')
+        else:
+            chunk_time_average, chunk_frequency_average = \
+                get_averaging_factors(vis.uvw, numpy.ones([1, vis.nants, vis.nants, 1]), time_coal,
+                                      max_time_coal, frequency_coal, max_frequency_coal)
+            chunk_time_average = chunk_time_average[antenna2, antenna1]
+            chunk_frequency_average = chunk_frequency_average[antenna2, antenna1]
+        changed = (chunk_time_average != time_average) | (chunk_frequency_average != frequency_average)
+        if numpy.any(changed):
+            if numpy.any(changed & (integrations > 0)):
+                completed.append(complete(changed & (integrations > 0)))
+            time_average, frequency_average = chunk_time_average, chunk_frequency_average
+            frequency_chunks = (vis.nchan + frequency_average - 1) // frequency_average
+            bins = vis.nchan * numpy.arange(nbaselines)[:, numpy.newaxis] + \
+                numpy.arange(vis.nchan)[numpy.newaxis, :] // frequency_average[:, numpy.newaxis]
+            bin_bandwidth = numpy.bincount(bins.reshape([-1]), numpy.tile(vis.channel_bandwidth, nbaselines),
+                                           minlength=nbins)
+        
+        blvis, blweight, bluvw = vis.blvis, vis.blweight, vis.bluvw
+        for itime in range(vis.nvis):
+            allpwts = numpy.sum(blweight[itime], axis=2)
+            numpy.add.at(sums['vis'], bins, blweight[itime] * blvis[itime])
+            numpy.add.at(sums['weight'], bins, blweight[itime])
+            numpy.add.at(sums['allpwts'], bins, allpwts)
+            numpy.add.at(sums['time'], bins, allpwts * vis.time[itime])
+            numpy.add.at(sums['frequency'], bins, allpwts * frequency)
+            uvw = bluvw[itime][:, numpy.newaxis, :] * (frequency / constants.c.value)[:, numpy.newaxis]
+            numpy.add.at(sums['uvw'], bins, allpwts[..., numpy.newaxis] * uvw)
+            integration_time += vis.integration_time[itime]
+            integrations += 1
+            
+            finished = integrations == time_average
+            if numpy.any(finished):
+                completed.append(complete(finished))
+        
+        if len(completed) > 0:
+            yield create_visibility_from_coalesced_rows(vis, completed)
+    
+    if template is not None and numpy.any(integrations > 0):
+        yield create_visibility_from_coalesced_rows(template, [complete(integrations > 0)])
+
+
+def create_visibility_from_coalesced_rows(vis: BlockVisibility, completed) -> Visibility:
+    """ Create a Visibility from a list of blocks of coalesced rows, as made by coalesce_visibility_iter
+    
+    :param vis: BlockVisibility from which the rows were coalesced
+    :param completed: List of dicts of columns
+    :returns: Visibility
+    """
+    columns = {name: numpy.concatenate([block[name] for block in completed]) for name in completed[0]}
+    return Visibility(uvw=columns['uvw'], time=columns['time'], frequency=columns['frequency'],
+                      channel_bandwidth=columns['channel_bandwidth'], phasecentre=vis.phasecentre,
+                      antenna1=columns['antenna1'], antenna2=columns['antenna2'], vis=columns['vis'],
+                      weight=columns['weight'], imaging_weight=numpy.ones(columns['weight'].shape),
+                      configuration=vis.configuration, integration_time=columns['integration_time'],
+                      polarisation_frame=vis.polarisation_frame)
+
+
+def get_coalescence_plan(vis: BlockVisibility, time_coal=0.0, max_time_coal=100, frequency_coal=0.0,
+                         max_frequency_coal=100):
+    """ Get the plan for coalescing a BlockVisibility: everything in the coalesced Visibility but vis and weight
+    
+    The plan holds the uvw, time, frequency, channel_bandwidth, integration_time, antenna1 and antenna2 columns
+    of the coalesced data, the index cindex from the BlockVisibility to the coalesced rows, and the baselines
+    that are coalesced. The averaging factors and the averaged uvw, time and frequency depend on the weights. The
+    plan is cached on vis for each set of coalescence factors and reused for as long as vis.data is the same table
+    and its uvw, time and weight columns are unchanged (see get_coalescence_checksum).
+    
+    :param vis: BlockVisibility
+    :param time_coal: Time coalescence factor, 0.0 for no coalescence
+    :param max_time_coal: Maximum number of integrations to average
+    :param frequency_coal: Frequency coalescence factor, 0.0 for no coalescence
+    :param max_frequency_coal: Maximum number of channels to average
+    :returns: dict
+    """
+    key = (time_coal, max_time_coal, frequency_coal, max_frequency_coal)
+    checksum = get_coalescence_checksum(vis)
+    if vis.coalescence_cache is not None:
+        dataref, cachechecksum, plans = vis.coalescence_cache
+        if dataref() is vis.data and cachechecksum == checksum and key in plans:
+            return plans[key]
+    
+    if time_coal == 0.0 and frequency_coal == 0.0:
+        # Format conversion only: every baseline antenna1 < antenna2 is kept
+        _, cuvw, _, ctime, cfrequency, cchannel_bandwidth, ca1, ca2, cintegration_time, cindex \
+            = convert_blocks(vis.data.column('vis'), vis.data.column('uvw'), vis.data.column('weight'), vis.time,
+                             vis.integration_time, vis.frequency, vis.channel_bandwidth)
+        baselines = None
+    else:
+        _, cuvw, _, ctime, cfrequency, cchannel_bandwidth, ca1, ca2, cintegration_time, cindex \
+            = average_in_blocks(vis.vis, vis.uvw, vis.weight, vis.time, vis.integration_time,
+                                vis.frequency, vis.channel_bandwidth, time_coal, max_time_coal,
+                                frequency_coal, max_frequency_coal)
+    
+    cindex.flags.writeable = False
+    plan = {'uvw': cuvw, 'time': ctime, 'frequency': cfrequency, 'channel_bandwidth': cchannel_bandwidth,
+            'integration_time': cintegration_time, 'antenna1': ca1, 'antenna2': ca2, 'cindex': cindex,
+            'baselines': None}
+    
+    if time_coal != 0.0 or frequency_coal != 0.0:
+        # The baselines are coalesced in turn, each into a block of rows [time chunk, frequency chunk]
+        allpwtsgrid = numpy.sum(vis.weight, axis=4)
+        time_average, frequency_average = get_averaging_factors(vis.uvw, allpwtsgrid, time_coal, max_time_coal,
+                                                                frequency_coal, max_frequency_coal)
+        baselines = numpy.any(allpwtsgrid, axis=(0, 3))
+        time_average = time_average[baselines]
+        frequency_average = frequency_average[baselines]
+        time_chunks = (vis.nvis + time_average - 1) // time_average
+        frequency_chunks = (vis.nchan + frequency_average - 1) // frequency_average
+        nrows = time_chunks * frequency_chunks
+        assert numpy.sum(nrows) == len(ctime), "Mismatch between number of rows in plan and coalesced visibility"
+        plan.update({'baselines': baselines, 'time_average': time_average, 'frequency_average': frequency_average,
+                     'frequency_chunks': frequency_chunks, 'row_start': numpy.cumsum(nrows) - nrows})
+    
+    if vis.coalescence_cache is None or vis.coalescence_cache[0]() is not vis.data or \
+            vis.coalescence_cache[1] != checksum:
+        vis.coalescence_cache = (weakref.ref(vis.data), checksum, {})
+    vis.coalescence_cache[2][key] = plan
+    return plan
+
+
+def get_coalescence_checksum(vis: BlockVisibility):
+    """ Get a checksum of the columns of a BlockVisibility on which the coalescence plan depends
+    
+    The columns may be changed in place, e.g. by flagging, so the plan cached by get_coalescence_plan is checked
+    against this. It takes a small fraction of the time needed to coalesce.
+    
+    :param vis: BlockVisibility
+    :returns: Digest of the uvw, time and weight columns
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for name in ['uvw', 'time', 'weight']:
+        digest.update(numpy.ascontiguousarray(vis.data.column(name)).data)
+    return digest.digest()
+
+
+def create_visibility_from_coalescence_plan(vis: BlockVisibility, plan) -> Visibility:
+    """ Coalesce the vis and weight columns of a BlockVisibility according to a plan from get_coalescence_plan
+    
+    Each coalesced value is the weighted average of the values in the blocks that map to it, and each weight the
+    sum of their weights.
+    
+    :param vis: BlockVisibility
+    :param plan: Plan from get_coalescence_plan
+    :returns: Coalesced Visibility with cindex and blockvis filled in
+    """
+    cnvis = len(plan['time'])
+    npol = vis.npol
+    if plan['baselines'] is None:
+        if vis.compact:
+            cvis, cwts = vis.blvis, vis.blweight
+        else:
+            antenna1, antenna2 = vis.baselines
+            cvis = vis.data.column('vis')[:, antenna2, antenna1]
+            cwts = vis.data.column('weight')[:, antenna2, antenna1]
+        cvis = cvis.reshape([cnvis, npol])
+        cwts = cwts.reshape([cnvis, npol])
+    else:
+        # Weighted sums over the elements of the coalesced baselines that map to each row
+        baselines = plan['baselines']
+        itime = numpy.arange(vis.nvis)[:, numpy.newaxis, numpy.newaxis]
+        ichan = numpy.arange(vis.nchan)[numpy.newaxis, numpy.newaxis, :]
+        rows = plan['row_start'][:, numpy.newaxis] + \
+            (itime // plan['time_average'][:, numpy.newaxis]) * plan['frequency_chunks'][:, numpy.newaxis] + \
+            ichan // plan['frequency_average'][:, numpy.newaxis]
+        rows = rows.reshape([-1])
+        blockvis = vis.vis[:, baselines].reshape([-1, npol])
+        blockwts = vis.weight[:, baselines].reshape([-1, npol])
+        cvis = numpy.zeros([cnvis, npol], dtype='complex')
+        cwts = numpy.zeros([cnvis, npol])
+        for pol in range(npol):
+            wvis = blockwts[:, pol] * blockvis[:, pol]
+            cwts[:, pol] = numpy.bincount(rows, blockwts[:, pol], minlength=cnvis)
+            cvis[:, pol].real = numpy.bincount(rows, wvis.real, minlength=cnvis)
+            cvis[:, pol].imag = numpy.bincount(rows, wvis.imag, minlength=cnvis)
+        mask = cwts > 0.0
+        cvis[mask] = cvis[mask] / cwts[mask]
+    
+    cimwt = numpy.ones(cvis.shape)
+    return Visibility(uvw=plan['uvw'], time=plan['time'], frequency=plan['frequency'],
+                      channel_bandwidth=plan['channel_bandwidth'],
+                      phasecentre=vis.phasecentre, antenna1=plan['antenna1'], antenna2=plan['antenna2'], vis=cvis,
+                      weight=cwts, imaging_weight=cimwt,
+                      configuration=vis.configuration, integration_time=plan['integration_time'],
+                      polarisation_frame=vis.polarisation_frame, cindex=plan['cindex'],
+                      blockvis=vis)
+
+
 def decoalesce_visibility(vis, overwrite=False):
     """ Decoalesce the visibilities to the original values (opposite of coalesce_visibility)
     
@@ -123,19 +374,53 @@ def decoalesce_visibility(vis, overwrite=False):
         log.debug('decoalesce_visibility: Filled decoalesced data into template')
         decomp_vis = vis.blockvis
     
-    vshape = decomp_vis.data['vis'].shape
+    # The index is into the square layout
+    if decomp_vis.compact:
+        blockvis = decomp_vis.vis
+    else:
+        blockvis = decomp_vis.data['vis']
+    decoalesce_into(blockvis, vis.data['vis'], vis.cindex)
     
-    npol = vshape[-1]
-    dvis = numpy.zeros(vshape, dtype='complex')
-    assert numpy.max(vis.cindex) < dvis.size
-    for i in range(dvis.size // npol):
-        decomp_vis.data['vis'].flat[i:i + npol] = vis.data['vis'][vis.cindex[i]]
+    if decomp_vis.compact:
+        antenna1, antenna2 = decomp_vis.baselines
+        decomp_vis.data['vis'][...] = blockvis[:, antenna2, antenna1]
     
     log.debug('decoalesce_visibility: Coalesced %s, decoalesced %s' % (vis_summary(vis), vis_summary(decomp_vis)))
     
     return decomp_vis
 
 
+def get_averaging_factors(uvw, allpwtsgrid, time_coal=1.0, max_time_coal=100, frequency_coal=1.0,
+                          max_frequency_coal=100):
+    """ Get the number of integrations and channels to average for each baseline
+    
+    :param uvw: uvw blocks [ntimes, nant, nant, 3]
+    :param allpwtsgrid: Weights summed over polarisation [ntimes, nant, nant, nchan]
+    :returns: time_average, frequency_average [nant, nant]
+    """
+    nant = uvw.shape[1]
+    
+    # Now calculate on a baseline basis the time and frequency averaging. We do this by looking at
+    # the maximum uv distance for all data and for a given baseline. The integration time and
+    # channel bandwidth are scale appropriately.
+    uvmax = numpy.sqrt(numpy.max(uvw[:, 0] ** 2 + uvw[:, 1] ** 2 + uvw[:, 2] ** 2))
+    uvdist = numpy.max(numpy.sqrt(uvw[..., 0] ** 2 + uvw[..., 1] ** 2), axis=0)
+    baselines = numpy.any(allpwtsgrid, axis=(0, 3))
+    moving = baselines & (uvdist > 0.0)
+    stationary = baselines & (uvdist == 0.0)
+    
+    time_average = numpy.ones([nant, nant], dtype='int')
+    frequency_average = numpy.ones([nant, nant], dtype='int')
+    time_average[moving] = numpy.minimum(max_time_coal, numpy.maximum(1, numpy.round(
+        time_coal * uvmax / uvdist[moving]).astype('int')))
+    frequency_average[moving] = numpy.minimum(max_frequency_coal, numpy.maximum(1, numpy.round(
+        frequency_coal * uvmax / uvdist[moving]).astype('int')))
+    time_average[stationary] = max_time_coal
+    frequency_average[stationary] = max_frequency_coal
+    
+    return time_average, frequency_average
+
+
 def average_in_blocks(vis, uvw, wts, times, integration_time, frequency, channel_bandwidth, time_coal=1.0,
                       max_time_coal=100, frequency_coal=1.0, max_frequency_coal=100):
     # Calculate the averaging factors for time and frequency making them the same for all times
@@ -149,132 +434,89 @@ def average_in_blocks(vis, uvw, wts, times, integration_time, frequency, channel
     
     # Pol independent weighting
     allpwtsgrid = numpy.sum(wts, axis=4)
-    # Pol and frequency independent weighting
-    allcpwtsgrid = numpy.sum(allpwtsgrid, axis=3)
-    # Pol and time independent weighting
-    alltpwtsgrid = numpy.sum(allpwtsgrid, axis=0)
     
-    # Now calculate on a baseline basis the time and frequency averaging. We do this by looking at
-    # the maximum uv distance for all data and for a given baseline. The integration time and
-    # channel bandwidth are scale appropriately.
-    uvmax = numpy.sqrt(numpy.max(uvw[:, 0] ** 2 + uvw[:, 1] ** 2 + uvw[:, 2] ** 2))
-    time_average = numpy.ones([nant, nant], dtype='int')
-    frequency_average = numpy.ones([nant, nant], dtype='int')
-    ua = numpy.arange(nant)
-    for a2 in ua:
-        for a1 in ua:
-            if allpwtsgrid[:, a2, a1, :].any() > 0.0:
-                uvdist = numpy.max(numpy.sqrt(uvw[:, a2, a1, 0] ** 2 + uvw[:, a2, a1, 1] ** 2), axis=0)
-                if uvdist > 0.0:
-                    time_average[a2, a1] = min(max_time_coal,
-                                               max(1, int(round((time_coal * uvmax / uvdist)))))
-                    frequency_average[a2, a1] = min(max_frequency_coal,
-                                                    max(1, int(round(frequency_coal * uvmax / uvdist))))
-                else:
-                    time_average[a2, a1] = max_time_coal
-                    frequency_average[a2, a1] = max_frequency_coal
-    
-    # See how many time chunks and frequency we need for each baseline. To do this we use the same averaging that
-    # we will use later for the actual data. This tells us the number of chunks required for each baseline.
-    frequency_grid, time_grid = numpy.meshgrid(frequency, times)
-    channel_bandwidth_grid, integration_time_grid = numpy.meshgrid(channel_bandwidth, integration_time)
-    cnvis = 0
-    time_chunk_len = numpy.ones([nant, nant], dtype='int')
-    frequency_chunk_len = numpy.ones([nant, nant], dtype='int')
-    for a2 in ua:
-        for a1 in ua:
-            if (time_average[a2, a1] > 0) & (frequency_average[a2, a1] > 0 & (allpwtsgrid[:, a2, a1, ...].any() > 0.0)):
-                def average_from_grid(arr):
-                    return average_chunks2(arr, allpwtsgrid[:, a2, a1, :],
-                                           (time_average[a2, a1], frequency_average[a2, a1]))
-                
-                # time_chunks, _ = average_from_grid(timesgrid)
-                time_chunks, _ = average_chunks(times, allcpwtsgrid[:, a2, a1], time_average[a2, a1])
-                time_chunk_len[a2, a1] = time_chunks.shape[0]
-                # frequency_chunks, _ = average_from_grid(frequencygrid)
-                frequency_chunks, _ = average_chunks(frequency, alltpwtsgrid[a2, a1, :], frequency_average[a2, a1])
-                frequency_chunk_len[a2, a1] = frequency_chunks.shape[0]
-                nrows = time_chunk_len[a2, a1] * frequency_chunk_len[a2, a1]
-                cnvis += nrows
+    time_average, frequency_average = get_averaging_factors(uvw, allpwtsgrid, time_coal, max_time_coal,
+                                                            frequency_coal, max_frequency_coal)
+    
+    # The baselines with data are coalesced in turn (a2, a1 in row-major order), each into a block of rows
+    # [time chunk, frequency chunk]
+    antenna2, antenna1 = numpy.nonzero(numpy.any(allpwtsgrid, axis=(0, 3)))
+    time_average = time_average[antenna2, antenna1]
+    frequency_average = frequency_average[antenna2, antenna1]
+    time_chunk_len = (ntimes + time_average - 1) // time_average
+    frequency_chunk_len = (nchan + frequency_average - 1) // frequency_average
+    nrows = time_chunk_len * frequency_chunk_len
+    row_start = numpy.cumsum(nrows) - nrows
+    cnvis = numpy.sum(nrows)
     
-    # Now we know enough to define the output coalesced arrays. The shape will be
-    # succesive a1, a2: [len_time_chunks[a2,a1], a2, a1, len_frequency_chunks[a2,a1]]
     ctime = numpy.zeros([cnvis])
     cfrequency = numpy.zeros([cnvis])
     cchannel_bandwidth = numpy.zeros([cnvis])
     cvis = numpy.zeros([cnvis, npol], dtype='complex')
     cwts = numpy.zeros([cnvis, npol])
     cuvw = numpy.zeros([cnvis, 3])
-    ca1 = numpy.zeros([cnvis], dtype='int')
-    ca2 = numpy.zeros([cnvis], dtype='int')
+    ca1 = numpy.repeat(antenna1, nrows)
+    ca2 = numpy.repeat(antenna2, nrows)
     cintegration_time = numpy.zeros([cnvis])
     
-    # For decoalescence we keep an index to map back to the original BlockVisibility
-    rowgrid = numpy.zeros([ntimes, nant, nant, nchan], dtype='int')
-    rowgrid.flat = range(rowgrid.size)
-    
-    cindex = numpy.zeros([rowgrid.size], dtype='int')
-    
-    # Now go through, chunking up the various arrays. Everything is converted into an array with
-    # axes [time, channel] and then it is averaged over time and frequency chunks for
-    # this baseline.
-    # To aid decoalescence we will need an index of which output elements a given input element
-    # contributes to. This is a many to one. The decoalescence will then just consist of using
-    # this index to extract the coalesced value that a given input element contributes towards.
-    
-    visstart = 0
-    for a2 in ua:
-        for a1 in ua:
-            if (time_chunk_len[a2, a1] > 0) & (frequency_chunk_len[a2, a1] > 0) & \
-                    (allpwtsgrid[:, a2, a1, :].any() > 0.0):
-                
-                nrows = time_chunk_len[a2, a1] * frequency_chunk_len[a2, a1]
-                rows = slice(visstart, visstart + nrows)
-                
-                cindex.flat[rowgrid[:, a2, a1, :]] = numpy.array(range(visstart, visstart + nrows))
-                
-                ca1[rows] = a1
-                ca2[rows] = a2
-                
-                # Average over time and frequency for case where polarisation isn't an issue
-                def average_from_grid(arr):
-                    return average_chunks2(arr, allpwtsgrid[:, a2, a1, :], \
-                                           (time_average[a2, a1], frequency_average[a2, a1]))[0]
-                
-                ctime[rows] = average_from_grid(time_grid).flatten()
-                cfrequency[rows] = average_from_grid(frequency_grid).flatten()
-                
-                for axis in range(3):
-                    uvwgrid = numpy.outer(uvw[:, a2, a1, axis], frequency / constants.c.value)
-                    cuvw[rows, axis] = average_from_grid(uvwgrid).flatten()
-                
-                # For some variables, we need the sum not the average
-                def sum_from_grid(arr):
-                    result = average_chunks2(arr, allpwtsgrid[:, a2, a1, :], \
-                                             (time_average[a2, a1], frequency_average[a2, a1]))
-                    return result[0] * result[0].size
-                
-                cintegration_time[rows] = sum_from_grid(integration_time_grid).flatten()
-                cchannel_bandwidth[rows] = sum_from_grid(channel_bandwidth_grid).flatten()
-                
-                # For the polarisations we have to perform the time-frequency average separately for each polarisation
-                for pol in range(npol):
-                    result = average_chunks2(vis[:, a2, a1, :, pol], wts[:, a2, a1, :, pol],
-                                             (time_average[a2, a1], frequency_average[a2, a1]))
-                    cvis[rows, pol], cwts[rows, pol] = result[0].flatten(), result[1].flatten()
-                
-                visstart += nrows
-    
-    assert cnvis == visstart, "Mismatch between number of rows in coalesced visibility and index"
+    # For decoalescence we keep an index to map back to the original BlockVisibility. Each element [time, channel]
+    # of a baseline maps to the row of its time and frequency chunks.
+    cindex = numpy.zeros([ntimes, nant, nant, nchan], dtype='int')
+    itime = numpy.arange(ntimes)[:, numpy.newaxis, numpy.newaxis]
+    ichan = numpy.arange(nchan)[numpy.newaxis, numpy.newaxis, :]
+    cindex[:, antenna2, antenna1, :] = row_start[:, numpy.newaxis] + \
+        (itime // time_average[:, numpy.newaxis]) * frequency_chunk_len[:, numpy.newaxis] + \
+        ichan // frequency_average[:, numpy.newaxis]
+    cindex = cindex.reshape([-1])
+    
+    # Baselines with the same averaging factors are averaged together. Everything is converted into an array
+    # with axes [baseline, time, channel] and then it is averaged over time and frequency chunks.
+    for ta, fa in set(zip(time_average, frequency_average)):
+        group = (time_average == ta) & (frequency_average == fa)
+        a1, a2 = antenna1[group], antenna2[group]
+        tlen, flen = time_chunk_len[group][0], frequency_chunk_len[group][0]
+        rows = row_start[group][:, numpy.newaxis, numpy.newaxis] + \
+            numpy.arange(tlen)[numpy.newaxis, :, numpy.newaxis] * flen + \
+            numpy.arange(flen)[numpy.newaxis, numpy.newaxis, :]
+        
+        groupwts = numpy.transpose(allpwtsgrid[:, a2, a1, :], [1, 0, 2])
+        
+        def average_from_grid(arr):
+            return average_chunks2(numpy.broadcast_to(arr, groupwts.shape), groupwts, (ta, fa))[0]
+        
+        ctime[rows] = average_from_grid(times[:, numpy.newaxis])
+        cfrequency[rows] = average_from_grid(frequency)
+        
+        for axis in range(3):
+            uvwgrid = uvw[:, a2, a1, axis].T[..., numpy.newaxis] * (frequency / constants.c.value)
+            cuvw[rows, axis] = average_from_grid(uvwgrid)
+        
+        # For some variables, we need the sum not the average
+        cintegration_time[rows] = average_from_grid(integration_time[:, numpy.newaxis]) * (tlen * flen)
+        cchannel_bandwidth[rows] = average_from_grid(channel_bandwidth) * (tlen * flen)
+        
+        # The polarisations are averaged separately, each with its own weights
+        groupvis, groupvwts = average_chunks2(numpy.transpose(vis[:, a2, a1], [1, 3, 0, 2]),
+                                              numpy.transpose(wts[:, a2, a1], [1, 3, 0, 2]), (ta, fa))
+        cvis[rows] = numpy.transpose(groupvis, [0, 2, 3, 1])
+        cwts[rows] = numpy.transpose(groupvwts, [0, 2, 3, 1])
     
     return cvis, cuvw, cwts, ctime, cfrequency, cchannel_bandwidth, ca1, ca2, cintegration_time, cindex
 
 
 def convert_blocks(vis, uvw, wts, times, integration_time, frequency, channel_bandwidth):
-    # The input visibility is a block of shape [ntimes, nant, nant, nchan, npol]. We will map this
-    # into rows like vis[npol] and with additional columns antenna1, antenna2, frequency
-    
-    ntimes, nant, _, nchan, npol = vis.shape
+    # The input visibility is a block of shape [ntimes, nant, nant, nchan, npol], or [ntimes, nbaselines,
+    # nchan, npol] in the compact layout. We will map this into rows like vis[npol] and with additional
+    # columns antenna1, antenna2, frequency. The rows are ordered by time, antenna1, antenna2 (antenna1 <
+    # antenna2) and channel.
+    
+    if vis.ndim == 4:
+        ntimes, nbaselines, nchan, npol = vis.shape
+        nant = int(round((1 + numpy.sqrt(1 + 8 * nbaselines)) / 2))
+    else:
+        ntimes, nant, _, nchan, npol = vis.shape
+    antenna1, antenna2 = get_baselines(nant)
+    nbaselines = len(antenna1)
     
     cnvis = ntimes * nant * (nant - 1) * nchan // 2
     
@@ -290,39 +532,46 @@ def convert_blocks(vis, uvw, wts, times, integration_time, frequency, channel_ba
     ca2 = numpy.zeros([cnvis], dtype='int')
     cintegration_time = numpy.zeros([cnvis])
     
-    # For decoalescence we keep an index to map back to the original BlockVisibility
-    rowgrid = numpy.zeros([ntimes, nant, nant, nchan], dtype='int')
-    rowgrid.flat = range(rowgrid.size)
-    
-    cindex = numpy.zeros([rowgrid.size], dtype='int')
-    
-    # Now go through, chunking up the various arrays. Everything is converted into an array with
-    # axes [time, channel] and then it is averaged over time and frequency chunks for
-    # this baseline.
-    # To aid decoalescence we will need an index of which output elements a given input element
-    # contributes to. This is a many to one. The decoalescence will then just consist of using
-    # this index to extract the coalesced value that a given input element contributes towards.
-    
-    row = 0
-    for itime in range(ntimes):
-        for a1 in range(nant):
-            for a2 in range(a1 + 1, nant):
-                for chan in range(nchan):
-                    ca1[row] = a1
-                    ca2[row] = a2
-                    cfrequency[row] = frequency[chan]
-                    ctime[row] = times[itime]
-                    
-                    cuvw[row, :] = uvw[itime, a2, a1, :] * frequency[chan] / constants.c.value
-                    
-                    cindex.flat[rowgrid[itime, a2, a1, chan]] = row
-                    cintegration_time[row] = integration_time[itime]
-                    cchannel_bandwidth[row] = channel_bandwidth[chan]
-                    cvis[row, :] = vis[itime, a2, a1, chan, :]
-                    cwts[row, :] = wts[itime, a2, a1, chan, :]
-                    row += 1
+    ctime[...] = numpy.repeat(times, nbaselines * nchan)
+    cintegration_time[...] = numpy.repeat(integration_time, nbaselines * nchan)
+    ca1[...] = numpy.tile(numpy.repeat(antenna1, nchan), ntimes)
+    ca2[...] = numpy.tile(numpy.repeat(antenna2, nchan), ntimes)
+    cfrequency[...] = numpy.tile(frequency, ntimes * nbaselines)
+    cchannel_bandwidth[...] = numpy.tile(channel_bandwidth, ntimes * nbaselines)
     
-    return cvis, cuvw, cwts, ctime, cfrequency, cchannel_bandwidth, ca1, ca2, cintegration_time, cindex
+    # Gather the baselines from the blocks
+    if vis.ndim == 4:
+        blockuvw, blockvis, blockwts = uvw, vis, wts
+    else:
+        blockuvw = uvw[:, antenna2, antenna1]
+        blockvis = vis[:, antenna2, antenna1]
+        blockwts = wts[:, antenna2, antenna1]
+    cuvw[...] = (blockuvw[:, :, numpy.newaxis, :] * frequency[:, numpy.newaxis] / constants.c.value).reshape([-1, 3])
+    cvis[...] = blockvis.reshape([-1, npol])
+    cwts[...] = blockwts.reshape([-1, npol])
+    
+    # For decoalescence we keep an index to map back to the original BlockVisibility. This is of the
+    # square layout [ntimes, nant, nant, nchan], giving for each element the row to which it contributes.
+    cindex = numpy.zeros([ntimes, nant, nant, nchan], dtype='int')
+    cindex[:, antenna2, antenna1, :] = numpy.arange(cnvis).reshape([ntimes, nbaselines, nchan])
+    
+    return cvis, cuvw, cwts, ctime, cfrequency, cchannel_bandwidth, ca1, ca2, cintegration_time, cindex.reshape([-1])
+
+
+def decoalesce_into(dvis, cvis, cindex):
+    """Fill a block of visibility from coalesced data using the index from coalescence
+    
+    Element i of the index gives the coalesced row for the npol values of element i of the block without its
+    polarisation axis, i.e. of dvis.reshape([-1, npol])[i].
+    
+    :param dvis: Block visibility to be filled (in place)
+    :param cvis: Coalesced visibility values
+    :param cindex: Index array from coalescence
+    """
+    npol = dvis.shape[-1]
+    assert len(cindex) == dvis.size // npol, "Index does not match the block"
+    assert numpy.max(cindex) < len(cvis)
+    dvis[...] = cvis[cindex].reshape(dvis.shape)
 
 
 def decoalesce_vis(vshape, cvis, cindex):
@@ -336,12 +585,8 @@ def decoalesce_vis(vshape, cvis, cindex):
     :param cindex: Index array from coalescence
     :returns: uncoalesced vis
     """
-    npol = vshape[-1]
     dvis = numpy.zeros(vshape, dtype='complex')
-    assert numpy.max(cindex) < dvis.size
-    for i in range(dvis.size // npol):
-        dvis.flat[i:i + npol] = cvis[cindex[i]]
-    
+    decoalesce_into(dvis, cvis, cindex)
     return dvis
 
 
@@ -7,10 +7,18 @@ A typical use would be to make a sequence of snapshot images::
         dirtySnapshot = create_image_from_visibility(visslice, npixel=512, cellsize=0.001, npol=1)
         dirtySnapshot, sumwt = invert_2d(visslice, dirtySnapshot)
 
+The selections can be made with an index of the rows, built once by create_row_index, instead of a scan of
+all rows::
+
+    create_row_index(vt)
+    for rows in vis_timeslice_iter(vt):
+        ...
+    rows = select_rows(vt, 'baseline', (1, 2))
 
 """
 
 import logging
+import weakref
 
 import numpy
 
@@ -27,13 +35,14 @@ def vis_timeslice_iter(vis, **kwargs):
     unique elements of the vis time.
           
     :param timeslice: Timeslice (seconds) ('auto')
-    :returns: Boolean array with selected rows=True
+    :returns: Boolean array with selected rows=True, or sorted array of row numbers if vis has a row index
         
     """
     
     assert type(vis) == Visibility or type(vis) == BlockVisibility
     
-    uniquetimes = numpy.unique(vis.time)
+    index = get_row_index(vis, 'time')
+    uniquetimes = numpy.unique(vis.time) if index is None else index['unique']
     timeslice = get_parameter(kwargs, "timeslice", 'auto')
     if timeslice == 'auto':
         log.debug('vis_timeslice_iter: Found %d unique times' % len(uniquetimes))
@@ -44,9 +53,12 @@ def vis_timeslice_iter(vis, **kwargs):
             # Doesn't matter what we set it to.
             timeslice = vis.integration_time[0]
     boxes = timeslice * numpy.round(uniquetimes / timeslice).astype('int')
-        
+    
     for box in boxes:
-        rows = numpy.abs(vis.time - box) < 0.5 * timeslice
+        if index is not None:
+            rows = select_rows(vis, 'time', box, 0.5 * timeslice)
+        else:
+            rows = numpy.abs(vis.time - box) < 0.5 * timeslice
         yield rows
 
 
@@ -55,10 +67,15 @@ def vis_wstack_iter(vis, **kwargs):
 
     :param wstack: wstack (wavelengths)
     :param vis_slices: Number of slices (second in precedence to wstack)
-    :returns: Boolean array with selected rows=True
+    :returns: Boolean array with selected rows=True, or sorted array of row numbers if vis has a row index. None
+        if no rows are selected
     """
     assert type(vis) == Visibility or type(vis) == BlockVisibility
-    wmaxabs = (numpy.max(numpy.abs(vis.w)))
+    index = get_row_index(vis, 'w')
+    if index is None:
+        wmaxabs = (numpy.max(numpy.abs(vis.w)))
+    else:
+        wmaxabs = numpy.max(numpy.abs(index['unique'][[0, -1]]))
 
     wstack = get_parameter(kwargs, "wstack", None)
     if wstack is None:
@@ -70,8 +87,13 @@ def vis_wstack_iter(vis, **kwargs):
         boxes = numpy.linspace(- wmaxabs, +wmaxabs, vis_slices)
     
     for box in boxes:
-        rows = numpy.abs(vis.w - box) < 0.5 * wstack
-        if numpy.sum(rows) > 0:
+        if index is not None:
+            rows = select_rows(vis, 'w', box, 0.5 * wstack)
+            selected = len(rows) > 0
+        else:
+            rows = numpy.abs(vis.w - box) < 0.5 * wstack
+            selected = numpy.sum(rows) > 0
+        if selected:
             yield rows
         else:
             yield None
@@ -97,3 +119,130 @@ def vis_slice_iter(vis, **kwargs):
             yield range(row, min(row+step, vis.nvis))
 
 
+def create_row_index(vis, keys=None):
+    """ Build an index of the rows of a Visibility or BlockVisibility for selection by time, baseline or channel
+    
+    For each key the index holds the rows sorted by value (the sort is stable so each group of equal values is in
+    row order), the unique values, and the offset of each group of equal values in the sorted rows. Selections by
+    select_rows and the iterators then take a binary search rather than a scan of all rows. The index is kept on
+    vis and used for as long as vis.data is the same table and the indexed columns are unchanged, as given by
+    ColumnTable.version. Rows appended or a write to e.g. vis.data['uvw'] therefore make the index out of date, and
+    it is then not used.
+    
+    :param vis: Visibility or BlockVisibility
+    :param keys: Keys to index: 'time', 'baseline' (antenna1, antenna2), 'frequency' or 'w'. Default is all of
+        these for a Visibility and 'time' for a BlockVisibility
+    :returns: vis
+    """
+    assert type(vis) == Visibility or type(vis) == BlockVisibility
+    if keys is None:
+        keys = ['time', 'baseline', 'frequency', 'w'] if type(vis) == Visibility else ['time']
+    
+    index = {}
+    for key in keys:
+        values = get_row_index_values(vis, key)
+        order = numpy.argsort(values, kind='stable')
+        unique, offsets = numpy.unique(values[order], return_index=True)
+        index[key] = {'order': order, 'unique': unique, 'offsets': numpy.append(offsets, len(order)),
+                      'versions': get_row_index_versions(vis, key)}
+        if key == 'baseline':
+            index[key]['nants'] = get_nants(vis)
+    
+    vis.row_index = (weakref.ref(vis.data), index)
+    return vis
+
+
+def get_row_index(vis, key):
+    """ Get the index of the rows for key, if create_row_index has been called for vis and the columns are unchanged
+    
+    :param vis: Visibility or BlockVisibility
+    :param key: 'time', 'baseline', 'frequency' or 'w'
+    :returns: dict of order, unique and offsets, or None
+    """
+    row_index = getattr(vis, 'row_index', None)
+    if row_index is None:
+        return None
+    dataref, index = row_index
+    if dataref() is not vis.data:
+        return None
+    index = index.get(key)
+    if index is None or index['versions'] != get_row_index_versions(vis, key):
+        return None
+    return index
+
+
+def get_row_index_values(vis, key):
+    """ Get the values of key for each row
+    
+    The baseline is encoded as antenna1 * nants + antenna2 where nants is one more than the largest antenna number.
+    """
+    if key == 'baseline':
+        assert type(vis) == Visibility, "Only a Visibility can be indexed by baseline"
+        return vis.antenna1 * get_nants(vis) + vis.antenna2
+    assert key in ['time', 'frequency', 'w'], "Unknown index key %s" % key
+    if key in ['frequency', 'w']:
+        assert type(vis) == Visibility, "Only a Visibility can be indexed by %s" % key
+    return getattr(vis, key)
+
+
+def get_row_index_versions(vis, key):
+    """ Get the versions of the columns from which the values of key are taken
+    """
+    names = {'time': ['time'], 'baseline': ['antenna1', 'antenna2'], 'frequency': ['frequency'], 'w': ['uvw']}[key]
+    return tuple(vis.data.version(name) for name in names)
+
+
+def get_nants(vis):
+    return max(numpy.max(vis.antenna1), numpy.max(vis.antenna2)) + 1
+
+
+def select_rows(vis, key, value, halfwidth=None):
+    """ Select the rows where key equals value, or is within halfwidth of value
+    
+    The selection is as numpy.abs(values - value) < halfwidth, but uses the index from create_row_index if
+    there is one.
+    
+    :param vis: Visibility or BlockVisibility
+    :param key: 'time', 'baseline', 'frequency' or 'w'
+    :param value: Value, or (antenna1, antenna2) for 'baseline'
+    :param halfwidth: Half width of the range of values selected, None for equality
+    :returns: Sorted array of row numbers
+    """
+    index = get_row_index(vis, key)
+    if key == 'baseline':
+        antenna1, antenna2 = value
+        nants = get_nants(vis) if index is None else index['nants']
+        value = antenna1 * nants + antenna2
+    
+    if index is None:
+        values = get_row_index_values(vis, key)
+        if halfwidth is None:
+            return numpy.flatnonzero(values == value)
+        return numpy.flatnonzero(numpy.abs(values - value) < halfwidth)
+    
+    unique = index['unique']
+    if halfwidth is None:
+        first = numpy.searchsorted(unique, value)
+        last = first + 1 if first < len(unique) and unique[first] == value else first
+    else:
+        # The groups selected are contiguous. Search for the limits and then adjust to the exact test, since
+        # value +/- halfwidth is rounded.
+        def inside(group):
+            return numpy.abs(unique[group] - value) < halfwidth
+        
+        first = numpy.searchsorted(unique, value - halfwidth)
+        last = numpy.searchsorted(unique, value + halfwidth, side='right')
+        while first > 0 and inside(first - 1):
+            first -= 1
+        while first < last and not inside(first):
+            first += 1
+        while last < len(unique) and inside(last):
+            last += 1
+        while last > first and not inside(last - 1):
+            last -= 1
+    
+    offsets = index['offsets']
+    rows = index['order'][offsets[first]:offsets[last]]
+    if last - first > 1:
+        rows = numpy.sort(rows)
+    return rows
@@ -22,13 +22,19 @@ def vis_summary(vis):
 def append_visibility(vis: Visibility, othervis: Visibility):
     """Append othervis to vis
     
+    The data of vis is extended in place with spare capacity, so building up a visibility by appending many
+    chunks e.g. from create_blockvisibility_iterator takes time linear in the total number of rows.
+    
     :param vis:
     :param othervis:
     :returns: Visibility vis + othervis
     """
     assert vis.polarisation_frame == othervis.polarisation_frame
     assert vis.phasecentre == othervis.phasecentre
-    vis.data = numpy.hstack((vis.data, othervis.data))
+    vis.data.append(othervis.data)
+    vis.row_index = None
+    if type(vis) is Visibility:
+        vis.frequency_map_cache = None
     return vis
 
 
@@ -44,10 +50,35 @@ def copy_visibility(vis, zero=False):
     return newvis
 
 
+def create_derived_visibility(vis, zero=True):
+    """Create a visibility with its own vis column, sharing the other columns with vis
+    
+    This is for model and residual visibilities. The data is a copy-on-write selection of all the rows of vis (see
+    ColumnTable) with a new vis column, so only that column is allocated. Any other column is copied when first
+    written e.g. newvis.data['imaging_weight'][...] = 1.0, or by vis if it is written there first, so writes to
+    either visibility never show in the other.
+    
+    :param vis: Visibility or BlockVisibility
+    :param zero: Zero the vis column (True) or copy it from vis
+    :returns: Visibility or BlockVisibility
+    """
+    newvis = copy.copy(vis)
+    newvis.data = vis.data[...]
+    if zero:
+        newvis.data.set_column('vis', numpy.zeros_like(vis.data.column('vis')))
+    else:
+        newvis.data.set_column('vis', numpy.array(vis.data.column('vis')))
+    return newvis
+
+
+# Maximum number of rows to fill at a time in create_visibility
+create_visibility_chunksize = 2 ** 20
+
+
 def create_visibility(config: Configuration, times: numpy.array, frequency: numpy.array,
                       channel_bandwidth, phasecentre: SkyCoord,
                       weight: float, polarisation_frame=PolarisationFrame('stokesI'),
-                      integration_time=1.0) -> Visibility:
+                      integration_time=1.0, precision='double', weight_per_row=False) -> Visibility:
     """ Create a Visibility from Configuration, hour angles, and direction of source
 
     Note that we keep track of the integration time for BDA purposes
@@ -59,6 +90,8 @@ def create_visibility(config: Configuration, times: numpy.array, frequency: nump
     :param phasecentre: phasecentre of observation
     :param npol: Number of polarizations
     :param integration_time: Integration time ('auto' or value in s)
+    :param precision: Precision of the vis and weight columns: 'double' or 'single'
+    :param weight_per_row: Hold one weight per row rather than per polarisation
     :returns: Visibility
     """
     assert phasecentre is not None, "Must specify phase centre"
@@ -74,46 +107,38 @@ def create_visibility(config: Configuration, times: numpy.array, frequency: nump
     npol = polarisation_frame.npol
     nrows = nbaselines * ntimes * nch
     nrowsperintegration = nbaselines * nch
-    row = 0
-    rvis = numpy.zeros([nrows, npol], dtype='complex')
-    rweight = weight * numpy.ones([nrows, npol])
-    rtimes = numpy.zeros([nrows])
-    rfrequency = numpy.zeros([nrows])
-    rchannel_bandwidth = numpy.zeros([nrows])
-    rantenna1 = numpy.zeros([nrows], dtype='int')
-    rantenna2 = numpy.zeros([nrows], dtype='int')
+    rvis = numpy.zeros([nrows, npol], dtype='complex64' if precision == 'single' else 'complex')
+    rweight = numpy.full([nrows, 1 if weight_per_row else npol], weight)
+    
+    # Rows are ordered by hour angle, then pairs of antennas a1 < a2 (as numpy.triu_indices), then frequency
+    antenna1, antenna2 = numpy.triu_indices(nants, 1)
+    times = numpy.asarray(times)
+    rtimes = numpy.repeat(times * 43200.0 / numpy.pi, nrowsperintegration)
+    rfrequency = numpy.tile(frequency, nbaselines * ntimes)
+    rchannel_bandwidth = numpy.tile(channel_bandwidth, nbaselines * ntimes)
+    rantenna1 = numpy.tile(numpy.repeat(antenna1, nch), ntimes)
+    rantenna2 = numpy.tile(numpy.repeat(antenna2, nch), ntimes)
     ruvw = numpy.zeros([nrows, 3])
     
-    # Do each hour angle in turn
-    for iha, ha in enumerate(times):
-        
-        # Calculate the positions of the antennas as seen for this hour angle
-        # and declination
-        ant_pos = xyz_to_uvw(ants_xyz, ha, phasecentre.dec.rad)
-        rtimes[row:row + nrowsperintegration] = ha * 43200.0 / numpy.pi
-        
-        # Loop over all pairs of antennas. Note that a2>a1
-        for a1 in range(nants):
-            for a2 in range(a1 + 1, nants):
-                rantenna1[row:row + nch] = a1
-                rantenna2[row:row + nch] = a2
-                
-                # Loop over all frequencies and polarisations
-                for ch in range(nch):
-                    # noinspection PyUnresolvedReferences
-                    k = frequency[ch] / constants.c.value
-                    ruvw[row, :] = (ant_pos[a2, :] - ant_pos[a1, :]) * k
-                    rfrequency[row] = frequency[ch]
-                    rchannel_bandwidth[row] = channel_bandwidth[ch]
-                    row += 1
-    
-    assert row == nrows
+    # noinspection PyUnresolvedReferences
+    k = frequency / constants.c.value
+    
+    # Work through the hour angles in chunks to bound the size of the temporaries
+    chunk = max(1, create_visibility_chunksize // max(1, nrowsperintegration))
+    for start in range(0, ntimes, chunk):
+        chunktimes = times[start:start + chunk]
+        # Calculate the positions of the antennas as seen for these hour angles and declination
+        ant_pos = numpy.array([xyz_to_uvw(ants_xyz, ha, phasecentre.dec.rad) for ha in chunktimes])
+        baseline_uvw = ant_pos[:, antenna2, :] - ant_pos[:, antenna1, :]
+        rows = slice(start * nrowsperintegration, (start + len(chunktimes)) * nrowsperintegration)
+        ruvw[rows] = (baseline_uvw[:, :, numpy.newaxis, :] * k[:, numpy.newaxis]).reshape([-1, 3])
+    
     rintegration_time = numpy.full_like(rtimes, integration_time)
     vis = Visibility(uvw=ruvw, time=rtimes, antenna1=rantenna1, antenna2=rantenna2,
                      frequency=rfrequency, vis=rvis,
                      weight=rweight, imaging_weight=rweight,
                      integration_time=rintegration_time, channel_bandwidth=rchannel_bandwidth,
-                     polarisation_frame=polarisation_frame)
+                     polarisation_frame=polarisation_frame, precision=precision, weight_per_row=weight_per_row)
     vis.phasecentre = phasecentre
     vis.configuration = config
     log.info("create_visibility: %s" % (vis_summary(vis)))
@@ -124,7 +149,7 @@ def create_visibility(config: Configuration, times: numpy.array, frequency: nump
 
 def create_blockvisibility(config: Configuration, times: numpy.array, frequency: numpy.array, phasecentre: SkyCoord,
                            weight: float, polarisation_frame=None, integration_time=1.0,
-                           channel_bandwidth=1e6) -> BlockVisibility:
+                           channel_bandwidth=1e6, compact=False) -> BlockVisibility:
     """ Create a BlockVisibility from Configuration, hour angles, and direction of source
 
     Note that we keep track of the integration time for BDA purposes
@@ -136,6 +161,7 @@ def create_blockvisibility(config: Configuration, times: numpy.array, frequency:
     :param phasecentre: phasecentre of observation
     :param npol: Number of polarizations
     :param integration_time: Integration time ('auto' or value in s)
+    :param compact: Use the compact layout, one entry per baseline (False)
     :returns: BlockVisibility
     """
     assert phasecentre is not None, "Must specify phase centre"
@@ -149,25 +175,27 @@ def create_blockvisibility(config: Configuration, times: numpy.array, frequency:
     nbaselines = int(nants * (nants - 1) / 2)
     ntimes = len(times)
     npol = polarisation_frame.npol
-    visshape = [ntimes, nants, nants, nch, npol]
+    if compact:
+        antenna1, antenna2 = get_baselines(nants)
+        blockshape = [nbaselines]
+    else:
+        blockshape = [nants, nants]
+    visshape = [ntimes] + blockshape + [nch, npol]
     rvis = numpy.zeros(visshape, dtype='complex')
     rweight = weight * numpy.ones(visshape)
-    rtimes = numpy.zeros([ntimes])
-    ruvw = numpy.zeros([ntimes, nants, nants, 3])
+    rtimes = numpy.asarray(times) * 43200.0 / numpy.pi
+    ruvw = numpy.zeros([ntimes] + blockshape + [3])
     
-    # Do each hour angle in turn
+    # Do each hour angle in turn, the uvw for a1, a2 being ant_pos[a1] - ant_pos[a2]
     for iha, ha in enumerate(times):
         
         # Calculate the positions of the antennas as seen for this hour angle
         # and declination
         ant_pos = xyz_to_uvw(ants_xyz, ha, phasecentre.dec.rad)
-        rtimes[iha] = ha * 43200.0 / numpy.pi
-        
-        # Loop over all pairs of antennas. Note that a2>a1
-        for a1 in range(nants):
-            for a2 in range(a1 + 1, nants):
-                ruvw[iha, a2, a1, :] = (ant_pos[a2, :] - ant_pos[a1, :])
-                ruvw[iha, a1, a2, :] = (ant_pos[a1, :] - ant_pos[a2, :])
+        if compact:
+            numpy.subtract(ant_pos[antenna2], ant_pos[antenna1], out=ruvw[iha])
+        else:
+            numpy.subtract(ant_pos[:, numpy.newaxis, :], ant_pos[numpy.newaxis, :, :], out=ruvw[iha])
     
     rintegration_time = numpy.full_like(rtimes, integration_time)
     rchannel_bandwidth = numpy.full_like(frequency, channel_bandwidth)
@@ -182,80 +210,93 @@ def create_blockvisibility(config: Configuration, times: numpy.array, frequency:
     return vis
 
 
+def convert_blockvisibility_layout(vis: BlockVisibility, compact=True) -> BlockVisibility:
+    """ Convert a BlockVisibility to the compact (one entry per baseline) or square layout
+    
+    Converting to the square layout fills in the entries for antenna1 > antenna2 from those for the reversed
+    baseline. If vis is already in the requested layout it is returned unchanged.
+    
+    :param vis: BlockVisibility
+    :param compact: Convert to the compact layout (True) or to the square layout (False)
+    :returns: BlockVisibility
+    """
+    assert type(vis) is BlockVisibility, "vis is not a BlockVisibility: %r" % vis
+    if vis.compact == compact:
+        return vis
+    
+    columns = {'uvw': vis.bluvw, 'vis': vis.blvis, 'weight': vis.blweight} if compact else \
+        {'uvw': vis.uvw, 'vis': vis.vis, 'weight': vis.weight}
+    newvis = copy.copy(vis)
+    newvis.data = vis.data[...]
+    for name, col in columns.items():
+        newvis.data.set_column(name, col)
+    return newvis
+
+
 def create_visibility_from_rows(vis: Visibility, rows, makecopy=True) -> Visibility:
     """ Create a Visibility or BlockVisibility from selected rows
+    
+    With makecopy the data of the new visibility is a copy-on-write selection of the rows: a column is copied
+    only when it is written e.g. newvis.data['vis'][...] = 0.0, or when vis writes to it first, so scattering the
+    data into many selections needs little more memory than the data itself. Read-only access through the
+    properties (newvis.uvw etc.) does not copy a contiguous range of rows.
 
     :param vis: Visibility
-    :param rows: Boolean array of row selction
-    :param makecopy: Make a deep copy (True)
+    :param rows: Boolean array of row selction, or index array, range, or slice
+    :param makecopy: Make a (copy-on-write) copy (True)
     :returns: Visibility
     """
     
-    if type(vis) is Visibility:
-    
-        if makecopy:
-            newvis = copy_visibility(vis)
-            newvis.data = copy.deepcopy(vis.data[rows])
-            return newvis
-        else:
-            vis.data = copy.deepcopy(vis.data[rows])
-            return vis
+    if makecopy:
+        newvis = copy.copy(vis)
+        newvis.data = vis.data[rows]
+        return newvis
     else:
-
-        if makecopy:
-            newvis = copy_visibility(vis)
-            newvis.data = copy.deepcopy(vis.data[rows])
-            return newvis
-        else:
-            vis.data = copy.deepcopy(vis.data[rows])
-            
-            return vis
+        vis.data = copy.deepcopy(vis.data[rows])
+        return vis
 
 
-def phaserotate_visibility(vis: Visibility, newphasecentre: SkyCoord, tangent=True,
-                           inverse=False) -> Visibility:
+def phaserotate_visibility(vis: Visibility, newphasecentre: SkyCoord, tangent=True, inverse=False,
+                           inplace=False) -> Visibility:
     """
     Phase rotate from the current phase centre to a new phase centre
 
+    By default the Visibility is copied first. With inplace=True the vis (and, if not tangent, uvw) columns of vis
+    are rotated without making a copy.
+
     :param vis: Visibility to be rotated
     :param newphasecentre:
     :param tangent: Stay on the same tangent plane? (True)
     :param inverse: Actually do the opposite
+    :param inplace: Rotate vis in place instead of rotating a copy (False)
     :returns: Visibility
     """
     assert type(vis) is Visibility, "vis is not a Visibility: %r" % vis
     
+    if inplace:
+        newvis = vis
+    else:
+        newvis = copy_visibility(vis)
+    
     l, m, n = skycoord_to_lmn(newphasecentre, vis.phasecentre)
     
     # No significant change?
     if numpy.abs(l) > 1e-15 or numpy.abs(m) > 1e-15:
         
-        # Make a new copy
-        newvis = copy_visibility(vis)
-        
         phasor = simulate_point(newvis.uvw, l, m)
         
         if inverse:
-            for pol in range(vis.polarisation_frame.npol):
-                newvis.data['vis'][..., pol] *= phasor
+            newvis.data['vis'] *= phasor[:, numpy.newaxis]
         else:
-            for pol in range(vis.polarisation_frame.npol):
-                newvis.data['vis'][..., pol] *= numpy.conj(phasor)
+            newvis.data['vis'] *= numpy.conjugate(phasor)[:, numpy.newaxis]
         
         # To rotate UVW, rotate into the global XYZ coordinate system and back. We have the option of
         # staying on the tangent plane or not. If we stay on the tangent then the raster will
         # join smoothly at the edges. If we change the tangent then we will have to reproject to get
         # the results on the same image, in which case overlaps or gaps are difficult to deal with.
         if not tangent:
-            if inverse:
-                xyz = uvw_to_xyz(vis.data['uvw'], ha=-newvis.phasecentre.ra.rad, dec=newvis.phasecentre.dec.rad)
-                newvis.data['uvw'][...] = \
-                    xyz_to_uvw(xyz, ha=-newphasecentre.ra.rad, dec=newphasecentre.dec.rad)[...]
-            else:
-                # This is the original (non-inverse) code
-                xyz = uvw_to_xyz(newvis.data['uvw'], ha=-newvis.phasecentre.ra.rad, dec=newvis.phasecentre.dec.rad)
-                newvis.data['uvw'][...] = xyz_to_uvw(xyz, ha=-newphasecentre.ra.rad, dec=newphasecentre.dec.rad)[
-                    ...]
+            xyz = uvw_to_xyz(newvis.data['uvw'], ha=-newvis.phasecentre.ra.rad, dec=newvis.phasecentre.dec.rad)
+            newvis.data['uvw'][...] = xyz_to_uvw(xyz, ha=-newphasecentre.ra.rad, dec=newphasecentre.dec.rad)[...]
         newvis.phasecentre = newphasecentre
     
     return newvis
@@ -331,14 +372,17 @@ def remove_continuum_blockvisibility(vis: BlockVisibility, degree=1, mask=None,
     
     nchan = len(vis.frequency)
     x = (vis.frequency - vis.frequency[nchan//2])/(vis.frequency[0] - vis.frequency[nchan//2])
+    # Works for either layout of the BlockVisibility
+    nblock = numpy.prod(vis.data['vis'].shape[1:-2])
+    blockvis = vis.data['vis'].reshape([vis.nvis, nblock, nchan, vis.npol])
+    blockweight = vis.data['weight'].reshape([vis.nvis, nblock, nchan, vis.npol])
     for row in range(vis.nvis):
-        for ant2 in range(vis.nants):
-            for ant1 in range(vis.nants):
-                for pol in range(vis.polarisation_frame.npol):
-                    wt = numpy.sqrt(vis.data['weight'][row, ant2, ant1, :, pol])
-                    if mask is not None:
-                        wt[mask] = 0.0
-                    fit = numpy.polyfit(x, vis.data['vis'][row, ant2, ant1, :, pol], w=wt, deg=degree)
-                    prediction = numpy.polyval(fit, x)
-                    vis.data['vis'][row, ant2, ant1, :, pol] -= prediction
+        for block in range(nblock):
+            for pol in range(vis.polarisation_frame.npol):
+                wt = numpy.sqrt(blockweight[row, block, :, pol])
+                if mask is not None:
+                    wt[mask] = 0.0
+                fit = numpy.polyfit(x, blockvis[row, block, :, pol], w=wt, deg=degree)
+                prediction = numpy.polyval(fit, x)
+                blockvis[row, block, :, pol] -= prediction
     return vis
@@ -83,6 +83,19 @@ class TestArray_functions(unittest.TestCase):
         numpy.testing.assert_array_equal(carr[:,5], answerarr)
         numpy.testing.assert_array_equal(cwts[:,5], answerwts)
 
+    def test_average_chunks2_batch(self):
+        arr = numpy.linspace(0.0, 120.0, 121).reshape(11, 11)
+        wts = numpy.ones_like(arr)
+        wts[3, 4] = 0.0
+        barr = numpy.array([arr, 2.0 * arr, arr + 1j])
+        bwts = numpy.array([wts, wts, 2.0 * wts])
+        carr, cwts = average_chunks2(barr, bwts, (5, 2))
+        assert carr.shape == (3, 3, 6)
+        for i in range(3):
+            answerarr, answerwts = average_chunks2(barr[i], bwts[i], (5, 2))
+            numpy.testing.assert_array_equal(carr[i], answerarr)
+            numpy.testing.assert_array_equal(cwts[i], answerwts)
+
     def test_average_chunks_jit(self):
         arr = numpy.linspace(0.0, 100.0, 11)
         wts = numpy.ones_like(arr)
@@ -90,6 +90,20 @@ class TestCalibrationOperations(unittest.TestCase):
             vis = apply_gaintable(self.vis, gt, inverse=True)
             error = numpy.max(numpy.abs(vis.vis-original.vis))
             assert error < 1e-12, "Error = %s" % (error)
+
+    def test_apply_gaintable_leakage_kron(self):
+        self.actualSetup('stokesIQUV', 'linear')
+        gt = create_gaintable_from_blockvisibility(self.vis)
+        gt = simulate_gaintable(gt, phase_error=0.1, amplitude_error=0.1, leakage=0.1)
+        for inverse in [False, True]:
+            original = copy_visibility(self.vis)
+            vis = apply_gaintable(copy_visibility(self.vis), gt, inverse=inverse)
+            a1, a2, chan = 3, 7, 1
+            mueller = numpy.kron(gt.gain[0, a1, chan], numpy.conjugate(gt.gain[0, a2, chan]))
+            if inverse:
+                mueller = numpy.linalg.inv(mueller)
+            numpy.testing.assert_allclose(vis.vis[0, a2, a1, chan],
+                                          numpy.matmul(mueller, original.vis[0, a2, a1, chan]), atol=1e-12)
     
 
 if __name__ == '__main__':
@@ -5,7 +5,8 @@
 import unittest
 
 from arl.calibration.operations import *
-from arl.calibration.solvers import solve_gaintable
+from arl.calibration.solvers import solve_gaintable, gain_substitution_scalar, gain_substitution_vector, \
+    gain_substitution_matrix, remove_model
 from arl.fourier_transforms.ftprocessor import predict_skycomponent_blockvisibility
 from arl.util.testing_support import create_named_configuration, simulate_gaintable
 from arl.visibility.operations import create_blockvisibility, copy_visibility
@@ -48,6 +49,19 @@ class TestCalibrationSolvers(unittest.TestCase):
         residual = numpy.max(gtsol.residual)
         assert residual < 3e-8, "Max residual = %s" % (residual)
     
+    def test_solve_gaintable_antenna_residual(self):
+        self.actualSetup('stokesI', 'stokesI', f=[100.0])
+        gt = create_gaintable_from_blockvisibility(self.vis)
+        gt = simulate_gaintable(gt, phase_error=10.0, amplitude_error=0.0)
+        original = copy_visibility(self.vis)
+        self.vis = apply_gaintable(self.vis, gt)
+        # Corrupt the baselines of one antenna
+        self.vis.data['vis'][:, 3, ...] *= 1.1
+        self.vis.data['vis'][:, :, 3, ...] *= 1.1
+        gtsol = solve_gaintable(self.vis, original, phase_only=True, niter=200)
+        assert gtsol.antenna_residual.shape == gtsol.gain.shape
+        assert numpy.all(numpy.argmax(gtsol.antenna_residual, axis=1) == 3)
+    
     def core_solve(self, spf, dpf, phase_error=0.1, amplitude_error=0.0, leakage=0.0,
                    phase_only=True, niter=200, crosspol=False,residual_tol=1e-6, f=[100.0,50.0,-10.0, 40.0]):
         self.actualSetup(spf, dpf, f=f)
@@ -90,6 +104,46 @@ class TestCalibrationSolvers(unittest.TestCase):
         self.core_solve('stokesIQUV', 'circular', phase_error=0.1, amplitude_error=0.01, leakage=0.01,
                         residual_tol=1e-3, crosspol=True, phase_only=False, f=[100.0, 0.0, 0.0, 50.0])
 
+    def test_gain_substitution_diagonal(self):
+        # For diagonal gains and data the scalar, vector and matrix substitutions are the same for each receptor
+        nants, nchan = 5, 2
+        rng = numpy.random.RandomState(1)
+        shape = (nants, nants, nchan, 2, 2)
+        x = (rng.normal(size=shape) + 1j * rng.normal(size=shape)) * numpy.eye(2)
+        xwt = rng.uniform(0.5, 1.0, size=shape) * numpy.eye(2)
+        xwt[:, 3, 1] = 0.0
+        for ant in range(nants):
+            x[ant, ant] = 0.0
+            xwt[ant, ant] = 0.0
+        gain = numpy.exp(1j * rng.uniform(-1.0, 1.0, size=(nants, nchan, 2, 2))) * numpy.eye(2)
+        vgain, vgwt = gain_substitution_vector(gain.copy(), x, xwt)
+        mgain, mgwt = gain_substitution_matrix(gain.copy(), x, xwt)
+        for rec in [0, 1]:
+            numpy.testing.assert_allclose(vgain[..., rec, rec], mgain[..., rec, rec], atol=1e-12)
+            numpy.testing.assert_allclose(vgwt[..., rec, rec], mgwt[..., rec, rec], atol=1e-12)
+            sgain, sgwt = gain_substitution_scalar(gain[..., rec:rec + 1, rec:rec + 1],
+                                                   x[..., rec:rec + 1, rec:rec + 1].copy(),
+                                                   xwt[..., rec:rec + 1, rec:rec + 1].copy())
+            numpy.testing.assert_allclose(sgain[..., 0, 0], vgain[..., rec, rec], atol=1e-12)
+        assert numpy.all(vgain[3, 1] == 0.0) and numpy.all(vgwt[3, 1] == 0.0)
+
+    def test_remove_model_matrix(self):
+        nrows, nants, nchan = 2, 4, 3
+        rng = numpy.random.RandomState(1)
+        shape = (nrows, nants, nants, nchan, 4)
+        vis = rng.normal(size=shape) + 1j * rng.normal(size=shape)
+        modelvis = rng.normal(size=shape) + 1j * rng.normal(size=shape)
+        weight = numpy.ones(shape)
+        # A singular model
+        modelvis[0, 2, 1, 0] = [1.0, 2.0, 2.0, 4.0]
+        x, xwt = remove_model(vis, weight, modelvis, isscalar=False, crosspol=False)
+        assert x.shape == (nrows, nants, nants, nchan, 2, 2)
+        assert numpy.all(x[0, 2, 1, 0] == 0.0) and numpy.all(xwt[0, 2, 1, 0] == 0.0)
+        assert numpy.all(x[:, 1, 2] == 0.0)
+        mvis = modelvis.reshape(x.shape)
+        numpy.testing.assert_allclose(numpy.matmul(mvis[1, 2, 1], x[1, 2, 1]), vis[1, 2, 1].reshape([nchan, 2, 2]),
+                                      atol=1e-12)
+
 
 if __name__ == '__main__':
     unittest.main()
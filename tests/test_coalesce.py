@@ -11,7 +11,7 @@ import astropy.units as u
 from arl.data.polarisation import PolarisationFrame
 from arl.util.testing_support import create_named_configuration
 from arl.visibility.coalesce import coalesce_visibility, decoalesce_visibility, \
-    convert_blockvisibility_to_visibility
+    convert_blockvisibility_to_visibility, get_coalescence_plan, coalesce_visibility_iter
 from arl.visibility.operations import create_blockvisibility, create_visibility_from_rows
 from arl.visibility.iterators import vis_timeslice_iter
 
@@ -52,6 +52,24 @@ class TestCoalesce(unittest.TestCase):
         assert dvis.nvis == self.blockvis.nvis
 
 
+    def test_convert_decoalesce_polarisation(self):
+        for compact in [False, True]:
+            blockvis = create_blockvisibility(self.lowcore, self.times[:3], self.frequency,
+                                              phasecentre=self.phasecentre, weight=1.0,
+                                              polarisation_frame=PolarisationFrame('linear'),
+                                              channel_bandwidth=self.channel_bandwidth, compact=compact)
+            blvis = numpy.random.RandomState(1).normal(size=blockvis.blvis.shape) + 1j
+            blockvis.data['vis'] = 0.0
+            if compact:
+                blockvis.data['vis'] = blvis
+            else:
+                antenna1, antenna2 = blockvis.baselines
+                blockvis.data['vis'][:, antenna2, antenna1] = blvis
+            cvis = convert_blockvisibility_to_visibility(blockvis)
+            dvis = decoalesce_visibility(cvis, overwrite=True)
+            assert dvis is not blockvis
+            numpy.testing.assert_array_equal(dvis.blvis, blvis)
+
     def test_coalesce_decoalesce(self):
         cvis = coalesce_visibility(self.blockvis, time_coal=1.0, frequency_coal=1.0)
         assert numpy.min(cvis.frequency) == numpy.min(self.frequency)
@@ -61,6 +79,20 @@ class TestCoalesce(unittest.TestCase):
         dvis = decoalesce_visibility(cvis, overwrite=True)
         assert dvis.nvis == self.blockvis.nvis
 
+    def test_coalesce_decoalesce_index(self):
+        # Fill in the vis values with the time, so that each decoalesced value is the mean over its time chunk
+        ntimes = self.blockvis.nvis
+        self.blockvis.data['vis'] = numpy.arange(ntimes).reshape([ntimes, 1, 1, 1, 1])
+        cvis = coalesce_visibility(self.blockvis, time_coal=1.0, frequency_coal=1.0)
+        plan = get_coalescence_plan(self.blockvis, time_coal=1.0, frequency_coal=1.0)
+        assert numpy.max(plan['time_average']) > 1
+        dvis = decoalesce_visibility(cvis, overwrite=True)
+        start = (numpy.arange(ntimes)[:, numpy.newaxis] // plan['time_average']) * plan['time_average']
+        stop = numpy.minimum(start + plan['time_average'], ntimes)
+        expected = numpy.broadcast_to(((start + stop - 1) / 2.0)[..., numpy.newaxis, numpy.newaxis],
+                                      dvis.vis[:, plan['baselines']].shape)
+        numpy.testing.assert_allclose(dvis.vis[:, plan['baselines']], expected)
+
     def test_coalesce_decoalesce_frequency(self):
         cvis = coalesce_visibility(self.blockvis, time_coal=0.0, max_time_coal=1, frequency_coal=1.0)
         assert numpy.min(cvis.frequency) == numpy.min(self.frequency)
@@ -106,6 +138,60 @@ class TestCoalesce(unittest.TestCase):
             dvisslice = decoalesce_visibility(cvisslice)
             assert dvisslice.nvis == visslice.nvis
 
+    def test_coalesce_plan_reused(self):
+        self.blockvis.data['vis'][...] = 1.0
+        cvis = coalesce_visibility(self.blockvis, time_coal=1.0, frequency_coal=1.0)
+        plan = get_coalescence_plan(self.blockvis, time_coal=1.0, frequency_coal=1.0)
+        assert plan['cindex'] is cvis.cindex
+        numpy.testing.assert_allclose(cvis.vis, 1.0)
+        self.blockvis.data['vis'][...] = 2.0
+        cvis2 = coalesce_visibility(self.blockvis, time_coal=1.0, frequency_coal=1.0)
+        assert cvis2.cindex is cvis.cindex
+        numpy.testing.assert_allclose(cvis2.vis, 2.0)
+        numpy.testing.assert_allclose(cvis2.weight, cvis.weight)
+        numpy.testing.assert_allclose(cvis2.uvw, cvis.uvw)
+        
+        # Flagging in place changes the plan
+        self.blockvis.data['weight'][0, 1, 0] = 0.0
+        cvis3 = coalesce_visibility(self.blockvis, time_coal=1.0, frequency_coal=1.0)
+        assert cvis3.cindex is not cvis.cindex
+        rows = (cvis.antenna1 == 0) & (cvis.antenna2 == 1)
+        assert cvis3.time[rows][0] > cvis.time[rows][0]
+        
+        # A baseline with no weight at all is left out
+        self.blockvis.data['weight'][:, 1, 0] = 0.0
+        cvis4 = coalesce_visibility(self.blockvis, time_coal=1.0, frequency_coal=1.0)
+        assert not numpy.any((cvis4.antenna1 == 0) & (cvis4.antenna2 == 1))
+
+    def test_coalesce_flagged_baseline(self):
+        self.blockvis.data['weight'][:, 2, 1, ...] = 0.0
+        cvis = coalesce_visibility(self.blockvis, time_coal=1.0, frequency_coal=1.0)
+        assert not numpy.any((cvis.antenna1 == 1) & (cvis.antenna2 == 2))
+        assert numpy.any((cvis.antenna1 == 1) & (cvis.antenna2 == 3))
+        dvis = decoalesce_visibility(cvis)
+        assert dvis.nvis == self.blockvis.nvis
+
+    def test_coalesce_visibility_iter(self):
+        chunks = [create_visibility_from_rows(self.blockvis, slice(start, start + 7))
+                  for start in range(0, self.blockvis.nvis, 7)]
+        cvis = convert_blockvisibility_to_visibility(self.blockvis)
+        cvisstream = list(coalesce_visibility_iter(chunks))
+        assert len(cvisstream) == len(chunks)
+        numpy.testing.assert_allclose(numpy.concatenate([c.vis for c in cvisstream]), cvis.vis)
+        numpy.testing.assert_allclose(numpy.concatenate([c.uvw for c in cvisstream]), cvis.uvw)
+        numpy.testing.assert_array_equal(numpy.concatenate([c.antenna2 for c in cvisstream]), cvis.antenna2)
+        
+        cvisstream = list(coalesce_visibility_iter(chunks, time_coal=1.0, frequency_coal=1.0))
+        numpy.testing.assert_allclose(numpy.sum([numpy.sum(c.weight) for c in cvisstream]),
+                                      numpy.sum(self.blockvis.blweight))
+        # The averaging factors are set for each chunk, but no data are lost when they change
+        numpy.testing.assert_allclose(numpy.sum([numpy.sum(c.weight * c.vis) for c in cvisstream]),
+                                      numpy.sum(self.blockvis.blweight * self.blockvis.blvis))
+        numpy.testing.assert_allclose(numpy.sum([numpy.sum(c.integration_time * c.data['channel_bandwidth'])
+                                                 for c in cvisstream]),
+                                      len(self.blockvis.baselines[0]) * numpy.sum(self.blockvis.integration_time) *
+                                      numpy.sum(self.blockvis.channel_bandwidth))
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -13,7 +13,8 @@ from arl.skycomponent.operations import create_skycomponent, find_skycomponents,
 from arl.util.testing_support import create_named_configuration
 import logging
 
-from arl.visibility.operations import create_visibility, sum_visibility
+from arl.visibility.coalesce import convert_blockvisibility_to_visibility
+from arl.visibility.operations import create_visibility, create_blockvisibility, sum_visibility
 
 log = logging.getLogger(__name__)
 
@@ -177,6 +178,23 @@ class TestFTProcessor(unittest.TestCase):
         self.actualSetUp()
         self._predict_base(predict_facets, fluxthreshold=1e-7)
 
+    def test_predict_facets_workers(self):
+        self.actualSetUp()
+        self.params['facet_workers'] = 4
+        self._predict_base(predict_facets, fluxthreshold=1e-7)
+        # The partitions are accumulated in order so the result is the same as predicting them one at a time
+        serialvis = create_visibility(self.lowcore, self.times, self.frequency,
+                                      channel_bandwidth=self.channel_bandwidth, phasecentre=self.phasecentre,
+                                      weight=1.0, polarisation_frame=PolarisationFrame('stokesI'))
+        self.params['facet_workers'] = 1
+        serialvis = predict_facets(serialvis, self.model, **self.params)
+        assert numpy.array_equal(serialvis.vis, self.modelvis.vis)
+
+    def test_predict_dft(self):
+        self.actualSetUp()
+        assert predict_dft_cost(self.componentvis, self.model) < 1.0
+        self._predict_base(predict_dft, fluxthreshold=1e-7)
+
     def test_predict_timeslice(self):
         # This works poorly because of the poor interpolation accuracy for point sources. The corresponding
         # invert works well particularly if the beam sampling is high
@@ -231,6 +249,16 @@ class TestFTProcessor(unittest.TestCase):
         self.actualSetUp()
         self._invert_base(invert_facets, positionthreshold=1.0)
 
+    def test_invert_facets_workers(self):
+        self.actualSetUp()
+        self.params['facet_workers'] = 4
+        dirty, sumwt = invert_facets(self.componentvis, create_empty_image_like(self.model), **self.params)
+        self.params['facet_workers'] = 1
+        serialdirty, serialsumwt = invert_facets(self.componentvis, create_empty_image_like(self.model), **self.params)
+        assert numpy.array_equal(dirty.data, serialdirty.data)
+        assert numpy.array_equal(sumwt, serialsumwt)
+        self._checkcomponents(dirty, positionthreshold=1.0)
+
     def test_invert_wstack(self):
         self.actualSetUp()
         self._invert_base(invert_wstack, positionthreshold=8.0)
@@ -251,6 +279,68 @@ class TestFTProcessor(unittest.TestCase):
         self.actualSetUp()
         self._invert_base(invert_wprojection, positionthreshold=1.0)
 
+    def test_residual_invert(self):
+        self.actualSetUp()
+        modelvis = predict_2d(copy_visibility(self.componentvis, zero=True), self.model, **self.params)
+        resvis = copy_visibility(self.componentvis)
+        resvis.data['vis'] -= modelvis.data['vis']
+        dirty, sumwt = invert_2d(resvis, self.model, **self.params)
+        original = numpy.array(self.componentvis.vis)
+        fusedvis, fuseddirty, fusedsumwt = residual_invert(self.componentvis, self.model, **self.params)
+        assert fusedvis is not self.componentvis
+        numpy.testing.assert_array_equal(self.componentvis.vis, original)
+        numpy.testing.assert_allclose(fusedvis.vis, resvis.vis, atol=1e-12)
+        numpy.testing.assert_allclose(fuseddirty.data, dirty.data, atol=1e-12)
+        numpy.testing.assert_allclose(fusedsumwt, sumwt)
+
+    def test_residual_invert_coalesced(self):
+        self.actualSetUp()
+        bvis = create_blockvisibility(self.lowcore, self.times, self.frequency,
+                                      channel_bandwidth=self.channel_bandwidth, phasecentre=self.phasecentre,
+                                      weight=1.0, polarisation_frame=PolarisationFrame('stokesI'))
+        bvis = predict_skycomponent_blockvisibility(bvis, self.components)
+        params = {'time_coal': 1.0, 'max_time_coal': 4}
+        modelvis = predict_2d(copy_visibility(bvis, zero=True), self.model, **params)
+        residual = bvis.vis - modelvis.vis
+        original = numpy.array(bvis.vis)
+        resvis, resdirty, ressumwt = residual_invert(bvis, self.model, **params)
+        numpy.testing.assert_array_equal(bvis.vis, original)
+        numpy.testing.assert_allclose(resvis.vis, residual, atol=1e-12)
+        resvis, resdirty, ressumwt = residual_invert(bvis, self.model, inplace=True, **params)
+        assert resvis is bvis
+        numpy.testing.assert_allclose(bvis.vis, residual, atol=1e-12)
+    
+    def test_block_gridding(self):
+        self.actualSetUp()
+        for compact in [False, True]:
+            bvis = create_blockvisibility(self.lowcore, self.times[:2], self.frequency,
+                                          channel_bandwidth=self.channel_bandwidth, phasecentre=self.phasecentre,
+                                          weight=1.0, polarisation_frame=PolarisationFrame('stokesI'),
+                                          compact=compact)
+            avis = predict_2d(convert_blockvisibility_to_visibility(bvis), self.model, dft_threshold=0.0)
+            bvis = predict_2d(bvis, self.model, dft_threshold=0.0)
+            numpy.testing.assert_allclose(bvis.blvis.reshape(avis.vis.shape), avis.vis, atol=1e-12)
+            if not compact:
+                numpy.testing.assert_allclose(bvis.vis[:, 0, 1], numpy.conjugate(bvis.vis[:, 1, 0]))
+            dirty, sumwt = invert_2d(avis, self.model)
+            bdirty, bsumwt = invert_2d(bvis, self.model)
+            numpy.testing.assert_allclose(bdirty.data, dirty.data, atol=1e-12)
+            numpy.testing.assert_allclose(bsumwt, sumwt)
+            original = numpy.array(bvis.blvis)
+            resvis, resdirty, ressumwt = residual_invert(bvis, self.model)
+            numpy.testing.assert_array_equal(bvis.blvis, original)
+            numpy.testing.assert_allclose(resvis.blvis, 0.0, atol=1e-12)
+
+    def test_predict_skycomponent_dft(self):
+        self.actualSetUp()
+        vis = copy_visibility(self.componentvis, zero=True)
+        for comp in self.components:
+            l, m, n = skycoord_to_lmn(comp.direction, vis.phasecentre)
+            vis.data['vis'][:, 0] += comp.flux[0, 0] * simulate_point(vis.uvw, l, m)
+        dftvis = copy_visibility(self.componentvis, zero=True)
+        dftvis = predict_skycomponent_visibility(dftvis, self.components, dft_chunksize=1000, dft_workers=4)
+        numpy.testing.assert_allclose(dftvis.vis, vis.vis, atol=1e-9)
+
     def test_weighting(self):
         self.actualSetUp()
         vis, density, densitygrid = weight_visibility(self.componentvis, self.model, weighting='uniform')
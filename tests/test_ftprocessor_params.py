@@ -11,7 +11,7 @@ from astropy.coordinates import SkyCoord
 from astropy import units as u
 from arl.data.polarisation import PolarisationFrame
 from arl.fourier_transforms.ftprocessor import create_image_from_visibility
-from arl.fourier_transforms.ftprocessor_params import get_frequency_map
+from arl.fourier_transforms.ftprocessor_params import get_frequency_map, get_rowmap
 from arl.util.testing_support import create_named_configuration, create_low_test_image_from_s3, \
     create_low_test_image_from_gleam
 
@@ -62,6 +62,23 @@ class TestFTProcessorParams(unittest.TestCase):
         assert numpy.max(vfrequency_map) == 0
         assert spectral_mode == 'mfs'
 
+    def test_get_frequency_map_cached(self):
+        spectral_mode, vfrequency_map = get_frequency_map(self.vis)
+        assert vfrequency_map.dtype == numpy.int32
+        assert numpy.max(vfrequency_map) == self.vnchan - 1
+        assert get_frequency_map(self.vis)[1] is vfrequency_map
+        self.vis.data = self.vis.data[self.vis.frequency > self.frequency[0]]
+        spectral_mode, vfrequency_map = get_frequency_map(self.vis)
+        assert len(vfrequency_map) == self.vis.nvis
+        assert numpy.max(vfrequency_map) == self.vnchan - 2
+        self.vis.data['frequency'][...] = self.frequency[-1]
+        assert numpy.max(get_frequency_map(self.vis)[1]) == 0
+
+    def test_get_rowmap(self):
+        col = numpy.array([3.0, 1.0, 2.0, 3.0, 1.0])
+        assert list(get_rowmap(col)) == [2, 0, 1, 2, 0]
+        assert list(get_rowmap(col, numpy.array([3.0, 2.0, 1.0]))) == [0, 2, 1, 0, 2]
+
     def test_get_frequency_map_gleam(self):
         self.model = create_low_test_image_from_gleam(npixel=256, cellsize=0.001, frequency=self.frequency,
                                                       channel_bandwidth=self.channel_bandwidth)
@@ -8,7 +8,8 @@ import unittest
 
 from arl.util.testing_support import create_named_configuration
 from arl.visibility.iterators import *
-from arl.visibility.operations import create_visibility, create_visibility_from_rows
+from arl.visibility.operations import create_visibility, create_visibility_from_rows, append_visibility, \
+    phaserotate_visibility
 
 log = logging.getLogger(__name__)
 
@@ -67,6 +68,47 @@ class TestVisibilityIterators(unittest.TestCase):
             assert visslice.vis[0].real == visslice.time[0]
             assert len(rows)
 
+    def test_vis_timeslice_iterator_indexed(self):
+        self.actualSetUp()
+        expected = list(vis_timeslice_iter(self.vis))
+        create_row_index(self.vis)
+        indexed = list(vis_timeslice_iter(self.vis))
+        assert len(indexed) == len(expected)
+        for rows, expectedrows in zip(indexed, expected):
+            assert rows.dtype.kind == 'i'
+            numpy.testing.assert_array_equal(rows, numpy.flatnonzero(expectedrows))
+    
+    def test_vis_timeslice_iterator_indexed_append(self):
+        self.actualSetUp()
+        othervis = create_visibility(self.lowcore, self.times[-1:] + 600.0 * numpy.pi / 43200.0, self.frequency,
+                                     channel_bandwidth=self.channel_bandwidth, phasecentre=self.phasecentre,
+                                     weight=1.0)
+        create_row_index(self.vis)
+        append_visibility(self.vis, othervis)
+        create_row_index(self.vis)
+        self.vis.data.append(othervis.data)
+        assert get_row_index(self.vis, 'time') is None
+        scanned = list(vis_timeslice_iter(self.vis))
+        assert len(scanned) == len(self.times) + 1
+        assert sum(numpy.sum(rows) for rows in scanned) == self.vis.nvis
+        create_row_index(self.vis)
+        indexed = list(vis_timeslice_iter(self.vis))
+        assert len(indexed) == len(self.times) + 1
+        assert sum(len(rows) for rows in indexed) == self.vis.nvis
+    
+    def test_select_rows(self):
+        self.actualSetUp()
+        create_row_index(self.vis)
+        rows = select_rows(self.vis, 'baseline', (1, 3))
+        assert len(rows) == len(self.times)
+        assert numpy.all(self.vis.antenna1[rows] == 1) and numpy.all(self.vis.antenna2[rows] == 3)
+        rows = select_rows(self.vis, 'time', self.vis.time[0], 100.0)
+        numpy.testing.assert_array_equal(rows, numpy.flatnonzero(numpy.abs(self.vis.time - self.vis.time[0]) < 100.0))
+        assert len(select_rows(self.vis, 'frequency', 2e8)) == 0
+        self.vis.row_index = None
+        rows = select_rows(self.vis, 'baseline', (1, 3))
+        assert len(rows) == len(self.times)
+    
     def test_vis_wstack_iterator(self):
         self.actualSetUp()
         nchunks = len(list(vis_wstack_iter(self.vis, wstack=10.0)))
@@ -77,6 +119,36 @@ class TestVisibilityIterators(unittest.TestCase):
             visslice = create_visibility_from_rows(self.vis, rows)
             assert numpy.sum(visslice.nvis) < self.vis.nvis
 
+    def test_vis_wstack_iterator_indexed(self):
+        self.actualSetUp()
+        expected = list(vis_wstack_iter(self.vis, wstack=10.0))
+        create_row_index(self.vis)
+        indexed = list(vis_wstack_iter(self.vis, wstack=10.0))
+        assert len(indexed) == len(expected)
+        for rows, expectedrows in zip(indexed, expected):
+            if expectedrows is None:
+                assert rows is None
+            else:
+                assert rows.dtype.kind == 'i'
+                numpy.testing.assert_array_equal(rows, numpy.flatnonzero(expectedrows))
+
+    def test_vis_wstack_iterator_indexed_phaserotate(self):
+        self.actualSetUp()
+        create_row_index(self.vis)
+        newphasecentre = SkyCoord(ra=+35.0 * u.deg, dec=-15.0 * u.deg, frame='icrs', equinox=2000.0)
+        phaserotate_visibility(self.vis, newphasecentre, tangent=False, inplace=True)
+        assert get_row_index(self.vis, 'w') is None
+        assert get_row_index(self.vis, 'time') is not None
+        indexed = list(vis_wstack_iter(self.vis, wstack=10.0))
+        self.vis.row_index = None
+        expected = list(vis_wstack_iter(self.vis, wstack=10.0))
+        assert len(indexed) == len(expected)
+        for rows, expectedrows in zip(indexed, expected):
+            if expectedrows is None:
+                assert rows is None
+            else:
+                numpy.testing.assert_array_equal(rows, expectedrows)
+
     def test_vis_wstack_iterator_vis_slices(self):
         self.actualSetUp()
         nchunks = len(list(vis_wstack_iter(self.vis, vis_slices=11)))
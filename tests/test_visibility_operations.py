@@ -3,18 +3,25 @@
 
 """
 
+import mmap
+import tempfile
 import unittest
 
+from astropy import constants
 from numpy.testing import assert_allclose
 
+from arl.data.persist import arl_dump_visibility, arl_load_visibility
 from arl.data.polarisation import PolarisationFrame
 from arl.fourier_transforms.ftprocessor import *
+from arl.util.coordinate_support import xyz_to_uvw
 from arl.util.testing_support import create_named_configuration
 
 from arl.visibility.coalesce import convert_blockvisibility_to_visibility
+from arl.visibility.iterators import vis_timeslice_iter
+import arl.visibility.operations
 
 from arl.visibility.operations import create_blockvisibility, create_visibility, append_visibility, qa_visibility, \
-    sum_visibility
+    sum_visibility, convert_blockvisibility_layout, create_derived_visibility
 
 
 class TestVisibilityOperations(unittest.TestCase):
@@ -43,6 +50,69 @@ class TestVisibilityOperations(unittest.TestCase):
         assert self.vis.nvis == len(self.vis.time)
         assert self.vis.nvis == len(self.vis.frequency)
 
+    def test_create_visibility_reference(self):
+        # Compare with the rows made one at a time, as create_visibility did before it was vectorised
+        config = Configuration(name='reference', xyz=self.lowcore.xyz[:6], names='A%d', mount='xy', diameter=35.0)
+        times = (numpy.pi / 43200.0) * numpy.array([0.0, 100.0, 200.0])
+        frequency = numpy.array([1.0e8, 1.1e8])
+        channel_bandwidth = numpy.array([1e6, 2e6])
+        uvw, time, freq, bandwidth, antenna1, antenna2 = [], [], [], [], [], []
+        for ha in times:
+            ant_pos = xyz_to_uvw(config.xyz, ha, self.phasecentre.dec.rad)
+            for a1 in range(6):
+                for a2 in range(a1 + 1, 6):
+                    for ch in range(2):
+                        uvw.append((ant_pos[a2] - ant_pos[a1]) * frequency[ch] / constants.c.value)
+                        time.append(ha * 43200.0 / numpy.pi)
+                        freq.append(frequency[ch])
+                        bandwidth.append(channel_bandwidth[ch])
+                        antenna1.append(a1)
+                        antenna2.append(a2)
+        
+        # The default and then two integrations, one integration and one row at a time
+        chunksize = arl.visibility.operations.create_visibility_chunksize
+        try:
+            for arl.visibility.operations.create_visibility_chunksize in [chunksize, 60, 30, 1]:
+                vis = create_visibility(config, times, frequency, channel_bandwidth=channel_bandwidth,
+                                        phasecentre=self.phasecentre, weight=2.0, integration_time=10.0,
+                                        polarisation_frame=PolarisationFrame("linear"))
+                assert_allclose(vis.uvw, uvw, rtol=1e-15)
+                assert numpy.array_equal(vis.time, time)
+                assert numpy.array_equal(vis.frequency, freq)
+                assert numpy.array_equal(vis.channel_bandwidth, bandwidth)
+                assert numpy.array_equal(vis.antenna1, antenna1)
+                assert numpy.array_equal(vis.antenna2, antenna2)
+                assert numpy.array_equal(vis.weight, numpy.full([90, 4], 2.0))
+                assert numpy.array_equal(vis.integration_time, numpy.full([90], 10.0))
+                assert numpy.array_equal(vis.vis, numpy.zeros([90, 4]))
+        finally:
+            arl.visibility.operations.create_visibility_chunksize = chunksize
+    
+    def test_create_blockvisibility_reference(self):
+        # Compare with the uvw made one baseline at a time, as create_blockvisibility did before
+        config = Configuration(name='reference', xyz=self.lowcore.xyz[:6], names='A%d', mount='xy', diameter=35.0)
+        times = (numpy.pi / 43200.0) * numpy.array([0.0, 100.0, 200.0])
+        frequency = numpy.array([1.0e8, 1.1e8])
+        uvw = numpy.zeros([3, 6, 6, 3])
+        for iha, ha in enumerate(times):
+            ant_pos = xyz_to_uvw(config.xyz, ha, self.phasecentre.dec.rad)
+            for a1 in range(6):
+                for a2 in range(a1 + 1, 6):
+                    uvw[iha, a2, a1] = ant_pos[a2] - ant_pos[a1]
+                    uvw[iha, a1, a2] = ant_pos[a1] - ant_pos[a2]
+        for compact in [False, True]:
+            vis = create_blockvisibility(config, times, frequency, phasecentre=self.phasecentre, weight=2.0,
+                                         integration_time=10.0, channel_bandwidth=1e6, compact=compact,
+                                         polarisation_frame=PolarisationFrame("linear"))
+            assert_allclose(vis.uvw, uvw, rtol=1e-15)
+            assert numpy.array_equal(vis.time, times * 43200.0 / numpy.pi)
+            assert numpy.array_equal(vis.frequency, frequency)
+            assert numpy.array_equal(vis.channel_bandwidth, [1e6, 1e6])
+            assert numpy.array_equal(vis.integration_time, [10.0, 10.0, 10.0])
+            assert numpy.array_equal(vis.blweight, numpy.full([3, 15, 2, 4], 2.0))
+            if not compact:
+                assert numpy.array_equal(vis.weight, numpy.full([3, 6, 6, 2, 4], 2.0))
+    
     def test_create_visibility_polarisation(self):
         self.vis = create_visibility(self.lowcore, self.times, self.frequency,
                                      channel_bandwidth=self.channel_bandwidth,
@@ -59,6 +129,20 @@ class TestVisibilityOperations(unittest.TestCase):
         for makecopy in [True, False]:
             selected_vis = create_visibility_from_rows(self.vis, rows, makecopy=makecopy)
             assert selected_vis.nvis == numpy.sum(numpy.array(rows))
+    
+    def test_visibility_row(self):
+        self.vis = create_visibility(self.lowcore, self.times, self.frequency, phasecentre=self.phasecentre,
+                                     weight=1.0, channel_bandwidth=self.channel_bandwidth)
+        selected_vis = create_visibility_from_rows(self.vis, range(0, 5))
+        row = self.vis.data[3]
+        assert_allclose(row['uvw'], self.vis.uvw[3])
+        row['vis'] = 2.0
+        self.vis.data[-1]['vis'] = 3.0
+        assert self.vis.vis[3, 0] == 2.0
+        assert self.vis.vis[-1, 0] == 3.0
+        assert numpy.all(selected_vis.vis == 0.0)
+        assert not self.vis.uvw.flags.writeable
+        assert len(list(self.vis.data)) == self.vis.nvis
             
     def test_create_visibility(self):
         self.vis = create_visibility(self.lowcore, self.times, self.frequency, phasecentre=self.phasecentre,
@@ -72,6 +156,21 @@ class TestVisibilityOperations(unittest.TestCase):
         assert vis.nvis == len(vis.time)
         assert numpy.unique(vis.time).size == self.vis.time.size
 
+    def test_create_blockvisibility_compact(self):
+        self.vis = create_blockvisibility(self.lowcore, self.times, self.frequency, phasecentre=self.phasecentre,
+                                          weight=1.0, channel_bandwidth=self.channel_bandwidth)
+        compactvis = create_blockvisibility(self.lowcore, self.times, self.frequency, phasecentre=self.phasecentre,
+                                            weight=1.0, channel_bandwidth=self.channel_bandwidth, compact=True)
+        assert compactvis.compact and not self.vis.compact
+        assert compactvis.nants == self.vis.nants
+        assert compactvis.vis.shape == self.vis.vis.shape
+        assert compactvis.size() < 0.5 * self.vis.size()
+        assert_allclose(compactvis.bluvw, self.vis.bluvw)
+        assert_allclose(compactvis.uvw, self.vis.uvw)
+        assert_allclose(convert_blockvisibility_layout(self.vis).data['uvw'], compactvis.data['uvw'])
+        vis = convert_blockvisibility_to_visibility(compactvis)
+        assert_allclose(vis.uvw, convert_blockvisibility_to_visibility(self.vis).uvw)
+
     def test_create_visibility_from_rows(self):
         self.vis = create_visibility(self.lowcore, self.times, self.frequency, phasecentre=self.phasecentre,
                                           weight=1.0, channel_bandwidth=self.channel_bandwidth)
@@ -80,6 +179,29 @@ class TestVisibilityOperations(unittest.TestCase):
             selected_vis = create_visibility_from_rows(self.vis, rows, makecopy=makecopy)
             assert selected_vis.nvis == numpy.sum(numpy.array(rows))
 
+    def test_create_visibility_from_rows_copy_on_write(self):
+        self.vis = create_visibility(self.lowcore, self.times, self.frequency, phasecentre=self.phasecentre,
+                                     weight=1.0, channel_bandwidth=self.channel_bandwidth)
+        rows = range(10, 20)
+        selected_vis = create_visibility_from_rows(self.vis, rows)
+        assert numpy.may_share_memory(selected_vis.uvw, self.vis.uvw)
+        assert not selected_vis.uvw.flags.writeable
+        selected_vis.data['vis'][...] = 1.0
+        assert numpy.all(selected_vis.vis == 1.0)
+        assert numpy.all(self.vis.vis == 0.0)
+        assert not numpy.may_share_memory(selected_vis.vis, self.vis.vis)
+        assert_allclose(selected_vis.uvw, self.vis.uvw[10:20])
+        masked_vis = create_visibility_from_rows(self.vis, self.vis.time > 150.0)
+        assert_allclose(masked_vis.time, self.vis.time[self.vis.time > 150.0])
+        # Writes to the original after the selection do not show in it, for any type of selection
+        selections = [create_visibility_from_rows(self.vis, rows) for rows in [range(10, 20), [10, 12, 14],
+                                                                               self.vis.time > 150.0]]
+        nested_vis = create_visibility_from_rows(selections[0], range(2, 5))
+        uvw = numpy.array(self.vis.uvw)
+        self.vis.data['uvw'][...] = 0.0
+        for vis in selections:
+            assert numpy.any(vis.uvw != 0.0)
+        assert_allclose(nested_vis.uvw, uvw[12:15])
 
 
     def test_append_visibility(self):
@@ -94,6 +216,40 @@ class TestVisibilityOperations(unittest.TestCase):
             assert self.vis.nvis == len(self.vis.time)
             assert self.vis.nvis == len(self.vis.frequency)
 
+    def test_append_visibility_many(self):
+        self.vis = create_blockvisibility(self.lowcore, self.times[0:1], self.frequency,
+                                          channel_bandwidth=self.channel_bandwidth, phasecentre=self.phasecentre,
+                                          weight=1.0)
+        for i, time in enumerate(self.times[1:]):
+            othervis = create_blockvisibility(self.lowcore, numpy.array([time]), self.frequency,
+                                              channel_bandwidth=self.channel_bandwidth,
+                                              phasecentre=self.phasecentre, weight=1.0)
+            othervis.data['vis'][...] = i + 1
+            self.vis = append_visibility(self.vis, othervis)
+        assert_allclose(self.vis.time, self.times * 43200.0 / numpy.pi)
+        assert_allclose(self.vis.vis[:, 0, 0, 0, 0].real, numpy.arange(len(self.times)))
+        # The data are held in buffers with spare capacity
+        assert len(self.vis.data.buffers['vis']) >= len(self.times)
+
+    def test_visibility_memory_mapped(self):
+        self.vis = create_visibility(self.lowcore, self.times, self.frequency,
+                                     channel_bandwidth=self.channel_bandwidth, phasecentre=self.phasecentre,
+                                     weight=1.0, polarisation_frame=PolarisationFrame("stokesIQUV"))
+        self.vismodel = predict_skycomponent_visibility(self.vis, self.comp)
+        with tempfile.TemporaryDirectory() as directory:
+            arl_dump_visibility(self.vismodel, directory)
+            vis = arl_load_visibility(directory)
+            base = vis.data.column('vis')
+            while base is not None and not isinstance(base, mmap.mmap):
+                base = base.base
+            assert base is not None
+            assert_allclose(vis.vis, self.vismodel.vis)
+            for rows in vis_timeslice_iter(vis):
+                visslice = create_visibility_from_rows(vis, rows)
+                assert_allclose(visslice.uvw, self.vismodel.uvw[rows])
+            vis.data['vis'][...] = 0.0
+            assert_allclose(arl_load_visibility(directory).vis, self.vismodel.vis)
+
     def test_copy_visibility(self):
         self.vis = create_visibility(self.lowcore, self.times, self.frequency,
                                      channel_bandwidth=self.channel_bandwidth, phasecentre=self.phasecentre, weight=1.0,
@@ -105,6 +261,57 @@ class TestVisibilityOperations(unittest.TestCase):
         assert (vis.data['vis'][0,0].real == 1.0)
         assert (self.vis.data['vis'][0,0].real == 0.0)
     
+    def test_create_derived_visibility(self):
+        self.vis = create_visibility(self.lowcore, self.times, self.frequency,
+                                     channel_bandwidth=self.channel_bandwidth, phasecentre=self.phasecentre, weight=1.0,
+                                     polarisation_frame=PolarisationFrame("stokesIQUV"))
+        self.vis.data['vis'][...] = 1.0
+        vis = create_derived_visibility(self.vis)
+        assert numpy.max(numpy.abs(vis.vis)) == 0.0
+        assert numpy.may_share_memory(vis.uvw, self.vis.uvw)
+        assert not numpy.may_share_memory(vis.vis, self.vis.vis)
+        vis.data['vis'][...] = 2.0
+        vis.data['imaging_weight'][...] = 3.0
+        assert numpy.max(self.vis.vis.real) == 1.0
+        assert numpy.max(self.vis.imaging_weight) == 1.0
+        vis = create_derived_visibility(self.vis, zero=False)
+        assert_allclose(vis.vis, self.vis.vis)
+    
+    def test_create_visibility_single_precision(self):
+        self.vis = create_visibility(self.lowcore, self.times, self.frequency,
+                                     channel_bandwidth=self.channel_bandwidth, phasecentre=self.phasecentre, weight=1.0,
+                                     polarisation_frame=PolarisationFrame("stokesIQUV"))
+        vis = create_visibility(self.lowcore, self.times, self.frequency,
+                                channel_bandwidth=self.channel_bandwidth, phasecentre=self.phasecentre, weight=1.0,
+                                polarisation_frame=PolarisationFrame("stokesIQUV"), precision='single',
+                                weight_per_row=True)
+        assert vis.vis.dtype == numpy.complex64
+        assert vis.data['weight'].shape == (vis.nvis, 1)
+        assert vis.weight.shape == self.vis.weight.shape
+        assert vis.size() < 0.6 * self.vis.size()
+        vis = predict_skycomponent_visibility(vis, self.comp)
+        self.vis = predict_skycomponent_visibility(self.vis, self.comp)
+        assert_allclose(vis.vis, self.vis.vis, rtol=1e-5)
+        weight = numpy.ones([vis.nvis, 4])
+        weight[:, 3] = 2.0
+        vis.data['weight'] = weight
+        assert_allclose(vis.weight, weight)
+    
+    def test_visibility_legacy_layout(self):
+        self.vis = create_visibility(self.lowcore, self.times, self.frequency,
+                                     channel_bandwidth=self.channel_bandwidth, phasecentre=self.phasecentre, weight=1.0,
+                                     polarisation_frame=PolarisationFrame("stokesIQUV"))
+        self.vismodel = predict_skycomponent_visibility(self.vis, self.comp)
+        assert self.vismodel.vis.dtype.isnative
+        assert self.vismodel.uvw.flags.c_contiguous
+        legacy = self.vismodel.data.to_structured()
+        assert legacy.dtype['vis'].base.byteorder == '>'
+        vis = Visibility(data=legacy, phasecentre=self.vismodel.phasecentre,
+                         polarisation_frame=self.vismodel.polarisation_frame)
+        assert_allclose(vis.vis, self.vismodel.vis)
+        assert_allclose(vis.uvw, self.vismodel.uvw)
+        assert vis.data.dtype.names == self.vismodel.data.dtype.names
+
     def test_visibilitysum(self):
         self.vis = create_visibility(self.lowcore, self.times, self.frequency,
                                      channel_bandwidth=self.channel_bandwidth, phasecentre=self.phasecentre, weight=1.0,
@@ -167,6 +374,19 @@ class TestVisibilityOperations(unittest.TestCase):
         assert_allclose(rotatedvis.uvw, original_uvw, rtol=1e-7)
         assert_allclose(rotatedvis.vis, original_vis, rtol=1e-7)
 
+    def test_phase_rotation_inplace(self):
+        self.vis = create_visibility(self.lowcore, self.times, self.frequency,
+                                     channel_bandwidth=self.channel_bandwidth,
+                                     phasecentre=self.phasecentre, weight=1.0,
+                                     polarisation_frame=PolarisationFrame("stokesIQUV"))
+        self.vismodel = predict_skycomponent_visibility(self.vis, self.comp)
+        rotatedvis = phaserotate_visibility(self.vismodel, newphasecentre=self.compabsdirection, tangent=False)
+        inplacevis = phaserotate_visibility(self.vismodel, newphasecentre=self.compabsdirection, tangent=False,
+                                            inplace=True)
+        assert inplacevis is self.vismodel
+        assert_allclose(inplacevis.vis, rotatedvis.vis, rtol=1e-7)
+        assert_allclose(inplacevis.uvw, rotatedvis.uvw, rtol=1e-7)
+
     def test_qa(self):
         self.vis = create_visibility(self.lowcore, self.times, self.frequency,
                                      channel_bandwidth=self.channel_bandwidth,
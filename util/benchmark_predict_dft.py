@@ -0,0 +1,100 @@
+""" Benchmark predict_2d_base and predict_dft to derive the constants used by predict_dft_cost
+
+Run from the top of the repository as
+
+    python -m util.benchmark_predict_dft
+
+Both predictions are timed for a range of visibility and image sizes and numbers of non-zero model pixels. The
+costs in predict_dft_cost are then fitted to the times by least squares:
+
+    fft time = predict_fft_overhead + predict_fft_pixel_cost * nplanes * npadded * log2(npadded)
+               + predict_degrid_sample_cost * nrows * npol
+    dft time = predict_dft_overhead + predict_dft_phasor_cost * nrows * nonzero
+
+and printed in the form used in arl/fourier_transforms/ftprocessor_base.py.
+"""
+
+import logging
+import time
+
+import numpy
+from astropy import units as u
+from astropy.coordinates import SkyCoord
+
+from arl.fourier_transforms.ftprocessor_base import predict_2d_base, predict_dft, create_image_from_visibility
+from arl.util.testing_support import create_named_configuration
+from arl.visibility.operations import create_visibility, copy_visibility
+
+log = logging.getLogger(__name__)
+
+
+def time_predict(predict, vis, model, repeats=3):
+    """ Best time of several predictions
+
+    :param predict: predict function
+    :param vis: Visibility (not changed)
+    :param model: model image
+    :param repeats: Number of predictions
+    :returns: Time in seconds
+    """
+    best = numpy.inf
+    for i in range(repeats):
+        predictvis = copy_visibility(vis)
+        start = time.time()
+        predict(predictvis, model)
+        best = min(best, time.time() - start)
+    return best
+
+
+def benchmark_predict_dft(cases, config='LOWBD2-CORE', padding=2, seed=1):
+    """ Fit the costs in predict_dft_cost to timings of predict_2d_base and predict_dft
+
+    :param cases: list of (number of times, npixel, number of non-zero pixels)
+    :param config: Name of the configuration
+    :param padding: Padding used by predict_2d_base
+    :param seed: Seed for the positions of the non-zero pixels
+    :returns: dict of cost name: value
+    """
+    rng = numpy.random.RandomState(seed)
+    configuration = create_named_configuration(config)
+    phasecentre = SkyCoord(ra=+15.0 * u.deg, dec=-35.0 * u.deg, frame='icrs', equinox=2000.0)
+
+    fft_times = []
+    dft_times = []
+    for ntimes, npixel, nonzero in cases:
+        times = numpy.linspace(-0.1, 0.1, ntimes)
+        vis = create_visibility(configuration, times, numpy.array([1e8]), channel_bandwidth=numpy.array([1e6]),
+                                phasecentre=phasecentre, weight=1.0)
+        model = create_image_from_visibility(vis, npixel=npixel, cellsize=0.0005, nchan=1)
+        model.data[0, 0, rng.randint(npixel // 4, 3 * npixel // 4, nonzero),
+                   rng.randint(npixel // 4, 3 * npixel // 4, nonzero)] = 1.0
+        nchan, npol, ny, nx = model.data.shape
+        nrows, vnpol = vis.data.column('vis').shape
+        npadded = int(round(padding * nx)) * int(round(padding * ny))
+        nonzero = numpy.count_nonzero(numpy.any(model.data != 0.0, axis=(0, 1)))
+
+        fft_time = time_predict(predict_2d_base, vis, model)
+        dft_time = time_predict(predict_dft, vis, model)
+        log.info("benchmark_predict_dft: %d rows, %d pixels, %d non-zero: fft %.4f s, dft %.4f s" %
+                 (nrows, npixel, nonzero, fft_time, dft_time))
+        fft_times.append([1.0, nchan * npol * npadded * numpy.log2(npadded), nrows * vnpol, fft_time])
+        dft_times.append([1.0, nrows * nonzero, dft_time])
+
+    fft_times = numpy.array(fft_times)
+    dft_times = numpy.array(dft_times)
+    fft_costs = numpy.linalg.lstsq(fft_times[:, :-1], fft_times[:, -1], rcond=None)[0]
+    dft_costs = numpy.linalg.lstsq(dft_times[:, :-1], dft_times[:, -1], rcond=None)[0]
+    return {'predict_fft_overhead': fft_costs[0],
+            'predict_fft_pixel_cost': fft_costs[1],
+            'predict_degrid_sample_cost': fft_costs[2],
+            'predict_dft_overhead': dft_costs[0],
+            'predict_dft_phasor_cost': dft_costs[1]}
+
+
+if __name__ == '__main__':
+    logging.basicConfig()
+    log.setLevel(logging.INFO)
+    cases = [(ntimes, npixel, nonzero) for ntimes in [1, 3] for npixel in [128, 256, 512]
+             for nonzero in [10, 100, 1000]]
+    for name, value in benchmark_predict_dft(cases).items():
+        print("%s = %.1g" % (name, value))